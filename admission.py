@@ -0,0 +1,180 @@
+#!/usr/bin/python
+# Copyright 2012 William Yu
+# wyu@ateneo.edu
+#
+# This file is part of POX.
+#
+# POX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# POX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with POX. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+PacketIn admission control.
+
+Runs in front of every other PacketIn listener (it registers with a
+high priority) and drops PacketIns that exceed a token bucket rate per
+switch or per switch port, so a flood on one switch cannot starve the
+others. Dropped PacketIns never reach the listeners behind it, nor the
+per-connection listeners (like of_switch_flow's Tutorial), since POX
+does not pass halted PacketIns on to the connection.
+
+Optionally, a source MAC whose port keeps exceeding its rate gets a
+temporary drop flow on the switch so its packets stop coming up at all.
+
+Command Line: ./pox.py samples.admission [--switch_rate=1000]
+                [--switch_burst=2000] [--port_rate=200] [--port_burst=400]
+                [--drop_flows] [--drop_timeout=5] samples.of_firewall
+"""
+
+import time
+
+from pox.core import core
+import pox.openflow.libopenflow_01 as of
+from pox.lib.revent import EventHalt
+from pox.lib.addresses import EthAddr
+from pox.lib.util import dpidToStr, str_to_bool
+from pox.lib.recoco import Timer
+
+log = core.getLogger()
+
+# Priority of our PacketIn listener; higher runs earlier
+ADMISSION_PRIORITY = 0x7fffffff
+
+
+class TokenBucket (object):
+  """
+  Allows 'rate' events per second with bursts of up to 'burst'.
+  """
+  __slots__ = ('rate', 'burst', 'tokens', 'last')
+
+  def __init__ (self, rate, burst, now = None):
+    self.rate = rate
+    self.burst = burst
+    self.tokens = burst
+    self.last = time.time() if now is None else now
+
+  def ready (self, now):
+    """
+    Refills the bucket up to 'now' and returns True if it has a token.
+    """
+    tokens = self.tokens + (now - self.last) * self.rate
+    if tokens > self.burst:
+      tokens = self.burst
+    self.last = now
+    self.tokens = tokens
+    return tokens >= 1
+
+  def take (self, now):
+    if not self.ready(now):
+      return False
+    self.tokens -= 1
+    return True
+
+
+class Admission (object):
+  """
+  Token buckets per dpid and per (dpid, in_port), with drop counters.
+  """
+  def __init__ (self, switch_rate = 1000, switch_burst = 2000,
+                port_rate = 200, port_burst = 400, drop_flows = False,
+                drop_timeout = 5):
+    self.switch_rate = switch_rate
+    self.switch_burst = switch_burst
+    self.port_rate = port_rate
+    self.port_burst = port_burst
+    self.drop_flows = drop_flows
+    self.drop_timeout = drop_timeout
+
+    self.switch_buckets = {}    # dpid -> TokenBucket
+    self.port_buckets = {}      # (dpid, port) -> TokenBucket
+    self.admitted = {}          # dpid -> count
+    self.dropped = {}           # (dpid, port) -> count
+    self._blocked = {}          # (dpid, port, mac) -> time blocked until
+    self._reported = {}         # (dpid, port) -> dropped count last logged
+
+    core.openflow.addListenerByName("PacketIn", self._handle_PacketIn,
+      priority = ADMISSION_PRIORITY)
+    core.openflow.addListenerByName("ConnectionDown",
+      self._handle_ConnectionDown)
+    Timer(10, self._report, recurring = True)
+
+  def _handle_ConnectionDown (self, event):
+    dpid = event.dpid
+    self.switch_buckets.pop(dpid, None)
+    for d in (self.port_buckets, self.dropped, self._reported,
+              self._blocked):
+      for key in [k for k in d if k[0] == dpid]:
+        del d[key]
+
+  def _handle_PacketIn (self, event):
+    now = time.time()
+    dpid = event.dpid
+    port = event.port
+
+    pb = self.port_buckets.get((dpid, port))
+    if pb is None:
+      pb = self.port_buckets[(dpid, port)] = TokenBucket(self.port_rate,
+        self.port_burst, now)
+    sb = self.switch_buckets.get(dpid)
+    if sb is None:
+      sb = self.switch_buckets[dpid] = TokenBucket(self.switch_rate,
+        self.switch_burst, now)
+    # A token is only taken when both have one, so a packet dropped for
+    # the switch's rate does not count against its port
+    port_ok = pb.ready(now)
+    if port_ok and sb.ready(now):
+      pb.tokens -= 1
+      sb.tokens -= 1
+      self.admitted[dpid] = self.admitted.get(dpid, 0) + 1
+      return
+    if not port_ok and self.drop_flows:
+      # This port is over its own rate, so block the source
+      self._block(event, now)
+
+    self.dropped[(dpid, port)] = self.dropped.get((dpid, port), 0) + 1
+    return EventHalt
+
+  def _block (self, event, now):
+    data = event.ofp.data
+    if data is None or len(data) < 12:
+      return
+    mac = data[6:12]
+    key = (event.dpid, event.port, mac)
+    if self._blocked.get(key, 0) > now:
+      return
+    self._blocked[key] = now + self.drop_timeout
+
+    msg = of.ofp_flow_mod()
+    msg.match.in_port = event.port
+    msg.match.dl_src = EthAddr(mac)
+    msg.hard_timeout = self.drop_timeout
+    event.connection.send(msg)
+    log.info("Blocking %s on %s.%i for %is", EthAddr(mac),
+      dpidToStr(event.dpid), event.port, self.drop_timeout)
+
+  def _report (self):
+    now = time.time()
+    for key in [k for k, until in self._blocked.items() if until <= now]:
+      del self._blocked[key]
+    for (dpid, port), count in self.dropped.items():
+      last = self._reported.get((dpid, port), 0)
+      if count > last:
+        log.warning("Dropped %i PacketIn(s) from %s.%i (%i in total)",
+          count - last, dpidToStr(dpid), port, count)
+        self._reported[(dpid, port)] = count
+
+
+def launch (switch_rate = 1000, switch_burst = 2000, port_rate = 200,
+            port_burst = 400, drop_flows = False, drop_timeout = 5):
+  core.register("admission", Admission(float(switch_rate),
+    float(switch_burst), float(port_rate), float(port_burst),
+    str_to_bool(drop_flows), int(drop_timeout)))
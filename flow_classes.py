@@ -0,0 +1,223 @@
+#!/usr/bin/python
+# Copyright 2012 William Yu
+# wyu@ateneo.edu
+#
+# This file is part of POX.
+#
+# POX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# POX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with POX. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Traffic classes for flow statistics.
+
+A traffic class selects flows by transport port (source or destination),
+IP prefix (source or destination), IP protocol and/or VLAN. A flow
+belongs to a class if it matches every criterion the class has. Flows
+can belong to any number of classes.
+
+The classes of a ClassifierSet are compiled into one lookup table per
+criterion that maps a value to a bitmask of the classes it satisfies.
+Classifying a flow is then a handful of dict lookups and ANDs, no
+matter how many classes there are. Flows with the same bitmask are
+summed together first and only the distinct bitmasks are spread over
+the classes at the end.
+
+  classes = ClassifierSet()
+  classes.add("web", ports=[80, 443])
+  classes.add("lan", prefixes=["192.168.1.0/24"], protocols=[6, 17])
+  totals = classes.classify(event.stats)   # {name: [bytes, packets, flows]}
+"""
+
+
+def _ip_to_int (ip):
+  if ip is None:
+    return None
+  if hasattr(ip, 'toUnsigned'):
+    return ip.toUnsigned()
+  if isinstance(ip, int):
+    return ip
+  a, b, c, d = [int(x) for x in str(ip).split('.')]
+  return (a << 24) | (b << 16) | (c << 8) | d
+
+def _parse_prefix (prefix):
+  """
+  Turns "a.b.c.d/n" (or an (address, bits) pair) into (network, bits).
+  """
+  if isinstance(prefix, tuple):
+    addr, bits = prefix
+  elif '/' in prefix:
+    addr, bits = prefix.split('/')
+  else:
+    addr, bits = prefix, 32
+  bits = int(bits)
+  mask = ((1 << bits) - 1) << (32 - bits)
+  return _ip_to_int(addr) & mask, bits
+
+
+class TrafficClass (object):
+  def __init__ (self, name, ports = None, prefixes = None,
+                protocols = None, vlans = None):
+    self.name = name
+    self.ports = set(ports) if ports is not None else None
+    self.prefixes = ([_parse_prefix(p) for p in prefixes]
+                     if prefixes is not None else None)
+    self.protocols = set(protocols) if protocols is not None else None
+    self.vlans = set(vlans) if vlans is not None else None
+
+  def __str__ (self):
+    parts = []
+    for attr in ('ports', 'prefixes', 'protocols', 'vlans'):
+      value = getattr(self, attr)
+      if value is not None:
+        parts.append("%s=%s" % (attr, sorted(value)))
+    return "%s(%s)" % (self.name, ", ".join(parts))
+
+
+class _Dimension (object):
+  """
+  Lookup table of one criterion: value -> bitmask of classes.
+  """
+  def __init__ (self):
+    self.any = 0          # classes that do not care about this criterion
+    self.values = {}
+
+  def add (self, bit, values):
+    if values is None:
+      self.any |= bit
+      return
+    for v in values:
+      self.values[v] = self.values.get(v, 0) | bit
+
+
+class ClassifierSet (object):
+  """
+  A set of named traffic classes.
+  """
+  def __init__ (self):
+    self.classes = []
+    self._compiled = False
+
+  def __len__ (self):
+    return len(self.classes)
+
+  def add (self, name, ports = None, prefixes = None, protocols = None,
+           vlans = None):
+    self.remove(name)
+    self.classes.append(TrafficClass(name, ports, prefixes, protocols,
+                                     vlans))
+    self._compiled = False
+
+  def remove (self, name):
+    before = len(self.classes)
+    self.classes = [c for c in self.classes if c.name != name]
+    if len(self.classes) != before:
+      self._compiled = False
+      return True
+    return False
+
+  def compile (self):
+    ports = _Dimension()
+    protocols = _Dimension()
+    vlans = _Dimension()
+    # Prefixes are grouped by length: bits -> {network: bitmask}
+    prefix_any = 0
+    prefixes = {}
+    for i, c in enumerate(self.classes):
+      bit = 1 << i
+      ports.add(bit, c.ports)
+      protocols.add(bit, c.protocols)
+      vlans.add(bit, c.vlans)
+      if c.prefixes is None:
+        prefix_any |= bit
+      else:
+        for net, bits in c.prefixes:
+          nets = prefixes.setdefault(bits, {})
+          nets[net] = nets.get(net, 0) | bit
+    self._ports = ports
+    self._protocols = protocols
+    self._vlans = vlans
+    self._prefix_any = prefix_any
+    self._prefixes = [(((1 << bits) - 1) << (32 - bits), nets)
+                      for bits, nets in sorted(prefixes.items())]
+    self._all = (1 << len(self.classes)) - 1
+    self._compiled = True
+
+  def _prefix_mask (self, ip):
+    if ip is None:
+      return 0
+    m = 0
+    for netmask, nets in self._prefixes:
+      m |= nets.get(ip & netmask, 0)
+    return m
+
+  def match_mask (self, match):
+    """
+    Returns the bitmask of the classes an ofp_match belongs to.
+    """
+    if not self._compiled:
+      self.compile()
+    m = self._all
+    pv = self._ports.values
+    m &= self._ports.any | pv.get(match.tp_src, 0) | pv.get(match.tp_dst, 0)
+    if not m: return 0
+    m &= self._protocols.any | self._protocols.values.get(match.nw_proto, 0)
+    if not m: return 0
+    m &= self._vlans.any | self._vlans.values.get(match.dl_vlan, 0)
+    if not m: return 0
+    if self._prefixes:
+      m &= (self._prefix_any |
+            self._prefix_mask(_ip_to_int(match.nw_src)) |
+            self._prefix_mask(_ip_to_int(match.nw_dst)))
+    return m
+
+  def classify (self, stats, byte_counts = None, packet_counts = None):
+    """
+    Sums the flows of a stats reply per class in one pass. Byte and
+    packet counts default to the counters of the flows; sequences
+    aligned with 'stats' (e.g. deltas) can be given instead. Returns
+    {class name: [bytes, packets, flows]} for every class.
+    """
+    if not self._compiled:
+      self.compile()
+    if byte_counts is None:
+      byte_counts = [f.byte_count for f in stats]
+    if packet_counts is None:
+      packet_counts = [f.packet_count for f in stats]
+
+    # Sum by bitmask first; there are far fewer distinct masks than flows
+    by_mask = {}
+    match_mask = self.match_mask
+    for f, b, p in zip(stats, byte_counts, packet_counts):
+      m = match_mask(f.match)
+      if not m:
+        continue
+      t = by_mask.get(m)
+      if t is None:
+        by_mask[m] = [b, p, 1]
+      else:
+        t[0] += b
+        t[1] += p
+        t[2] += 1
+
+    totals = dict((c.name, [0, 0, 0]) for c in self.classes)
+    for m, (b, p, n) in by_mask.items():
+      i = 0
+      while m:
+        if m & 1:
+          t = totals[self.classes[i].name]
+          t[0] += b
+          t[1] += p
+          t[2] += n
+        m >>= 1
+        i += 1
+    return totals
@@ -0,0 +1,293 @@
+#!/usr/bin/python
+# Copyright 2012 William Yu
+# wyu@ateneo.edu
+#
+# This file is part of POX.
+#
+# POX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# POX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with POX. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Flow ownership tracking.
+
+Every component that installs flows gets a FlowOwner. It tags the
+component's flow_mods with a cookie made of the component's ID (top 16
+bits) and a generation number (low 48 bits), and keeps a shadow index
+of the flows it installed on each switch. Since OpenFlow 1.0 cannot
+delete flows by cookie, the index is what lets a component remove just
+its own flows (or just those of an old generation) with DELETE_STRICT
+instead of wiping the whole table.
+
+  owner = FlowOwner(COOKIE_FIREWALL)
+  owner.send(connection, flow_mod)      # tags, records and sends
+  owner.delete(connection)              # removes only our flows
+  owner.new_generation()
+  owner.delete(connection, keep=owner.cookie)   # only older ones
+
+Entries are dropped from the index when their hard timeout passes, or,
+for flows with only an idle timeout, once no PacketIn has hit them (see
+duplicate()) for that long; a flow whose traffic never comes back to the
+controller may then outlive its entry. With track_removals, flows are
+also installed with OFPFF_SEND_FLOW_REM so that flows removed earlier
+(idle timeout, deletes by others) are dropped from the index as they
+go, at the cost of a FlowRemoved message per flow. Permanent flows stay
+in the index until they are deleted or the switch disconnects.
+
+The index also tells whether a flow_mod would be a duplicate: packets
+that were already in flight when a flow was sent still come up as
+PacketIns, and handlers would install the same flow again for each.
+
+  if owner.duplicate(connection, msg):
+    ...send just a packet_out...
+
+A flow counts as present for min(idle_timeout, hard_timeout) after it
+was sent, the time during which the switch cannot have expired it.
+"""
+
+import time
+
+from pox.core import core
+import pox.openflow.libopenflow_01 as of
+from pox.lib.recoco import Timer
+
+log = core.getLogger()
+
+# Component IDs (top 16 bits of the cookie)
+COOKIE_SW_TUTORIAL = 1
+COOKIE_SW_TUTORIAL_OO = 2
+COOKIE_SWITCH_FLOW = 3
+COOKIE_FIREWALL = 4
+COOKIE_PATH_SWITCH = 5
+COOKIE_ROUTER = 6
+COOKIE_STATE_SYNC = 7
+
+_GENERATION_MASK = (1 << 48) - 1
+
+def make_cookie (owner_id, generation = 0):
+  return (owner_id << 48) | (generation & _GENERATION_MASK)
+
+def cookie_owner (cookie):
+  return cookie >> 48
+
+def cookie_generation (cookie):
+  return cookie & _GENERATION_MASK
+
+def _present_until (msg, now):
+  """
+  Time until which a flow sent 'now' cannot have timed out, or None if
+  it may be gone right away.
+  """
+  timeouts = [t for t in (msg.idle_timeout, msg.hard_timeout) if t]
+  if not timeouts:
+    # Permanent flow
+    return float('inf')
+  return now + min(timeouts)
+
+def _pack_actions (msg):
+  return b''.join(a.pack() for a in msg.actions)
+
+
+class FlowOwner (object):
+  """
+  Tags, tracks and removes the flows of one component.
+  """
+  def __init__ (self, owner_id, track_removals = False):
+    self.owner_id = owner_id
+    self.generation = 0
+    self.track_removals = track_removals
+
+    # dpid -> {(packed match, priority):
+    #          (cookie, match, expires, present until, packed actions)}
+    self.flows = {}
+
+    # dpid -> number of flow_mods sent / suppressed as duplicates
+    self.sent = {}
+    self.suppressed = {}
+
+    core.openflow.addListenerByName("ConnectionDown",
+      self._handle_ConnectionDown)
+    if track_removals:
+      core.openflow.addListenerByName("FlowRemoved",
+        self._handle_FlowRemoved)
+    self._timer = Timer(30, self.expire, recurring=True)
+
+  @property
+  def cookie (self):
+    return make_cookie(self.owner_id, self.generation)
+
+  def new_generation (self):
+    """
+    Starts a new generation and returns its cookie.
+    """
+    self.generation += 1
+    return self.cookie
+
+  def owns (self, cookie):
+    return cookie_owner(cookie) == self.owner_id
+
+  def _expires (self, msg, now):
+    """
+    Time after which the index forgets a flow sent (or hit) 'now', or
+    None to keep it until it is deleted or reported removed.
+    """
+    if msg.hard_timeout:
+      return now + msg.hard_timeout
+    if msg.idle_timeout and not self.track_removals:
+      return now + msg.idle_timeout
+    return None
+
+  def tag (self, connection, msg, cookie = None):
+    """
+    Tags a flow_mod with our cookie (or the given one) and records it.
+    Other messages are left alone.
+    """
+    if not isinstance(msg, of.ofp_flow_mod):
+      return msg
+    if msg.command not in (of.OFPFC_ADD, of.OFPFC_MODIFY,
+                           of.OFPFC_MODIFY_STRICT):
+      return msg
+    msg.cookie = self.cookie if cookie is None else cookie
+    if self.track_removals:
+      msg.flags |= of.OFPFF_SEND_FLOW_REM
+    now = time.time()
+    present = _present_until(msg, now)
+    dpid = connection.dpid
+    flows = self.flows.get(dpid)
+    if flows is None:
+      flows = self.flows[dpid] = {}
+    flows[(msg.match.pack(), msg.priority)] = (msg.cookie, msg.match,
+      self._expires(msg, now), present, _pack_actions(msg))
+    self.sent[dpid] = self.sent.get(dpid, 0) + 1
+    return msg
+
+  def duplicate (self, connection, msg, cookie = None):
+    """
+    Returns True (and counts it) if the same flow -- match, priority,
+    actions and cookie -- was sent to the switch recently enough that it
+    must still be there.
+    """
+    flows = self.flows.get(connection.dpid)
+    if not flows:
+      return False
+    entry = flows.get((msg.match.pack(), msg.priority))
+    if entry is None:
+      return False
+    if entry[0] != (self.cookie if cookie is None else cookie):
+      return False
+    now = time.time()
+    if entry[3] is None or entry[3] <= now:
+      return False
+    if entry[4] != _pack_actions(msg):
+      return False
+    if not msg.hard_timeout and entry[2] is not None:
+      # Traffic still hits it, so its idle timeout starts over
+      key = (msg.match.pack(), msg.priority)
+      flows[key] = entry[:2] + (self._expires(msg, now),) + entry[3:]
+    dpid = connection.dpid
+    self.suppressed[dpid] = self.suppressed.get(dpid, 0) + 1
+    return True
+
+  def stats (self):
+    """
+    Returns {dpid: (flows tracked, flow_mods sent, duplicates suppressed)}.
+    """
+    return dict((dpid, (len(self.flows.get(dpid, ())), self.sent.get(dpid, 0),
+                        self.suppressed.get(dpid, 0)))
+                for dpid in set(self.flows) | set(self.sent))
+
+  def send (self, connection, msg, cookie = None):
+    connection.send(self.tag(connection, msg, cookie))
+
+  def installed (self, dpid, cookie = None):
+    """
+    Returns (match, priority, cookie) of the flows we have on a switch,
+    optionally only those with the given cookie.
+    """
+    now = time.time()
+    return [(match, key[1], c)
+            for key, (c, match, expires, _, _) in
+                self.flows.get(dpid, {}).items()
+            if (cookie is None or c == cookie)
+            and (expires is None or expires > now)]
+
+  def delete (self, connection, cookie = None, keep = None, send = None):
+    """
+    Removes our flows from a switch: all of them, those with 'cookie',
+    or all but those with 'keep'. Returns how many were removed.
+    'send' can replace connection.send (e.g. to batch the deletes).
+    """
+    if send is None:
+      send = connection.send
+    flows = self.flows.get(connection.dpid)
+    if not flows:
+      return 0
+    now = time.time()
+    count = 0
+    for key, (c, match, expires, _, _) in list(flows.items()):
+      if cookie is not None and c != cookie:
+        continue
+      if keep is not None and c == keep:
+        continue
+      del flows[key]
+      if expires is not None and expires <= now:
+        # Already gone from the switch
+        continue
+      send(of.ofp_flow_mod(match=match, priority=key[1],
+        command=of.OFPFC_DELETE_STRICT))
+      count += 1
+    return count
+
+  def remove (self, connection, match, priority = of.OFP_DEFAULT_PRIORITY,
+              send = None):
+    """
+    Removes one of our flows from a switch, if we have it there.
+    Returns True if a delete was sent.
+    """
+    flows = self.flows.get(connection.dpid)
+    if not flows:
+      return False
+    entry = flows.pop((match.pack(), priority), None)
+    if entry is None:
+      return False
+    if entry[2] is not None and entry[2] <= time.time():
+      return False
+    if send is None:
+      send = connection.send
+    send(of.ofp_flow_mod(match=match, priority=priority,
+      command=of.OFPFC_DELETE_STRICT))
+    return True
+
+  def forget (self, dpid):
+    """
+    Drops the index of a switch (e.g., after its table was wiped).
+    """
+    self.flows.pop(dpid, None)
+
+  def _handle_ConnectionDown (self, event):
+    self.forget(event.dpid)
+    self.sent.pop(event.dpid, None)
+    self.suppressed.pop(event.dpid, None)
+
+  def expire (self):
+    now = time.time()
+    for flows in self.flows.values():
+      for key in [k for k, v in flows.items()
+                  if v[2] is not None and v[2] <= now]:
+        del flows[key]
+
+  def _handle_FlowRemoved (self, event):
+    if not self.owns(event.ofp.cookie):
+      return
+    flows = self.flows.get(event.dpid)
+    if flows is not None:
+      flows.pop((event.ofp.match.pack(), event.ofp.priority), None)
@@ -22,9 +22,36 @@
 This is a demonstration file created to show how to obtain flow 
 and port statistics from OpenFlow 1.0-enabled switches. The flow
 statistics handler contains a summary of web-only traffic.
+
+Polls are spread over the polling interval instead of going out to
+every switch at once, and a switch is not polled again while its
+previous request is still outstanding (unless it timed out). Switches
+that answer slowly or have large flow tables are polled less often.
+
+Counters of each flow are compared with the previous poll to report
+byte/packet rates rather than cumulative totals (see FlowCounterStore).
+
+Rates are summed per traffic class. Only "web" (port 80) is defined at
+start; more classes can be added from the interactive prompt with:
+  AddClass (name, ports=None, prefixes=None, protocols=None, vlans=None)
+  DeleteClass (name)
+  ShowClasses ()
+
+Rates per switch, port and traffic class are kept as time series in
+'history' (see timeseries.py), e.g.:
+  history.query((dpid, 'class', 'web', 'bps'), start=time.time()-600)
+With --export=<file> the history is saved there every --export_interval
+seconds and loaded again on start.
+
+Command Line: ./pox.py samples.flow_stats [--interval=5] [--timeout=10]
+                [--max_interval=60]
 """
 
 # standard includes
+import heapq
+import logging
+import time
+from array import array
 from pox.core import core
 from pox.lib.util import dpidToStr
 import pox.openflow.libopenflow_01 as of
@@ -32,50 +59,381 @@ import pox.openflow.libopenflow_01 as of
 # include as part of the betta branch
 from pox.openflow.of_json import *
 
+from flow_classes import ClassifierSet
+from timeseries import TimeSeriesStore
+
 log = core.getLogger()
 
-# handler for timer function that sends the requests to all the
-# switches connected to the controller.
-def _timer_func ():
-  for connection in core.openflow._connections.values():
-    connection.send(of.ofp_stats_request(body=of.ofp_flow_stats_request()))
-    connection.send(of.ofp_stats_request(body=of.ofp_port_stats_request()))
-  log.debug("Sent %i flow/port stats request(s)", len(core.openflow._connections))
+# Poll state of a single switch
+class _SwitchPoll (object):
+  def __init__ (self, connection, interval, due):
+    self.connection = connection
+    self.interval = interval
+    self.due = due
+    self.flow_sent = None     # time the outstanding flow request was sent
+    self.port_sent = None     # time the outstanding port request was sent
+    self.latency = None       # smoothed reply latency
+    self.flow_count = 0       # flows in the last reply
+    self.skipped = 0          # polls skipped while busy
+    self.timeouts = 0
+
+class StatsCollector (object):
+  """
+  Schedules flow and port stats requests for all switches.
+
+  Each switch gets its own slot within the interval (derived from its
+  dpid) and is kept in a heap ordered by the time of its next poll, so
+  a tick only looks at the switches that are due.
+  """
+  # Replies should take no more than this fraction of the interval
+  LATENCY_SHARE = 0.1
+  # Flows per reply that a switch can have at the base interval
+  FLOWS_PER_INTERVAL = 10000
+
+  def __init__ (self, interval = 5, timeout = None, max_interval = None,
+                tick = 0.25):
+    from pox.lib.recoco import Timer
+    self.interval = interval
+    self.timeout = timeout if timeout is not None else 2 * interval
+    self.max_interval = (max_interval if max_interval is not None
+                         else 12 * interval)
+    self.switches = {}
+    self._heap = []
+    core.openflow.addListeners(self)
+    self._timer = Timer(tick, self._tick, recurring=True)
+
+  def _offset (self, dpid):
+    # Spread switches evenly (and deterministically) over the interval
+    return ((dpid * 2654435761) % 1000) / 1000.0 * self.interval
+
+  def _handle_ConnectionUp (self, event):
+    due = time.time() + self._offset(event.dpid)
+    sw = _SwitchPoll(event.connection, self.interval, due)
+    self.switches[event.dpid] = sw
+    heapq.heappush(self._heap, (due, event.dpid))
+
+  def _handle_ConnectionDown (self, event):
+    self.switches.pop(event.dpid, None)
+
+  def _tick (self):
+    now = time.time()
+    heap = self._heap
+    sent = 0
+    while heap and heap[0][0] <= now:
+      due, dpid = heapq.heappop(heap)
+      sw = self.switches.get(dpid)
+      if sw is None or sw.due != due:
+        # Switch went away or was rescheduled
+        continue
+      if self._poll(sw, now):
+        sent += 1
+      sw.due = now + sw.interval
+      heapq.heappush(heap, (sw.due, dpid))
+    if sent:
+      log.debug("Sent stats requests to %i switch(es)", sent)
+
+  def _poll (self, sw, now):
+    """
+    Sends requests to a switch unless it is still busy with the last
+    ones. Returns True if anything was sent.
+    """
+    for attr in ('flow_sent', 'port_sent'):
+      sent_at = getattr(sw, attr)
+      if sent_at is not None and now - sent_at > self.timeout:
+        sw.timeouts += 1
+        setattr(sw, attr, None)
+        log.warning("Stats request to %s timed out",
+          dpidToStr(sw.connection.dpid))
+    if sw.flow_sent is not None or sw.port_sent is not None:
+      sw.skipped += 1
+      return False
+    sw.connection.send(of.ofp_stats_request(body=of.ofp_flow_stats_request()))
+    sw.connection.send(of.ofp_stats_request(body=of.ofp_port_stats_request()))
+    sw.flow_sent = sw.port_sent = now
+    return True
+
+  def _adapt (self, sw):
+    """
+    Stretches the interval of switches that are slow to answer or have
+    large flow tables.
+    """
+    factor = 1.0
+    if sw.latency is not None:
+      factor = max(factor, sw.latency / (self.LATENCY_SHARE * self.interval))
+    factor = max(factor, sw.flow_count / float(self.FLOWS_PER_INTERVAL))
+    sw.interval = min(self.max_interval, self.interval * factor)
+
+  def _handle_FlowStatsReceived (self, event):
+    sw = self.switches.get(event.connection.dpid)
+    if sw is None or sw.flow_sent is None:
+      return
+    latency = time.time() - sw.flow_sent
+    sw.flow_sent = None
+    if sw.latency is None:
+      sw.latency = latency
+    else:
+      sw.latency = 0.8 * sw.latency + 0.2 * latency
+    sw.flow_count = len(event.stats)
+    self._adapt(sw)
+
+  def _handle_PortStatsReceived (self, event):
+    sw = self.switches.get(event.connection.dpid)
+    if sw is not None:
+      sw.port_sent = None
+
+class FlowCounterStore (object):
+  """
+  Flow counters of one switch, kept between polls to compute rates.
+
+  Flows are identified by (match, priority, cookie). Counters are kept
+  in columns (one array per field, one row per flow) so that a poll of
+  a large table does not allocate an object per flow. A flow whose
+  counters went down or whose duration went back was reinstalled (or
+  its switch reset), so its whole count is taken as the delta. Flows
+  missing from a poll have expired and their rows are reused.
+  """
+  def __init__ (self):
+    self.rows = {}                    # flow key -> row
+    self.keys = []                    # row -> flow key (None if free)
+    self.free = []
+    self.byte_count = array('d')      # counters as of the last poll
+    self.packet_count = array('d')
+    self.duration = array('d')
+    self.delta_bytes = array('d')     # change since the poll before
+    self.delta_packets = array('d')
+    self.seen = array('l')            # generation last seen in
+    self.generation = 0
+    self.last_poll = None
+    self.interval = None              # seconds between the last polls
+    self.total_bytes = 0              # sums of the last deltas
+    self.total_packets = 0
+    self.expired = 0                  # flows gone in the last poll
+
+  def __len__ (self):
+    return len(self.rows)
+
+  def _new_row (self, key):
+    if self.free:
+      row = self.free.pop()
+      self.keys[row] = key
+    else:
+      row = len(self.keys)
+      self.keys.append(key)
+      for column in (self.byte_count, self.packet_count, self.duration,
+                     self.delta_bytes, self.delta_packets):
+        column.append(0.0)
+      self.seen.append(0)
+    self.rows[key] = row
+    return row
+
+  def update (self, stats, now = None):
+    """
+    Takes in a flow stats reply. Returns the row of each entry of
+    'stats', in order.
+    """
+    if now is None: now = time.time()
+    self.generation += 1
+    gen = self.generation
+    rows = self.rows
+    byte_count = self.byte_count
+    packet_count = self.packet_count
+    duration = self.duration
+    delta_bytes = self.delta_bytes
+    delta_packets = self.delta_packets
+    seen = self.seen
+    total_bytes = total_packets = 0
+    result = array('l')
+
+    for f in stats:
+      key = (f.match.pack(), f.priority, f.cookie)
+      row = rows.get(key)
+      b = f.byte_count
+      p = f.packet_count
+      d = f.duration_sec + f.duration_nsec / 1e9
+      if row is None:
+        row = self._new_row(key)
+        db, dp = b, p
+      elif b < byte_count[row] or p < packet_count[row] or d < duration[row]:
+        # Reinstalled or reset; everything counted since is new
+        db, dp = b, p
+      else:
+        db = b - byte_count[row]
+        dp = p - packet_count[row]
+      byte_count[row] = b
+      packet_count[row] = p
+      duration[row] = d
+      delta_bytes[row] = db
+      delta_packets[row] = dp
+      seen[row] = gen
+      total_bytes += db
+      total_packets += dp
+      result.append(row)
+
+    # Anything not seen in this poll has expired
+    expired = 0
+    if len(rows) > len(result):
+      for row, key in enumerate(self.keys):
+        if key is not None and seen[row] != gen:
+          del rows[key]
+          self.keys[row] = None
+          self.free.append(row)
+          expired += 1
+    self.expired = expired
+
+    if self.last_poll is not None:
+      self.interval = now - self.last_poll
+    self.last_poll = now
+    self.total_bytes = total_bytes
+    self.total_packets = total_packets
+    return result
+
+  def bps (self, row = None):
+    """
+    Bits per second of a flow (or of the whole switch if no row is
+    given) over the last interval. None until two polls were seen.
+    """
+    if not self.interval:
+      return None
+    b = self.total_bytes if row is None else self.delta_bytes[row]
+    return b * 8 / self.interval
+
+  def pps (self, row = None):
+    if not self.interval:
+      return None
+    p = self.total_packets if row is None else self.delta_packets[row]
+    return p / self.interval
+
+# Flow counters of every switch (dpid -> FlowCounterStore)
+counters = {}
+
+# Traffic classes that flows are summed into
+classifiers = ClassifierSet()
+
+# Rate history: (dpid, 'switch', 'bps'), (dpid, 'port', port_no, 'rx_bps'),
+# (dpid, 'class', name, 'bps'), ... -> time series
+history = TimeSeriesStore()
+
+# Last port counters: (dpid, port_no) -> (time, rx_bytes, tx_bytes)
+_port_counters = {}
+
+# function to add (or replace) a traffic class
+def AddClass (name, ports=None, prefixes=None, protocols=None, vlans=None):
+  classifiers.add(name, ports, prefixes, protocols, vlans)
+  log.debug("Adding traffic class %s", name)
+
+# function to delete a traffic class
+def DeleteClass (name):
+  if not classifiers.remove(name):
+    log.error("Cannot find traffic class %s", name)
+
+# function to display the traffic classes
+def ShowClasses ():
+  for c in classifiers.classes:
+    log.info("Class %s defined", c)
+
+def _handle_ConnectionDown (event):
+  counters.pop(event.dpid, None)
+  for key in [k for k in _port_counters if k[0] == event.dpid]:
+    del _port_counters[key]
 
 # handler to display flow statistics received in JSON format
 # structure of event.stats is defined by ofp_flow_stats()
 def _handle_flowstats_received (event):
-  stats = flow_stats_to_list(event.stats)
-  log.debug("FlowStatsReceived from %s: %s", 
-    dpidToStr(event.connection.dpid), stats)
-
-  # Get number of bytes/packets in flows for web traffic only
-  web_bytes = 0
-  web_flows = 0
-  web_packet = 0
-  for f in event.stats:
-    if f.match.tp_dst == 80 or f.match.tp_src == 80:
-      web_bytes += f.byte_count
-      web_packet += f.packet_count
-      web_flows += 1
-  log.info("Web traffic from %s: %s bytes (%s packets) over %s flows", 
-    dpidToStr(event.connection.dpid), web_bytes, web_packet, web_flows)
+  dpid = event.connection.dpid
+  if log.isEnabledFor(logging.DEBUG):
+    stats = flow_stats_to_list(event.stats)
+    log.debug("FlowStatsReceived from %s: %s", dpidToStr(dpid), stats)
+
+  store = counters.get(dpid)
+  if store is None:
+    store = counters[dpid] = FlowCounterStore()
+  now = time.time()
+  rows = store.update(event.stats, now)
+  if store.interval is None:
+    # Rates need two polls
+    return
+  history.add((dpid, 'switch', 'bps'), now, store.bps())
+  history.add((dpid, 'switch', 'pps'), now, store.pps())
+
+  # Get number of bytes/packets in flows for each traffic class
+  delta_bytes = store.delta_bytes
+  delta_packets = store.delta_packets
+  totals = classifiers.classify(event.stats,
+    [delta_bytes[row] for row in rows], [delta_packets[row] for row in rows])
+  for name, (class_bytes, class_packets, class_flows) in totals.items():
+    history.add((dpid, 'class', name, 'bps'), now,
+      class_bytes * 8 / store.interval)
+    history.add((dpid, 'class', name, 'pps'), now,
+      class_packets / store.interval)
+    if not class_flows:
+      continue
+    log.info("%s traffic from %s: %.0f bps (%.1f pps) over %s flows",
+      name, dpidToStr(dpid), class_bytes * 8 / store.interval,
+      class_packets / store.interval, class_flows)
+  log.debug("All traffic from %s: %.0f bps (%.1f pps), %i flows expired",
+    dpidToStr(dpid), store.bps(), store.pps(), store.expired)
 
 # handler to display port statistics received in JSON format
 def _handle_portstats_received (event):
-  stats = flow_stats_to_list(event.stats)
-  log.debug("PortStatsReceived from %s: %s", 
-    dpidToStr(event.connection.dpid), stats)
-    
+  dpid = event.connection.dpid
+  if log.isEnabledFor(logging.DEBUG):
+    stats = flow_stats_to_list(event.stats)
+    log.debug("PortStatsReceived from %s: %s", dpidToStr(dpid), stats)
+
+  # Record the rate of each port since the last reply
+  now = time.time()
+  for p in event.stats:
+    key = (dpid, p.port_no)
+    last = _port_counters.get(key)
+    _port_counters[key] = (now, p.rx_bytes, p.tx_bytes)
+    if last is None or now <= last[0]:
+      continue
+    rx = p.rx_bytes - last[1]
+    tx = p.tx_bytes - last[2]
+    if rx < 0 or tx < 0:
+      # Counters were reset
+      continue
+    dt = now - last[0]
+    history.add((dpid, 'port', p.port_no, 'rx_bps'), now, rx * 8 / dt)
+    history.add((dpid, 'port', p.port_no, 'tx_bps'), now, tx * 8 / dt)
+
+# function to save the rate history
+def _export_history (path):
+  try:
+    history.save(path)
+  except Exception:
+    log.exception("Cannot save statistics history to %s", path)
+
 # main functiont to launch the module
-def launch ():
+def launch (interval = 5, timeout = None, max_interval = None,
+            export = None, export_interval = 60):
+  global history
   from pox.lib.recoco import Timer
+  import os
 
   # attach handsers to listners
   core.openflow.addListenerByName("FlowStatsReceived", 
     _handle_flowstats_received) 
   core.openflow.addListenerByName("PortStatsReceived", 
     _handle_portstats_received) 
+  core.openflow.addListenerByName("ConnectionDown",
+    _handle_ConnectionDown)
+
+  # web traffic is reported by default
+  AddClass("web", ports=[80])
+
+  # poll every switch every five seconds (by default)
+  interval = float(interval)
+  core.register("flow_stats", StatsCollector(interval,
+    float(timeout) if timeout is not None else None,
+    float(max_interval) if max_interval is not None else None))
 
-  # timer set to execute every five seconds
-  Timer(5, _timer_func, recurring=True)
+  # save the rate history periodically (and pick it up again on start)
+  if export:
+    if os.path.exists(export):
+      try:
+        history = TimeSeriesStore.load(export)
+      except Exception:
+        log.exception("Cannot load statistics history from %s", export)
+    Timer(float(export_interval), _export_history, args=[export],
+      recurring=True)
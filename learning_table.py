@@ -0,0 +1,398 @@
+#!/usr/bin/python
+# Copyright 2012 William Yu
+# wyu@ateneo.edu
+#
+# This file is part of POX.
+#
+# POX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# POX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with POX. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Bounded MAC learning tables for the switch tutorials.
+
+A LearningTable holds the MAC-to-port entries of a single switch. It
+has a maximum size (least recently seen entries are evicted first)
+and an idle timeout so entries age out together with the flows that
+were installed for them. LearningTables keeps one LearningTable per
+datapath ID so that a switch that disconnects can simply be dropped.
+MacPortTable is a compact, array-backed MAC-to-port map for very large
+tables; run this file directly for a memory/throughput benchmark.
+HostLocations keeps a MacPortTable per datapath ID.
+
+This module does not depend on POX so it can be reused anywhere.
+"""
+
+import struct
+import time
+from array import array
+from collections import OrderedDict
+
+# Defaults are aligned with the idle_timeout/hard_timeout (10s/30s) of
+# the flows installed by the tutorial switches: once a MAC has not been
+# seen for a full hard timeout, no flow for it can be left on the switch.
+DEFAULT_MAX_ENTRIES = 4096
+DEFAULT_IDLE_TIMEOUT = 30
+
+
+class LearningTable (object):
+  """
+  MAC-to-port table of one switch with size and idle-time eviction.
+  """
+  def __init__ (self, max_entries = DEFAULT_MAX_ENTRIES,
+                idle_timeout = DEFAULT_IDLE_TIMEOUT):
+    self.max_entries = max_entries
+    self.idle_timeout = idle_timeout
+
+    # mac -> (port, last seen), oldest entry first
+    self._entries = OrderedDict()
+
+  def __len__ (self):
+    return len(self._entries)
+
+  def __contains__ (self, mac):
+    return self.get(mac) is not None
+
+  def learn (self, mac, port, now = None):
+    """
+    Records that 'mac' was last seen on 'port'.
+    """
+    if now is None: now = time.time()
+    entries = self._entries
+    if mac in entries:
+      # Re-insert so that the entry moves to the most recent end
+      del entries[mac]
+    elif len(entries) >= self.max_entries:
+      entries.popitem(last = False)
+    entries[mac] = (port, now)
+
+  def get (self, mac, now = None):
+    """
+    Returns the port of 'mac' or None if unknown or expired.
+    """
+    entry = self._entries.get(mac)
+    if entry is None:
+      return None
+    if now is None: now = time.time()
+    if now - entry[1] > self.idle_timeout:
+      del self._entries[mac]
+      return None
+    return entry[0]
+
+  def forget (self, mac):
+    self._entries.pop(mac, None)
+
+  def expire (self, now = None):
+    """
+    Removes all idle entries and returns how many were removed.
+    """
+    if now is None: now = time.time()
+    entries = self._entries
+    count = 0
+    # Entries are ordered by last sighting, so we can stop at the first
+    # entry that is still fresh.
+    while entries:
+      mac, (port, seen) = next(iter(entries.items()))
+      if now - seen <= self.idle_timeout:
+        break
+      del entries[mac]
+      count += 1
+    return count
+
+  def items (self):
+    """
+    Returns (mac, port) pairs, oldest first.
+    """
+    return [(mac, e[0]) for mac, e in self._entries.items()]
+
+  def clear (self):
+    self._entries.clear()
+
+
+class LearningTables (object):
+  """
+  Holds a LearningTable for each datapath ID.
+  """
+  def __init__ (self, max_entries = DEFAULT_MAX_ENTRIES,
+                idle_timeout = DEFAULT_IDLE_TIMEOUT):
+    self.max_entries = max_entries
+    self.idle_timeout = idle_timeout
+    self._tables = {}
+
+  def __len__ (self):
+    return len(self._tables)
+
+  def __contains__ (self, dpid):
+    return dpid in self._tables
+
+  def table (self, dpid):
+    """
+    Returns the table of 'dpid', creating it if needed.
+    """
+    t = self._tables.get(dpid)
+    if t is None:
+      t = LearningTable(self.max_entries, self.idle_timeout)
+      self._tables[dpid] = t
+    return t
+
+  def remove (self, dpid):
+    """
+    Drops the table of a switch (e.g., when it disconnects).
+    """
+    return self._tables.pop(dpid, None)
+
+  def expire (self, now = None):
+    if now is None: now = time.time()
+    return sum(t.expire(now) for t in self._tables.values())
+
+  def dpids (self):
+    return list(self._tables.keys())
+
+  def clear (self):
+    self._tables.clear()
+
+
+# MAC addresses are stored as 48-bit integers in MacPortTable
+_mac_struct = struct.Struct('!HI')
+
+def mac_to_int (raw):
+  """
+  Converts a raw 6-byte MAC address (EthAddr.toRaw()) to an integer.
+  """
+  hi, lo = _mac_struct.unpack(raw)
+  return (hi << 32) | lo
+
+def int_to_mac (mac):
+  """
+  Converts an integer back to a raw 6-byte MAC address.
+  """
+  return _mac_struct.pack(mac >> 32, mac & 0xffffffff)
+
+# Integer MAC keys; Python 2 gives longs for values above sys.maxint
+try:
+  _INT_TYPES = (int, long)
+except NameError:
+  _INT_TYPES = (int,)
+
+# Array of 32-bit unsigned values ('I' is 32 bits on all the platforms
+# POX runs on, 'L' is 64 bits on some)
+_U32 = 'I' if array('I').itemsize >= 4 else 'L'
+
+# Markers in the high half of a key; real MACs only use 16 bits there.
+# (Python 2 arrays have no 64-bit typecode, hence the two halves.)
+_EMPTY = 0x10000
+_DELETED = 0x10001
+
+class MacPortTable (object):
+  """
+  Compact MAC-to-port map for switches that see many hosts.
+
+  MACs are kept as 48-bit integers in an open-addressed table, split
+  into parallel arrays of their high 16 and low 32 bits (as unsigned
+  32-bit values), with the ports in a third array of unsigned 16-bit
+  values, so an entry costs about 15 bytes instead of the ~150 bytes of
+  a dict keyed by MAC strings. Keys may be given as integers or raw
+  6-byte MACs.
+  """
+  def __init__ (self, capacity = 1024):
+    size = 8
+    while size < capacity * 2:
+      size <<= 1
+    self._alloc(size)
+
+  def _alloc (self, size):
+    self._mask = size - 1
+    self._hi = array(_U32, [_EMPTY]) * size
+    self._lo = array(_U32, [0]) * size
+    self._ports = array('H', [0]) * size
+    self._used = 0       # live and deleted slots
+    self._len = 0
+
+  def __len__ (self):
+    return self._len
+
+  def __contains__ (self, mac):
+    return self.get(mac) is not None
+
+  def _slot (self, key):
+    """
+    Returns the slot holding 'key', or the free slot where it belongs
+    (negated minus one) if it is not present.
+    """
+    his = self._hi
+    los = self._lo
+    hi = key >> 32
+    lo = key & 0xffffffff
+    mask = self._mask
+    i = int((key ^ (key >> 17)) & mask)
+    free = -1
+    while True:
+      h = his[i]
+      if h == hi and los[i] == lo:
+        return i
+      if h == _EMPTY:
+        return -1 - (i if free < 0 else free)
+      if h == _DELETED and free < 0:
+        free = i
+      i = (i + 1) & mask
+
+  def learn (self, mac, port):
+    if not isinstance(mac, _INT_TYPES):
+      mac = mac_to_int(mac)
+    i = self._slot(mac)
+    if i >= 0:
+      self._ports[i] = port
+      return
+    i = -1 - i
+    if self._hi[i] == _EMPTY:
+      self._used += 1
+    self._hi[i] = mac >> 32
+    self._lo[i] = mac & 0xffffffff
+    self._ports[i] = port
+    self._len += 1
+    if self._used * 3 > self._mask * 2:
+      self._resize()
+
+  __setitem__ = learn
+
+  def get (self, mac, default = None):
+    if not isinstance(mac, _INT_TYPES):
+      mac = mac_to_int(mac)
+    i = self._slot(mac)
+    if i < 0:
+      return default
+    return self._ports[i]
+
+  def __getitem__ (self, mac):
+    port = self.get(mac)
+    if port is None:
+      raise KeyError(mac)
+    return port
+
+  def forget (self, mac):
+    if not isinstance(mac, _INT_TYPES):
+      mac = mac_to_int(mac)
+    i = self._slot(mac)
+    if i >= 0:
+      self._hi[i] = _DELETED
+      self._len -= 1
+
+  def items (self):
+    return [((h << 32) | l, p)
+            for h, l, p in zip(self._hi, self._lo, self._ports)
+            if not h & _EMPTY]
+
+  def _resize (self):
+    items = self.items()
+    size = self._mask + 1
+    if self._len * 3 > size:
+      size <<= 1
+    self._alloc(size)
+    for k, p in items:
+      self.learn(k, p)
+
+  def memory (self):
+    """
+    Returns the bytes used by the arrays.
+    """
+    return (self._hi.itemsize * len(self._hi) +
+            self._lo.itemsize * len(self._lo) +
+            self._ports.itemsize * len(self._ports))
+
+
+class HostLocations (object):
+  """
+  Where hosts were last seen: a MacPortTable for each datapath ID.
+  """
+  def __init__ (self):
+    self._tables = {}
+
+  def __len__ (self):
+    return sum(len(t) for t in self._tables.values())
+
+  def table (self, dpid):
+    """
+    Returns the table of 'dpid', creating it if needed.
+    """
+    t = self._tables.get(dpid)
+    if t is None:
+      t = self._tables[dpid] = MacPortTable()
+    return t
+
+  def dpids (self):
+    return list(self._tables.keys())
+
+
+def _benchmark (sizes = (10000, 100000, 1000000)):
+  """
+  Compares a dict keyed by MAC strings (as of_switch_flow used) with
+  MacPortTable, for memory and lookup throughput.
+  """
+  import os
+  import random
+  import sys
+  try:
+    import tracemalloc
+  except ImportError:
+    tracemalloc = None
+
+  def measure (build):
+    if tracemalloc is None:
+      return build(), float('nan')
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    t = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return t, (after - before) / 1048576.0
+
+  def mac_str (raw):
+    # Same work as str(EthAddr)
+    return ':'.join('%02x' % (c,) for c in bytearray(raw))
+
+  for n in sizes:
+    raws = [os.urandom(6) for _ in range(n)]
+    ports = [random.randint(1, 48) for _ in range(n)]
+    probes = [raws[i] for i in random.sample(range(n), min(n, 100000))]
+
+    def build_dict ():
+      d = {}
+      for r, p in zip(raws, ports):
+        d[mac_str(r)] = p
+      return d
+
+    def build_table ():
+      t = MacPortTable(n)
+      for r, p in zip(raws, ports):
+        t.learn(r, p)
+      return t
+
+    d, dict_mb = measure(build_dict)
+    t, table_mb = measure(build_table)
+
+    # Per-packet lookups, including turning the MAC into a key
+    start = time.time()
+    for r in probes:
+      d.get(mac_str(r))
+    dict_rate = len(probes) / (time.time() - start)
+    start = time.time()
+    for r in probes:
+      t.get(r)
+    table_rate = len(probes) / (time.time() - start)
+
+    sys.stdout.write("%8i MACs: dict[str] %7.1f MB %9.0f lookups/s | "
+      "MacPortTable %7.1f MB %9.0f lookups/s\n" %
+      (n, dict_mb, dict_rate, table_mb, table_rate))
+
+
+if __name__ == '__main__':
+  _benchmark()
@@ -0,0 +1,150 @@
+#!/usr/bin/python
+# Copyright 2012 William Yu
+# wyu@ateneo.edu
+#
+# This file is part of POX.
+#
+# POX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# POX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with POX. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Outbound OpenFlow message batching.
+
+A MessageBatcher collects the flow_mods and packet_outs a component
+sends to one switch and writes them to the connection in a single
+send() once the current event has been handled (or after at most
+'max_delay' seconds). A barrier request can be appended to each batch.
+Batchers keeps one MessageBatcher per connected switch.
+
+Usage:
+  batchers = Batchers()
+  batchers.send(event.connection, msg)   # instead of connection.send()
+  batchers.flush()                       # force everything out now
+"""
+
+from pox.core import core
+import pox.openflow.libopenflow_01 as of
+from pox.lib.recoco import Timer
+
+log = core.getLogger()
+
+
+class MessageBatcher (object):
+  """
+  Batches the messages sent to a single connection.
+  """
+  def __init__ (self, connection, max_delay = 0, max_messages = 64,
+                barrier = False):
+    self.connection = connection
+    self.max_delay = max_delay
+    self.max_messages = max_messages
+    self.barrier = barrier
+
+    self._pending = []
+    self._scheduled = False
+
+    # Statistics
+    self.messages = 0
+    self.writes = 0
+
+  def __len__ (self):
+    return len(self._pending)
+
+  def send (self, msg):
+    """
+    Queues a message (or already packed bytes) for the switch.
+    """
+    if not isinstance(msg, bytes):
+      msg = msg.pack()
+    self._pending.append(msg)
+    if len(self._pending) >= self.max_messages:
+      self.flush()
+    elif not self._scheduled:
+      self._scheduled = True
+      if self.max_delay > 0:
+        Timer(self.max_delay, self._scheduled_flush)
+      else:
+        # Runs after the event we are in (and those queued with it)
+        core.callLater(self._scheduled_flush)
+
+  def _scheduled_flush (self):
+    if self._scheduled:
+      self.flush()
+
+  def flush (self):
+    """
+    Writes out all queued messages.
+    """
+    self._scheduled = False
+    if not self._pending:
+      return
+    pending = self._pending
+    self._pending = []
+    if self.barrier:
+      pending.append(of.ofp_barrier_request().pack())
+    self.messages += len(pending)
+    self.writes += 1
+    self.connection.send(b''.join(pending))
+
+  def discard (self):
+    self._pending = []
+    self._scheduled = False
+
+
+class Batchers (object):
+  """
+  Holds a MessageBatcher for every connected switch.
+  """
+  def __init__ (self, max_delay = 0, max_messages = 64, barrier = False):
+    self.max_delay = max_delay
+    self.max_messages = max_messages
+    self.barrier = barrier
+    self._batchers = {}
+    core.openflow.addListenerByName("ConnectionDown",
+      self._handle_ConnectionDown)
+
+  def _handle_ConnectionDown (self, event):
+    b = self._batchers.pop(event.connection, None)
+    if b is not None:
+      b.discard()
+
+  def batcher (self, connection):
+    b = self._batchers.get(connection)
+    if b is None:
+      b = MessageBatcher(connection, self.max_delay, self.max_messages,
+                         self.barrier)
+      self._batchers[connection] = b
+    return b
+
+  def send (self, connection, msg):
+    self.batcher(connection).send(msg)
+
+  def flush (self, connection = None):
+    """
+    Flushes one connection, or all of them if none is given.
+    """
+    if connection is not None:
+      b = self._batchers.get(connection)
+      if b is not None:
+        b.flush()
+      return
+    for b in list(self._batchers.values()):
+      b.flush()
+
+  def stats (self):
+    """
+    Returns (messages, writes) summed over all switches.
+    """
+    messages = sum(b.messages for b in self._batchers.values())
+    writes = sum(b.writes for b in self._batchers.values())
+    return messages, writes
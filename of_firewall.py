@@ -21,84 +21,460 @@
 # purposes. This firewall is bad because only flows for valid packets are
 # installed. Non-matches always trigger a PacketIn().
 #
+# Two quieter modes can be selected with --mode:
+#   drop       a denied packet installs a short-lived drop flow for its
+#              (dl_type, nw_proto, port, src_port) so the rest of the flow
+#              is dropped by the switch.
+#   proactive  the whole rule set is pushed to the switch on ConnectionUp
+#              (and whenever it changes): allowed traffic is sent to the
+#              controller for learning, denied traffic is dropped by the
+#              switch. Rules with large port ranges that cannot be
+#              expanded into flows are still checked by the controller.
+#
 # This is a demonstration file aims to build a firewall. In this demo, 
 # firewall rules are applied to specific ports in the switch using the
 # following commands:
-#   AddRule (event, dl_type=0x800, nw_proto=1, port=0, src_port=of.OFPP_ALL)
+#   AddRule (event, dl_type=0x800, nw_proto=1, port=0, src_port=of.OFPP_ALL,
+#            priority=0, allow=True)
 #   DeleteRule (event, dl_type=0x800, nw_proto=1, port=0, src_port=of.OFPP_ALL):
-#   ShowRule ()
+#   ShowRules ()
+# where 'event' may also be a connection or a dpid. Packets that match
+# no rule are denied.
+# With samples.state_store loaded, the rules of a switch are saved and
+# restored when it reconnects after a controller restart.
 #
 # Mininet Command Line: sudo mn --topo single,3 --mac --switch ovsk --controller remote
 # Command Line: ./pox.py py log.level --DEBUG samples.of_firewall
+#               [--mode=noisy|drop|proactive] [--drop_timeout=10]
 #
 # THIS VERSION SUPPORT resend() functionality in the betta branch POX.
 #
 
+import ast
+import sys
+
 # These next two imports are common POX convention
 from pox.core import core
 from pox.lib.util import dpidToStr
 import pox.openflow.libopenflow_01 as of
 from pox.lib.packet.ethernet import ethernet
+from hotlog import HotLog, lazy
+from flow_owner import FlowOwner, COOKIE_FIREWALL
+from packet_out import packet_out
 
 # Even a simple usage of the logger is much nicer than print!
 log = core.getLogger()
 
+# Logging for the PacketIn path; costs next to nothing when DEBUG is off
+hot = HotLog(log)
+
 # This table maps (switch,MAC-addr) pairs to the port on 'switch' at
 # which we last saw a packet *from* 'MAC-addr'.
 # (In this case, we use a Connection object for the switch.)
 table = {}
 
-# This table contains the firewall rules:
-# firewall[(switch, dl_type, nw_proto, port, src_port)] = TRUE/FALSE
-# 
-# Our firewall only supports inbound rule enforcement per port only.
-# By default, this is empty.
+# Firewall rules are compiled into one RuleIndex per switch:
+# firewall[dpid] = RuleIndex
+#
+# Each rule matches on (dl_type, nw_proto, port, src_port) where 'port'
+# is the transport source port (ICMP type for ICMP), either a single
+# port, a (low, high) range or None for any port, and 'src_port' is the
+# switch port the packet came in on (of.OFPP_ALL for any port). dl_type
+# and nw_proto may also be None to match anything.
 #   Sample dl_type(s): IP (0x800)
 #   Sample nw_proto(s): ICMP (1), TCP (6), UDP (17)
 #
+# Packets that do not match any rule are denied. When several rules
+# match, the one with the highest priority wins; between rules of the
+# same priority, the one added first wins.
 firewall = {}
 
+# Firewall mode ('noisy', 'drop' or 'proactive') and the idle timeout of
+# the drop flows it installs. Set by launch().
+firewall_mode = 'noisy'
+drop_idle_timeout = 10
+
+# Tags the flows we install with our cookie and keeps track of them, so
+# rule changes only touch our own flows. Set by launch().
+owner = None
+
+# Flow priorities used in proactive mode. The rule set sits between the
+# default-deny flow and the learned forwarding flows, which use the
+# default priority (of.OFP_DEFAULT_PRIORITY). Those match on the in_port
+# the rules allowed, so they never let through what a rule denies on
+# another port.
+DENY_ALL_PRIORITY = 1
+RULE_PRIORITY_BASE = 0x100
+
+# Port ranges wider than this are not expanded into flows
+MAX_RANGE_FLOWS = 64
+
+class FirewallRule (object):
+  """
+  A single firewall rule.
+  """
+  def __init__ (self, dl_type, nw_proto, port, src_port, priority,
+                allow, seq):
+    self.dl_type = dl_type
+    self.nw_proto = nw_proto
+    self.port = port
+    self.src_port = src_port
+    self.priority = priority
+    self.allow = allow
+    # Sort key; lower sorts first and wins
+    self.rank = (-priority, seq)
+
+  @property
+  def key (self):
+    return (self.dl_type, self.nw_proto, self.port, self.src_port)
+
+  def __str__ (self):
+    return "%s %s %s %s priority=%s %s" % (self.dl_type, self.nw_proto,
+      self.port, self.src_port, self.priority,
+      "ALLOW" if self.allow else "DENY")
+
+def _better (a, b):
+  """
+  Returns the winning rule of two (either may be None).
+  """
+  if a is None: return b
+  if b is None: return a
+  return a if a.rank < b.rank else b
+
+class _RuleBucket (object):
+  """
+  Rules sharing the same (dl_type, nw_proto).
+
+  Single-port rules live in a dict keyed by (port, in_port) and rules
+  without a port in a dict keyed by in_port, so both are found with a
+  couple of hash lookups. Only port ranges need a scan; they are kept
+  in rank order so the scan stops at the first match.
+  """
+  def __init__ (self):
+    self.exact = {}
+    self.wild = {}
+    self.ranges = []
+
+  def __len__ (self):
+    return len(self.exact) + len(self.wild) + len(self.ranges)
+
+  def add (self, rule):
+    in_port = None if rule.src_port == of.OFPP_ALL else rule.src_port
+    if rule.port is None:
+      self.wild[in_port] = rule
+    elif isinstance(rule.port, tuple):
+      self.ranges.append(rule)
+      self.ranges.sort(key=lambda r: r.rank)
+    else:
+      self.exact[(rule.port, in_port)] = rule
+
+  def remove (self, rule):
+    in_port = None if rule.src_port == of.OFPP_ALL else rule.src_port
+    if rule.port is None:
+      del self.wild[in_port]
+    elif isinstance(rule.port, tuple):
+      self.ranges.remove(rule)
+    else:
+      del self.exact[(rule.port, in_port)]
+
+  def lookup (self, port, in_port):
+    exact = self.exact
+    wild = self.wild
+    best = _better(exact.get((port, in_port)), exact.get((port, None)))
+    best = _better(best, wild.get(in_port))
+    best = _better(best, wild.get(None))
+    for r in self.ranges:
+      if best is not None and best.rank < r.rank:
+        break
+      lo, hi = r.port
+      if lo <= port <= hi and (r.src_port == of.OFPP_ALL or
+                               r.src_port == in_port):
+        best = r
+        break
+    return best
+
+class RuleIndex (object):
+  """
+  Compiled firewall rules of one switch.
+
+  Rules are hashed into buckets by (dl_type, nw_proto) so a packet is
+  only checked against the (at most four) buckets that can match it.
+  Adding or deleting a rule only touches its own bucket.
+  """
+  def __init__ (self):
+    self.rules = {}
+    self.buckets = {}
+    self._seq = 0
+
+  def __len__ (self):
+    return len(self.rules)
+
+  def add (self, dl_type, nw_proto, port, src_port, priority = 0,
+           allow = True):
+    key = (dl_type, nw_proto, port, src_port)
+    if key in self.rules:
+      self.remove(*key)
+    self._seq += 1
+    rule = FirewallRule(dl_type, nw_proto, port, src_port, priority,
+                        allow, self._seq)
+    self.rules[key] = rule
+    bucket = self.buckets.get((dl_type, nw_proto))
+    if bucket is None:
+      bucket = self.buckets[(dl_type, nw_proto)] = _RuleBucket()
+    bucket.add(rule)
+    return rule
+
+  def remove (self, dl_type, nw_proto, port, src_port):
+    """
+    Removes a rule. Raises KeyError if there is no such rule.
+    """
+    rule = self.rules.pop((dl_type, nw_proto, port, src_port))
+    bucket = self.buckets[(dl_type, nw_proto)]
+    bucket.remove(rule)
+    if not bucket:
+      del self.buckets[(dl_type, nw_proto)]
+    return rule
+
+  def lookup (self, dl_type, nw_proto, port, in_port):
+    """
+    Returns the winning rule for a packet or None.
+    """
+    best = None
+    buckets = self.buckets
+    for bkey in ((dl_type, nw_proto), (dl_type, None), (None, nw_proto),
+                 (None, None)):
+      bucket = buckets.get(bkey)
+      if bucket is not None:
+        best = _better(best, bucket.lookup(port, in_port))
+    return best
+
+  def allows (self, dl_type, nw_proto, port, in_port):
+    """
+    True if the packet is allowed. Unmatched packets are denied.
+    """
+    rule = self.lookup(dl_type, nw_proto, port, in_port)
+    return rule is not None and rule.allow
+
+  def sorted_rules (self):
+    return sorted(self.rules.values(), key=lambda r: r.rank)
+
+# Rules are also saved in the state store (when it is loaded) under this
+# namespace, keyed by repr() of their (dl_type, nw_proto, port, src_port)
+# with repr() of (priority, allow, order added) as value.
+STATE_NS = 'of_firewall'
+
+def _save_rule (dpid, rule):
+  store = core.components.get('state_store')
+  if store is not None:
+    store.put(STATE_NS, dpid, repr(rule.key).encode('utf-8'),
+      repr((rule.priority, rule.allow, rule.rank[1])).encode('utf-8'))
+
+def _unsave_rule (dpid, key):
+  store = core.components.get('state_store')
+  if store is not None:
+    store.delete(STATE_NS, dpid, repr(key).encode('utf-8'))
+
+# Warm start: restores the rules a switch had before a restart
+def _restore_rules (dpid):
+  store = core.components.get('state_store')
+  if store is None or dpid in firewall:
+    return
+  rules = []
+  for key, value in store.get(STATE_NS, dpid).items():
+    key = ast.literal_eval(key.decode('utf-8'))
+    priority, allow, seq = ast.literal_eval(value.decode('utf-8'))
+    rules.append((seq, key, priority, allow))
+  if not rules:
+    return
+  index = firewall[dpid] = RuleIndex()
+  for seq, key, priority, allow in sorted(rules):
+    index.add(*key, priority = priority, allow = allow)
+  log.info("Restored %i firewall rule(s) of %s", len(rules),
+    dpidToStr(dpid))
+
+# Rules can be given for an event, a connection or a dpid
+def _dpid_of (target):
+  return getattr(target, 'dpid', target)
+
 # function that allows adding firewall rules into the firewall table
-def AddRule (event, dl_type=0x800, nw_proto=1, port=0, src_port=of.OFPP_ALL):
-  firewall[(event.connection,dl_type,nw_proto,port,src_port)]=True
-  log.debug("Adding firewall rule to %s: %s %s %s %s" %
-    dpidToStr(event.connection.dpid), dl_type, nw_proto, port, src_port)
+def AddRule (event, dl_type=0x800, nw_proto=1, port=0, src_port=of.OFPP_ALL,
+             priority=0, allow=True):
+  dpid = _dpid_of(event)
+  index = firewall.get(dpid)
+  if index is None:
+    index = firewall[dpid] = RuleIndex()
+  rule = index.add(dl_type, nw_proto, port, src_port, priority, allow)
+  _save_rule(dpid, rule)
+  hot.debug("Adding firewall rule to %s: %s %s %s %s",
+    dpidToStr(dpid), dl_type, nw_proto, port, src_port)
+  _rules_changed(dpid)
 
 # function that allows deleting firewall rules from the firewall table
 def DeleteRule (event, dl_type=0x800, nw_proto=1, port=0, src_port=of.OFPP_ALL):
+  dpid = _dpid_of(event)
   try:
-    del firewall[(event.connection,dl_type,nw_proto,port,src_port)]
-    log.debug("Deleting firewall rule in %s: %s %s %s %s" %
-      dpidToStr(event.connection.dpid), dl_type, nw_proto, port, src_port)
+    firewall[dpid].remove(dl_type, nw_proto, port, src_port)
+    _unsave_rule(dpid, (dl_type, nw_proto, port, src_port))
+    hot.debug("Deleting firewall rule in %s: %s %s %s %s",
+      dpidToStr(dpid), dl_type, nw_proto, port, src_port)
   except KeyError:
     log.error("Cannot find in %s: %s %s %s %s" %
-      dpidToStr(event.connection.dpid), dl_type, nw_proto, port, src_port)
+      (dpidToStr(dpid), dl_type, nw_proto, port, src_port))
+    return
+  _rules_changed(dpid)
 
 # function to display firewall rules
 def ShowRules ():
-  for key in firewall:
-    log.info("Rule %s defined" % key)
+  for dpid, index in firewall.items():
+    for rule in index.sorted_rules():
+      log.info("Rule %s defined in %s" % (rule, dpidToStr(dpid)))
+
+# IP protocols with a port (or, for ICMP, a type) that tp_src can match
+PORT_PROTOCOLS = (1, 6, 17)
+
+# Returns the matches needed to express a rule as flows, or None if
+# the rule has a port range that is too wide to expand. The switch
+# ignores tp_src unless dl_type is IP and nw_proto is set, so a rule
+# with a port but no protocol becomes one match per PORT_PROTOCOLS.
+def _rule_matches (rule):
+  if rule.port is None:
+    ports = [None]
+  elif isinstance(rule.port, tuple):
+    lo, hi = rule.port
+    ports = range(lo, hi + 1)
+  else:
+    ports = [rule.port]
+  dl_type = rule.dl_type
+  protos = [rule.nw_proto]
+  if rule.port is not None:
+    if dl_type is None:
+      dl_type = ethernet.IP_TYPE
+    elif dl_type != ethernet.IP_TYPE:
+      # Has no ports; only IP packets are checked anyway
+      return []
+    if rule.nw_proto is None:
+      protos = PORT_PROTOCOLS
+  if len(ports) * len(protos) > MAX_RANGE_FLOWS:
+    return None
+  matches = []
+  for proto in protos:
+    for port in ports:
+      match = of.ofp_match()
+      if dl_type is not None:
+        match.dl_type = dl_type
+      if proto is not None:
+        match.nw_proto = proto
+      if port is not None:
+        match.tp_src = port
+      if rule.src_port != of.OFPP_ALL:
+        match.in_port = rule.src_port
+      matches.append(match)
+  return matches
+
+# Pushes the rule set of a switch as flows. Rules are given decreasing
+# priorities in the same order the controller evaluates them. The flows
+# are installed as a new generation, and only then are the flows of the
+# previous generation removed, so the switch is never without rules.
+def _push_rules (connection):
+  cookie = owner.new_generation()
+
+  # Default deny for IP traffic
+  msg = of.ofp_flow_mod()
+  msg.match.dl_type = ethernet.IP_TYPE
+  msg.priority = DENY_ALL_PRIORITY
+  owner.send(connection, msg)
+
+  index = firewall.get(connection.dpid)
+  rules = index.sorted_rules() if index is not None else []
+  priority = RULE_PRIORITY_BASE + len(rules)
+  for rule in rules:
+    priority -= 1
+    matches = _rule_matches(rule)
+    if matches is None:
+      # Let the controller check this one
+      matches = _rule_matches(FirewallRule(rule.dl_type, rule.nw_proto,
+        None, rule.src_port, rule.priority, True, 0))
+      action = of.ofp_action_output(port = of.OFPP_CONTROLLER)
+    elif rule.allow:
+      action = of.ofp_action_output(port = of.OFPP_CONTROLLER)
+    else:
+      action = None
+    for match in matches:
+      msg = of.ofp_flow_mod(match=match, priority=priority)
+      if action is not None:
+        msg.actions.append(action)
+      owner.send(connection, msg)
+
+  # Stale rules and the forwarding flows learned under them
+  count = owner.delete(connection, keep = cookie)
+
+  hot.debug("Pushed %i firewall rule(s) to %s (%i old flows removed)",
+    len(rules), lazy(dpidToStr, connection.dpid), count)
+
+# Installs a drop flow for the tuple of a denied packet
+def _drop_flow (event, dl_type, nw_proto, tp_src):
+  msg = of.ofp_flow_mod()
+  msg.match.dl_type = dl_type
+  msg.match.nw_proto = nw_proto
+  msg.match.tp_src = tp_src
+  msg.match.in_port = event.port
+  msg.idle_timeout = drop_idle_timeout
+  msg.data = event.ofp
+  owner.send(event.connection, msg)
+
+# Makes the flows on a switch follow a change of its rules
+def _rules_changed (dpid):
+  if firewall_mode == 'noisy':
+    return
+  connection = core.openflow.getConnection(dpid)
+  if connection is None:
+    return
+  if firewall_mode == 'proactive':
+    _push_rules(connection)
+  else:
+    # Remove our stale drop and forwarding flows; they are re-learned
+    owner.delete(connection)
 
 # function to handle all housekeeping items when firewall starts
 def _handle_StartFirewall (event):
   log.info("Firewall Tutorial is running.")
+  _restore_rules(event.dpid)
+  if firewall_mode == 'proactive':
+    # Start from a clean slate; flows left over from an earlier run are
+    # not in our index
+    msg = of.ofp_flow_mod(command=of.OFPFC_DELETE)
+    msg.match.dl_type = ethernet.IP_TYPE
+    event.connection.send(msg)
+    _push_rules(event.connection)
 
 # function to handle all PacketIns from switch/router
 def _handle_PacketIn (event):
   packet = event.parsed
 
-  # only process Ethernet packets
+  # only process IP packets
   if packet.type != ethernet.IP_TYPE:
     return
+  ip = packet.payload
+
+  # the transport source port (or ICMP type) is checked against the rules
+  tp_src = getattr(ip.payload, 'srcport', None)
+  if tp_src is None:
+    tp_src = getattr(ip.payload, 'type', 0)
 
   # check if packet is compliant to rules before proceeding
-  if (firewall[(event.connection, packet.dl_type, packet.nw_proto, packet.tp_src, event.port)] == True):
-    log.debug("Rule (%s %s %s %s) FOUND in %s" %
-      dpidToStr(event.connection.dpid), packet.dl_type, packet.nw_proto, packet.tp_src, event.port)
+  index = firewall.get(event.dpid)
+  if index is not None and index.allows(packet.type, ip.protocol, tp_src,
+                                        event.port):
+    hot.debug("Rule (%s %s %s %s) FOUND in %s",
+      packet.type, ip.protocol, tp_src, event.port,
+      lazy(dpidToStr, event.dpid))
   else:
-    log.debug("Rule (%s %s %s %s) NOT FOUND in %s" %
-      dpidToStr(event.connection.dpid), packet.dl_type, packet.nw_proto, packet.tp_src, event.port)
-    return     
+    hot.debug("Rule (%s %s %s %s) NOT FOUND in %s",
+      packet.type, ip.protocol, tp_src, event.port,
+      lazy(dpidToStr, event.dpid))
+    if firewall_mode != 'noisy':
+      _drop_flow(event, packet.type, ip.protocol, tp_src)
+    return
 
   # Learn the source and fill up routing table
   table[(event.connection,packet.src)] = event.port
@@ -107,46 +483,63 @@ def _handle_PacketIn (event):
   if dst_port is None:
     # We don't know where the destination is yet. So, we'll just
     # send the packet out all ports (except the one it came in on!)
-    msg = of.ofp_packet_out(resend = event.ofp)
-    msg.actions.append(of.ofp_action_output(port = of.OFPP_ALL))
-    msg.send(event.connection)
+    msg = packet_out(event.dpid, event.ofp, of.OFPP_ALL)
+    if msg is not None:
+      event.connection.send(msg)
 
-    log.debug("Broadcasting %s.%i -> %s.%i" %
-      (packet.src, event.ofp.in_port, packet.dst, of.OFPP_ALL))
+    hot.debug("Broadcasting %s.%i -> %s.%i",
+      packet.src, event.ofp.in_port, packet.dst, of.OFPP_ALL)
   else:
     # Since we know the switch ports for both the source and dest
-    # MACs, we can install rules for both directions.
-    msg = of.ofp_flow_mod()
-    msg.match.dl_type = packet.dl_type
-    msg.match.nw_proto = packet.nw_proto
-    if (nw_proto != 1):
-      msg.match.tp_src = packet.tp_src
-    msg.match.dl_dst = packet.src
-    msg.match.dl_src = packet.dst
-    msg.idle_timeout = 10
-    msg.hard_timeout = 30
-    msg.actions.append(of.ofp_action_output(port = event.port))
-    msg.send(event.connection)
-    
+    # MACs, we can install rules for both directions (if the rules
+    # allow the way back too).
+    if index.allows(packet.type, ip.protocol, tp_src, dst_port):
+      msg = of.ofp_flow_mod()
+      msg.match.dl_type = packet.type
+      msg.match.nw_proto = ip.protocol
+      if (ip.protocol != 1):
+        msg.match.tp_src = tp_src
+      msg.match.in_port = dst_port
+      msg.match.dl_dst = packet.src
+      msg.match.dl_src = packet.dst
+      msg.idle_timeout = 10
+      msg.hard_timeout = 30
+      msg.actions.append(of.ofp_action_output(port = event.port))
+      owner.tag(event.connection, msg)
+      msg.send(event.connection)
+
     # This is the packet that just came in -- we want to
     # install the rule and also resend the packet.
     msg = of.ofp_flow_mod()
-    msg.match.dl_type = packet.dl_type
-    msg.match.nw_proto = packet.nw_proto
-    if (nw_proto != 1):
-      msg.match.tp_src = packet.tp_src
+    msg.match.dl_type = packet.type
+    msg.match.nw_proto = ip.protocol
+    if (ip.protocol != 1):
+      msg.match.tp_src = tp_src
+    msg.match.in_port = event.port
     msg.match.dl_src = packet.src
     msg.match.dl_dst = packet.dst
     msg.idle_timeout = 10
     msg.hard_timeout = 30
     msg.actions.append(of.ofp_action_output(port = dst_port))
+    owner.tag(event.connection, msg)
     msg.send(event.connection, resend = event.ofp)
 
-    log.debug("Installing %s.%i -> %s.%i AND %s.%i -> %s.%i" %
-      (packet.dst, dst_port, packet.src, event.ofp.in_port,
-      packet.src, event.ofp.in_port, packet.dst, dst_port))
+    hot.debug("Installing %s.%i -> %s.%i AND %s.%i -> %s.%i",
+      packet.dst, dst_port, packet.src, event.ofp.in_port,
+      packet.src, event.ofp.in_port, packet.dst, dst_port)
 
 # main function to start module
-def launch ():
+def launch (mode = 'noisy', drop_timeout = 10):
+  if mode not in ('noisy', 'drop', 'proactive'):
+    raise RuntimeError("Unknown firewall mode: %s" % (mode,))
+  global firewall_mode, drop_idle_timeout, owner
+  firewall_mode = mode
+  drop_idle_timeout = int(drop_timeout)
+  owner = FlowOwner(COOKIE_FIREWALL)
+
   core.openflow.addListenerByName("ConnectionUp", _handle_StartFirewall)
   core.openflow.addListenerByName("PacketIn", _handle_PacketIn)
+
+  # Lets other components (e.g., samples.state_sync) know that packets
+  # have to go through the firewall
+  core.register("of_firewall", sys.modules[__name__])
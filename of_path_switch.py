@@ -0,0 +1,212 @@
+#!/usr/bin/python
+# Copyright 2012 William Yu
+# wyu@ateneo.edu
+#
+# This file is part of POX.
+#
+# POX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# POX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with POX. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Shortest-path forwarding over the discovered topology.
+
+Hosts are learned where they attach: a source MAC is only learned on a
+port that samples.of_topology does not know as a link to another switch.
+The first packet to a known host installs a dl_dst flow on every switch
+of the shortest path to it in one go (last hop first), so the rest of
+the traffic never comes back to the controller. The paths come from
+the sink tree of the destination switch (see paths.py), which all
+switches share, so forwarding on the destination alone cannot loop.
+
+Packets to unknown or multicast destinations are flooded over the
+spanning tree of samples.of_topology.
+
+When a link or switch change invalidates the tree a route was computed
+from, or a host moves, the route's flows are removed; the next packet
+installs the new path.
+
+Command Line: ./pox.py openflow.discovery samples.of_topology
+                samples.of_path_switch [--idle_timeout=10]
+                [--hard_timeout=300]
+"""
+
+from pox.core import core
+import pox.openflow.libopenflow_01 as of
+from pox.lib.packet.ethernet import ethernet
+from pox.lib.util import dpidToStr
+from flow_owner import FlowOwner, COOKIE_PATH_SWITCH
+from packet_out import packet_out
+
+log = core.getLogger()
+
+
+class PathSwitch (object):
+  """
+  Installs end-to-end flows along shortest paths.
+  """
+  def __init__ (self, topology, idle_timeout = 10, hard_timeout = 300):
+    self.topology = topology
+    self.idle_timeout = idle_timeout
+    self.hard_timeout = hard_timeout
+    self.owner = FlowOwner(COOKIE_PATH_SWITCH)
+
+    self.hosts = {}       # MAC -> (dpid, port) it is attached to
+    # MAC -> (sink tree, set of dpids that have its flow). Every path to
+    # a host is a branch of the same sink tree, so flows are only added
+    # until the tree changes.
+    self.routes = {}
+
+  def host_flow (self, mac, port):
+    msg = of.ofp_flow_mod()
+    msg.match.dl_dst = mac
+    msg.idle_timeout = self.idle_timeout
+    msg.hard_timeout = self.hard_timeout
+    msg.actions.append(of.ofp_action_output(port = port))
+    return msg
+
+  def learn (self, mac, dpid, port):
+    old = self.hosts.get(mac)
+    if old == (dpid, port):
+      return
+    self.hosts[mac] = (dpid, port)
+    if old is not None:
+      log.debug("%s moved from %s.%i to %s.%i", mac, dpidToStr(old[0]),
+        old[1], dpidToStr(dpid), port)
+      self.unroute(mac)
+
+  def forget_port (self, dpid, port):
+    for mac in [m for m, loc in self.hosts.items() if loc == (dpid, port)]:
+      del self.hosts[mac]
+      self.unroute(mac)
+
+  def route (self, mac, hops, tree):
+    """
+    Installs the flows for 'mac' along 'hops', last hop first so that
+    the packet is not sent ahead of them.
+    """
+    entry = self.routes.get(mac)
+    if entry is not None and entry[0] is not tree:
+      self.unroute(mac)
+      entry = None
+    if entry is None:
+      entry = self.routes[mac] = (tree, set())
+    dpids = entry[1]
+    for dpid, port in reversed(hops):
+      connection = core.openflow.getConnection(dpid)
+      if connection is None:
+        continue
+      msg = self.host_flow(mac, port)
+      if not self.owner.duplicate(connection, msg):
+        self.owner.send(connection, msg)
+      dpids.add(dpid)
+    log.debug("Route to %s: %s", mac,
+      " ".join("%s.%i" % (dpidToStr(d), p) for d, p in hops))
+
+  def unroute (self, mac):
+    entry = self.routes.pop(mac, None)
+    if entry is None:
+      return
+    match = of.ofp_match(dl_dst = mac)
+    for dpid in entry[1]:
+      connection = core.openflow.getConnection(dpid)
+      if connection is not None:
+        self.owner.remove(connection, match)
+
+  def check_routes (self):
+    """
+    Removes the routes whose sink tree is no longer the current one.
+    """
+    paths = self.topology.paths
+    for mac, (tree, dpids) in list(self.routes.items()):
+      loc = self.hosts.get(mac)
+      if loc is None or paths.cached(loc[0]) is not tree:
+        self.unroute(mac)
+
+  def flood (self, event):
+    msg = packet_out(event.dpid, event.ofp, of.OFPP_ALL)
+    if msg is not None:
+      event.connection.send(msg)
+
+  def show (self):
+    log.info("%i host(s), %i route(s), %i sink tree(s) built",
+      len(self.hosts), len(self.routes), self.topology.paths.builds)
+    for mac, (dpid, port) in sorted(self.hosts.items()):
+      entry = self.routes.get(mac)
+      log.info("%s at %s.%i, flows on %i switch(es)", mac,
+        dpidToStr(dpid), port, len(entry[1]) if entry else 0)
+
+  def _handle_PacketIn (self, event):
+    packet = event.parsed
+    if not packet.parsed:
+      log.warning("Ignoring incomplete packet")
+      return
+    if packet.type == ethernet.LLDP_TYPE:
+      return
+
+    dpid = event.dpid
+    in_port = event.port
+    if not packet.src.is_multicast and \
+       not self.topology.is_link_port(dpid, in_port):
+      self.learn(packet.src, dpid, in_port)
+
+    loc = None if packet.dst.is_multicast else self.hosts.get(packet.dst)
+    if loc is None:
+      self.flood(event)
+      return
+    tree = self.topology.paths.sink_tree(loc[0])
+    hops = self.topology.paths.path(dpid, loc[0])
+    if hops is None:
+      self.flood(event)
+      return
+    hops.append(loc)
+    if hops[0][1] == in_port:
+      # Would go back where it came from
+      return
+    self.route(packet.dst, hops, tree)
+    msg = packet_out(dpid, event.ofp, hops[0][1])
+    if msg is not None:
+      event.connection.send(msg)
+
+  def _handle_PortStatus (self, event):
+    if event.deleted or event.ofp.desc.state & of.OFPPS_LINK_DOWN:
+      self.forget_port(event.dpid, event.port)
+    self.check_routes()
+
+  def _handle_ConnectionDown (self, event):
+    for mac in [m for m, loc in self.hosts.items() if loc[0] == event.dpid]:
+      del self.hosts[mac]
+    self.check_routes()
+
+  def _handle_LinkEvent (self, event):
+    if event.added:
+      # Anything learned on these ports came from another switch
+      l = event.link
+      self.forget_port(l.dpid1, l.port1)
+      self.forget_port(l.dpid2, l.port2)
+    self.check_routes()
+
+
+def launch (idle_timeout = 10, hard_timeout = 300):
+  def start ():
+    switch = PathSwitch(core.of_topology, int(idle_timeout),
+                        int(hard_timeout))
+    core.register("of_path_switch", switch)
+    # After of_topology has seen the same events (lower priority)
+    for name in ("PacketIn", "PortStatus", "ConnectionDown"):
+      core.openflow.addListenerByName(name,
+        getattr(switch, "_handle_" + name), priority = -1)
+    core.openflow_discovery.addListenerByName("LinkEvent",
+      switch._handle_LinkEvent, priority = -1)
+    log.info("Shortest-path forwarding.")
+  core.call_when_ready(start, ["openflow", "openflow_discovery",
+                               "of_topology"])
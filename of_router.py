@@ -0,0 +1,307 @@
+#!/usr/bin/python
+# Copyright 2012 William Yu
+# wyu@ateneo.edu
+#
+# This file is part of POX.
+#
+# POX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# POX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with POX. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+OpenFlow Static Router for the network of of_router_topo.py.
+
+  Network A (192.168.1.0/26)
+  <--> Router A (192.168.1.1, 192.168.1.129)
+  <--> Router B (192.168.1.65, 192.168.1.130)
+  <--> Network B (192.168.1.64/26)
+
+Each router switch gets a routing table (a prefix_table.PrefixTable, so
+longest-prefix matches stay fast with any number of routes) made of its
+connected networks and the static routes in ROUTERS. The router answers
+ARPs and pings for its own interface addresses. Other IP packets are
+routed: the MAC of the next hop is looked up in the router's ARP cache
+or, if unknown, asked for with an ARP request while the packet waits in
+a queue (up to PENDING_MAX packets per next hop, each for
+PENDING_TIMEOUT seconds; the request is repeated every PENDING_TIMEOUT
+seconds while packets wait, and the packets of a next hop that does not
+answer are dropped as they time out). The first packet to a destination
+installs a flow that rewrites dl_src/dl_dst, decrements the IP TTL and
+sends it out, so the rest of the traffic is routed by the switch.
+
+OpenFlow 1.0 has no action to decrement the IP TTL, so the Nicira
+extension (nx_action_dec_ttl) is used; the Open vSwitch of
+of_router_topo.py supports it, and drops the packets whose TTL runs
+out. The controller drops those of the first packet of a flow itself.
+
+Mininet Command Line: sudo python of_router_topo.py
+Command Line: ./pox.py samples.of_router [--router_a=0] [--router_b=1]
+"""
+
+import time
+
+from pox.core import core
+import pox.openflow.libopenflow_01 as of
+import pox.lib.packet as pkt
+import pox.openflow.nicira as nx
+from pox.lib.addresses import IPAddr, EthAddr
+from pox.lib.util import dpidToStr, str_to_dpid
+from pox.lib.recoco import Timer
+from prefix_table import PrefixTable, int_to_ip
+from flow_owner import FlowOwner, COOKIE_ROUTER
+from packet_out import packet_out
+
+log = core.getLogger()
+
+# Interfaces (port, address, prefix length) and static routes (prefix,
+# prefix length, gateway) of the routers of of_router_topo.py, where the
+# hosts are on port 1 and the link between the routers on port 2.
+ROUTERS = {
+  'a': ([(1, '192.168.1.1', 26), (2, '192.168.1.129', 26)],
+        [('192.168.1.64', 26, '192.168.1.130')]),
+  'b': ([(1, '192.168.1.65', 26), (2, '192.168.1.130', 26)],
+        [('192.168.1.0', 26, '192.168.1.129')]),
+}
+
+ARP_TIMEOUT = 120       # seconds an ARP cache entry (and its flows) lasts
+PENDING_TIMEOUT = 5     # seconds a packet waits for an ARP reply
+PENDING_MAX = 32        # packets queued per next hop
+ROUTE_IDLE_TIMEOUT = 60
+
+
+def _mask (length):
+  return (0xffffffff << (32 - length)) & 0xffffffff
+
+def _ip (n):
+  return IPAddr(int_to_ip(n))
+
+
+class Router (object):
+  """
+  Routes for one switch.
+  """
+  def __init__ (self, connection, interfaces, routes, owner):
+    self.connection = connection
+    self.owner = owner
+    self.macs = dict((p.port_no, EthAddr(p.hw_addr))
+                     for p in connection.features.ports)
+
+    self.interfaces = {}  # port -> (IPAddr, prefix length)
+    self.addresses = {}   # our addresses (unsigned) -> port
+    self.table = PrefixTable()  # prefix -> (port, gateway or None)
+    for port, ip, length in interfaces:
+      ip = IPAddr(ip)
+      self.interfaces[port] = (ip, length)
+      self.addresses[ip.toUnsigned()] = port
+      self.table.insert(ip.toUnsigned(), length, (port, None))
+    for prefix, length, gateway in routes:
+      self.add_route(IPAddr(prefix), length, IPAddr(gateway))
+
+    self.arp = {}         # IP (unsigned) -> (EthAddr, port, learned at)
+    # IP (unsigned) -> (ARP request sent at, [(deadline, ofp, dst)])
+    self.pending = {}
+
+    connection.addListeners(self)
+    self._timer = Timer(PENDING_TIMEOUT, self.expire_pending,
+      recurring = True)
+
+  def add_route (self, prefix, length, gateway):
+    """
+    Adds a static route. The gateway has to be on a connected network.
+    """
+    connected = self.table.lookup(gateway.toUnsigned())
+    if connected is None or connected[2][1] is not None:
+      log.error("%s: gateway %s of %s/%i is not on a connected network",
+        dpidToStr(self.connection.dpid), gateway, prefix, length)
+      return False
+    self.table.insert(prefix.toUnsigned(), length,
+      (connected[2][0], gateway.toUnsigned()))
+    return True
+
+  def _send_ethernet (self, port, dst, ethertype, payload):
+    e = pkt.ethernet(type = ethertype, src = self.macs[port], dst = dst)
+    e.payload = payload
+    msg = of.ofp_packet_out(in_port = of.OFPP_NONE)
+    msg.data = e.pack()
+    msg.actions.append(of.ofp_action_output(port = port))
+    self.connection.send(msg)
+
+  def learn (self, ip, mac, port):
+    """
+    Records where a neighbour is, and sends the packets waiting for it.
+    """
+    self.arp[ip] = (mac, port, time.time())
+    entry = self.pending.pop(ip, None)
+    if entry is None:
+      return
+    now = time.time()
+    sent = 0
+    for deadline, ofp, dst in entry[1]:
+      if deadline > now:
+        self.forward(ofp, dst, port, mac)
+        sent += 1
+    log.debug("%s: %s is at %s, sent %i queued packet(s)",
+      dpidToStr(self.connection.dpid), _ip(ip), mac, sent)
+
+  def neighbour (self, ip):
+    entry = self.arp.get(ip)
+    if entry is None:
+      return None
+    if time.time() - entry[2] > ARP_TIMEOUT:
+      del self.arp[ip]
+      return None
+    return entry
+
+  def resolve (self, ip, port, ofp, dst):
+    """
+    Queues a packet until the MAC of 'ip' is known, asking for it if we
+    are not already waiting for an answer.
+    """
+    now = time.time()
+    entry = self.pending.get(ip)
+    if entry is None or now - entry[0] > PENDING_TIMEOUT:
+      # Not asked yet, or no answer: drop what waited too long and ask
+      # (again)
+      queued = [q for q in entry[1] if q[0] > now] if entry else []
+      self.pending[ip] = (now, queued)
+      r = pkt.arp()
+      r.opcode = r.REQUEST
+      r.hwsrc = self.macs[port]
+      r.hwdst = EthAddr("00:00:00:00:00:00")
+      r.protosrc = self.interfaces[port][0]
+      r.protodst = _ip(ip)
+      self._send_ethernet(port, pkt.ETHER_BROADCAST,
+        pkt.ethernet.ARP_TYPE, r)
+      log.debug("%s: who has %s?", dpidToStr(self.connection.dpid),
+        _ip(ip))
+    else:
+      queued = entry[1]
+    if len(queued) < PENDING_MAX:
+      queued.append((now + PENDING_TIMEOUT, ofp, dst))
+
+  def expire_pending (self):
+    """
+    Drops the queued packets that waited too long, and the next hops
+    left with none once their ARP request is due again.
+    """
+    now = time.time()
+    for ip, (asked, queued) in list(self.pending.items()):
+      queued[:] = [q for q in queued if q[0] > now]
+      if not queued and now - asked > PENDING_TIMEOUT:
+        del self.pending[ip]
+
+  def forward (self, ofp, dst, port, mac):
+    """
+    Installs the flow for destination 'dst' (an IPAddr) through
+    (port, mac) and sends the packet along it.
+    """
+    actions = [of.ofp_action_dl_addr.set_src(self.macs[port]),
+               of.ofp_action_dl_addr.set_dst(mac),
+               nx.nx_action_dec_ttl(),
+               of.ofp_action_output(port = port)]
+    msg = of.ofp_flow_mod()
+    msg.match.dl_type = pkt.ethernet.IP_TYPE
+    msg.match.nw_dst = dst
+    msg.idle_timeout = ROUTE_IDLE_TIMEOUT
+    msg.hard_timeout = ARP_TIMEOUT
+    msg.actions = actions
+    if not self.owner.duplicate(self.connection, msg):
+      self.owner.send(self.connection, msg)
+    out = packet_out(self.connection.dpid, ofp, actions = actions)
+    if out is not None:
+      self.connection.send(out)
+
+  def handle_arp (self, event, a):
+    iface = self.interfaces.get(event.port)
+    if iface is None or a.prototype != a.PROTO_TYPE_IP:
+      return
+    ip, length = iface
+    src = a.protosrc.toUnsigned()
+    if src & _mask(length) == ip.toUnsigned() & _mask(length):
+      self.learn(src, a.hwsrc, event.port)
+    if a.opcode == a.REQUEST and a.protodst == ip:
+      r = pkt.arp()
+      r.opcode = r.REPLY
+      r.hwsrc = self.macs[event.port]
+      r.hwdst = a.hwsrc
+      r.protosrc = ip
+      r.protodst = a.protosrc
+      self._send_ethernet(event.port, a.hwsrc, pkt.ethernet.ARP_TYPE, r)
+
+  def handle_icmp (self, event, packet, ip):
+    icmp_in = packet.find("icmp")
+    if icmp_in is None or icmp_in.type != pkt.TYPE_ECHO_REQUEST:
+      return
+    icmp = pkt.icmp()
+    icmp.type = pkt.TYPE_ECHO_REPLY
+    icmp.payload = icmp_in.payload
+    ipp = pkt.ipv4()
+    ipp.protocol = ipp.ICMP_PROTOCOL
+    ipp.srcip = ip.dstip
+    ipp.dstip = ip.srcip
+    ipp.payload = icmp
+    self._send_ethernet(event.port, packet.src, pkt.ethernet.IP_TYPE, ipp)
+
+  def handle_ip (self, event, packet, ip):
+    dst = ip.dstip.toUnsigned()
+    if dst in self.addresses:
+      self.handle_icmp(event, packet, ip)
+      return
+    if ip.ttl <= 1:
+      log.debug("%s: TTL of packet to %s expired",
+        dpidToStr(self.connection.dpid), ip.dstip)
+      return
+    route = self.table.lookup(dst)
+    if route is None:
+      log.debug("%s: no route to %s", dpidToStr(self.connection.dpid),
+        ip.dstip)
+      return
+    port, gateway = route[2]
+    next_hop = dst if gateway is None else gateway
+    entry = self.neighbour(next_hop)
+    if entry is None:
+      self.resolve(next_hop, port, event.ofp, ip.dstip)
+      return
+    log.debug("%s: routing %s via %s.%i", dpidToStr(self.connection.dpid),
+      ip.dstip, _ip(next_hop), port)
+    self.forward(event.ofp, ip.dstip, port, entry[0])
+
+  def _handle_ConnectionDown (self, event):
+    self._timer.cancel()
+    self.pending.clear()
+
+  def _handle_PacketIn (self, event):
+    packet = event.parsed
+    if not packet.parsed:
+      log.warning("Ignoring incomplete packet")
+      return
+    a = packet.find("arp")
+    if a:
+      self.handle_arp(event, a)
+      return
+    ip = packet.find("ipv4")
+    if ip:
+      self.handle_ip(event, packet, ip)
+
+
+def launch (router_a = "0", router_b = "1"):
+  routers = {str_to_dpid(str(router_a)): ROUTERS['a'],
+             str_to_dpid(str(router_b)): ROUTERS['b']}
+  owner = FlowOwner(COOKIE_ROUTER)
+
+  def start_router (event):
+    config = routers.get(event.dpid)
+    if config is None:
+      return
+    log.debug("Routing for %s", dpidToStr(event.dpid))
+    Router(event.connection, config[0], config[1], owner)
+  core.openflow.addListenerByName("ConnectionUp", start_router)
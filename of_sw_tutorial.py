@@ -30,29 +30,94 @@ Command Line: ./pox.py log.level --DEBUG samples.of_sw_tutorial
 # These next two imports are common POX convention
 from pox.core import core
 import pox.openflow.libopenflow_01 as of
+from pox.lib.util import dpidToStr, str_to_bool
+from hotlog import HotLog
+from msg_batcher import Batchers
+from flow_owner import FlowOwner, COOKIE_SW_TUTORIAL
+from pox.lib.addresses import EthAddr
+from state_store import pack_port, unpack_port
+from packet_out import packet_out
 
 # Even a simple usage of the logger is much nicer than print!
 log = core.getLogger()
 
+# Logging for the PacketIn path; costs next to nothing when DEBUG is off
+hot = HotLog(log)
+
 # This table maps (switch,MAC-addr) pairs to the port on 'switch' at
 # which we last saw a packet *from* 'MAC-addr'.
 # (In this case, we use a Connection object for the switch.)
 table = {}
 
-# Method for just sending a packet to any port (broadcast by default)
-def send_packet (event, dst_port = of.OFPP_ALL):
-  msg = of.ofp_packet_out(in_port=event.ofp.in_port)
-  if event.ofp.buffer_id != -1 and event.ofp.buffer_id is not None:
-    # We got a buffer ID from the switch; use that
-    msg.buffer_id = event.ofp.buffer_id
+# Learned MACs are also saved in the state store (when it is loaded)
+# under this namespace, and restored when a switch connects.
+STATE_NS = 'of_sw_tutorial'
+
+# Learns the port of a source MAC
+def _learn (event, mac):
+  table[(event.connection, mac)] = event.port
+  store = core.components.get('state_store')
+  if store is not None and not mac.is_multicast:
+    store.put(STATE_NS, event.dpid, mac.toRaw(), pack_port(event.port))
+
+# Warm start: restores what we had learned about a switch before
+def _handle_ConnectionUp (event):
+  store = core.components.get('state_store')
+  if store is None:
+    return
+  entries = store.get(STATE_NS, event.dpid)
+  for mac, port in entries.items():
+    table[(event.connection, EthAddr(mac))] = unpack_port(port)
+  if entries:
+    log.info("Restored %i MAC(s) of %s", len(entries),
+      dpidToStr(event.dpid))
+
+# When batching is enabled (--batch), messages for a switch are queued
+# here and written out together at the end of the event.
+batchers = None
+
+# Tags our flows with our cookie and keeps track of them, so that
+# clear_own_flows() can remove just those. Set in launch().
+owner = None
+
+# Sends a message to a switch, through the batcher if there is one
+def _send (connection, msg):
+  if owner is not None:
+    owner.tag(connection, msg)
+  if batchers is not None:
+    batchers.send(connection, msg)
   else:
-    # No buffer ID from switch -- we got the raw data
-    if event.ofp.data:
-      # No raw_data specified -- nothing to send!
-      return
-    msg.data = event.ofp.data
-  msg.actions.append(of.ofp_action_output(port = dst_port))
-  event.connection.send(msg)
+    connection.send(msg)
+
+# Method for just sending a packet to any port (broadcast by default).
+# Uses the switch's buffer if it has the packet, else sends the data.
+def send_packet (event, dst_port = of.OFPP_ALL):
+  msg = packet_out(event.dpid, event.ofp, dst_port)
+  if msg is None:
+    # Not buffered and cut short -- nothing to send!
+    return
+  _send(event.connection, msg)
+
+# Sends a flow_mod unless the very same flow is already on the switch
+# (the PacketIn was in flight while it was installed), in which case the
+# packet is just sent on to 'dst_port'. Returns False if suppressed.
+def _install (event, msg, dst_port = None):
+  if owner is not None and owner.duplicate(event.connection, msg):
+    if dst_port is not None:
+      send_packet(event, dst_port)
+    return False
+  _send(event.connection, msg)
+  return True
+
+# Logs how many flow_mods were sent and suppressed per switch
+def show_flow_stats ():
+  for dpid, (flows, sent, suppressed) in owner.stats().items():
+    log.info("%s: %i flow(s) tracked, %i sent, %i duplicate(s) suppressed"
+      % (dpidToStr(dpid), flows, sent, suppressed))
+
+# Removes the flows we installed on a switch (and only those)
+def clear_own_flows (connection):
+  return owner.delete(connection, send = lambda msg: _send(connection, msg))
 
 # DUMB HUB Implementation
 # This is an implementation of a broadcast hub but all packets go 
@@ -62,8 +127,8 @@ def _handle_dumbhub_packetin (event):
   packet = event.parsed
   send_packet(event, of.OFPP_ALL)
 
-  log.debug("Broadcasting %s.%i -> %s.%i" %
-    (packet.src, event.ofp.in_port, packet.dst, of.OFPP_ALL))
+  hot.debug("Broadcasting %s.%i -> %s.%i",
+    packet.src, event.ofp.in_port, packet.dst, of.OFPP_ALL)
 
 # PAIR-WISE MATCHING HUB Implementation
 # This is an implementation of a broadcast hub with flows installed.
@@ -77,10 +142,10 @@ def _handle_pairhub_packetin (event):
   msg.match.dl_src = packet.src
   msg.match.dl_dst = packet.dst
   msg.actions.append(of.ofp_action_output(port = of.OFPP_ALL))
-  event.connection.send(msg)
+  _send(event.connection, msg)
 
-  log.debug("Installing %s.%i -> %s.%i" %
-    (packet.src, event.ofp.in_port, packet.dst, of.OFPP_ALL))
+  hot.debug("Installing %s.%i -> %s.%i",
+    packet.src, event.ofp.in_port, packet.dst, of.OFPP_ALL)
 
 # LAZY HUB Implementation (How hubs typically are)
 # This is an implementation of a broadcast hub with flows installed.
@@ -92,11 +157,11 @@ def _handle_lazyhub_packetin (event):
   msg.idle_timeout = 10
   msg.hard_timeout = 30
   msg.actions.append(of.ofp_action_output(port = of.OFPP_ALL))
-  event.connection.send(msg)
+  _send(event.connection, msg)
 
-  log.debug("Installing %s.%i -> %s.%i" %
-    ("ff:ff:ff:ff:ff:ff", event.ofp.in_port, "ff:ff:ff:ff:ff:ff", 
-    of.OFPP_ALL))
+  hot.debug("Installing %s.%i -> %s.%i",
+    "ff:ff:ff:ff:ff:ff", event.ofp.in_port, "ff:ff:ff:ff:ff:ff", 
+    of.OFPP_ALL)
 
 # BAD SWITCH Implementation
 # This is an obvious but problematic implementation of switch that
@@ -105,7 +170,7 @@ def _handle_badswitch_packetin (event):
   packet = event.parsed
 
   # Learn the source and fill up routing table
-  table[(event.connection,packet.src)] = event.port
+  _learn(event, packet.src)
 
   # install appropriate flow rule when learned
   msg = of.ofp_flow_mod()
@@ -113,13 +178,13 @@ def _handle_badswitch_packetin (event):
   msg.hard_timeout = 30
   msg.match.dl_dst = packet.src
   msg.actions.append(of.ofp_action_output(port = event.port))
-  event.connection.send(msg)
+  _send(event.connection, msg)
 
   # determine if appropriate destination route is available
   dst_port = table.get((event.connection,packet.dst))
 
-  log.debug("Installing %s.%i -> %s.%i" %
-    ("ff:ff:ff:ff:ff:ff", event.ofp.in_port, packet.src, event.port))
+  hot.debug("Installing %s.%i -> %s.%i",
+    "ff:ff:ff:ff:ff:ff", event.ofp.in_port, packet.src, event.port)
 
   if dst_port is None:
     # We don't know where the destination is yet. So, we'll just
@@ -130,15 +195,15 @@ def _handle_badswitch_packetin (event):
     # but it's not clear if all switches support this. :(
     send_packet(event, of.OFPP_ALL)
 
-    log.debug("Broadcasting %s.%i -> %s.%i" %
-      (packet.src, event.ofp.in_port, packet.dst, of.OFPP_ALL))
+    hot.debug("Broadcasting %s.%i -> %s.%i",
+      packet.src, event.ofp.in_port, packet.dst, of.OFPP_ALL)
   else:   
     # This is the packet that just came in -- we want send the packet
     # if we know the destination.
     send_packet(event, dst_port)
 
-    log.debug("Sending %s.%i -> %s.%i" %
-      (packet.src, event.ofp.in_port, packet.dst, dst_port))
+    hot.debug("Sending %s.%i -> %s.%i",
+      packet.src, event.ofp.in_port, packet.dst, dst_port)
 
 # PAIR-WISE MATCH SWITCH Implementation
 # This is an implementation of an pair match switch. This only matches
@@ -150,7 +215,7 @@ def _handle_pairswitch_packetin (event):
   packet = event.parsed
 
   # Learn the source and fill up routing table
-  table[(event.connection,packet.src)] = event.port
+  _learn(event, packet.src)
   dst_port = table.get((event.connection,packet.dst))
 
   if dst_port is None:
@@ -162,8 +227,8 @@ def _handle_pairswitch_packetin (event):
     # but it's not clear if all switches support this. :(
     send_packet(event, of.OFPP_ALL)
 
-    log.debug("Broadcasting %s.%i -> %s.%i" %
-      (packet.src, event.ofp.in_port, packet.dst, of.OFPP_ALL))
+    hot.debug("Broadcasting %s.%i -> %s.%i",
+      packet.src, event.ofp.in_port, packet.dst, of.OFPP_ALL)
   else:   
     # This is the packet that just came in -- we want to
     # install the rule and also resend the packet.
@@ -173,10 +238,13 @@ def _handle_pairswitch_packetin (event):
     msg.match.dl_src = packet.src
     msg.match.dl_dst = packet.dst
     msg.actions.append(of.ofp_action_output(port = dst_port))
-    event.connection.send(msg)
+    if not _install(event, msg, dst_port):
+      hot.debug("Already installed %s.%i -> %s.%i",
+        packet.src, event.ofp.in_port, packet.dst, dst_port)
+      return
 
-    log.debug("Installing %s.%i -> %s.%i" %
-      (packet.src, event.ofp.in_port, packet.dst, dst_port))
+    hot.debug("Installing %s.%i -> %s.%i",
+      packet.src, event.ofp.in_port, packet.dst, dst_port)
 
 # SMARTER PAIR-WISE MATCH SWITCH Implementation
 # This is an implementation of an ideal pair switch. This optimizes the
@@ -185,7 +253,7 @@ def _handle_idealpairswitch_packetin (event):
   packet = event.parsed
 
   # Learn the source and fill up routing table
-  table[(event.connection,packet.src)] = event.port
+  _learn(event, packet.src)
   dst_port = table.get((event.connection,packet.dst))
 
   if dst_port is None:
@@ -197,8 +265,8 @@ def _handle_idealpairswitch_packetin (event):
     # but it's not clear if all switches support this. :(
     send_packet(event, of.OFPP_ALL)
 
-    log.debug("Broadcasting %s.%i -> %s.%i" %
-      (packet.src, event.ofp.in_port, packet.dst, of.OFPP_ALL))
+    hot.debug("Broadcasting %s.%i -> %s.%i",
+      packet.src, event.ofp.in_port, packet.dst, of.OFPP_ALL)
   else:
     # Since we know the switch ports for both the source and dest
     # MACs, we can install rules for both directions.
@@ -208,7 +276,7 @@ def _handle_idealpairswitch_packetin (event):
     msg.match.dl_dst = packet.src
     msg.match.dl_src = packet.dst
     msg.actions.append(of.ofp_action_output(port = event.port))
-    event.connection.send(msg)
+    _install(event, msg)
     
     # This is the packet that just came in -- we want to
     # install the rule and also resend the packet.
@@ -218,16 +286,28 @@ def _handle_idealpairswitch_packetin (event):
     msg.match.dl_src = packet.src
     msg.match.dl_dst = packet.dst
     msg.actions.append(of.ofp_action_output(port = dst_port))
-    event.connection.send(msg)
+    if not _install(event, msg, dst_port):
+      hot.debug("Already installed %s.%i -> %s.%i",
+        packet.src, event.ofp.in_port, packet.dst, dst_port)
+      return
 
-    log.debug("Installing %s.%i -> %s.%i AND %s.%i -> %s.%i" %
-      (packet.dst, dst_port, packet.src, event.ofp.in_port,
-      packet.src, event.ofp.in_port, packet.dst, dst_port))
+    hot.debug("Installing %s.%i -> %s.%i AND %s.%i -> %s.%i",
+      packet.dst, dst_port, packet.src, event.ofp.in_port,
+      packet.src, event.ofp.in_port, packet.dst, dst_port)
 
 # function that is invoked upon load to ensure that listeners are
 # registered appropriately. Uncomment the hub/switch you would like 
 # to test. Only one at a time please.
-def launch ():
+#
+# --batch packs the messages of one event into a single write,
+# --batch_delay=<seconds> holds them for up to that long to coalesce
+# more, and --barrier follows each batch with a barrier request.
+def launch (batch = False, batch_delay = 0, barrier = False):
+  global batchers, owner
+  owner = FlowOwner(COOKIE_SW_TUTORIAL)
+  if str_to_bool(batch):
+    batchers = Batchers(float(batch_delay), barrier = str_to_bool(barrier))
+
   #core.openflow.addListenerByName("PacketIn", _handle_dumbhub_packetin)
   #core.openflow.addListenerByName("PacketIn", _handle_pairhub_packetin)
   #core.openflow.addListenerByName("PacketIn", _handle_lazyhub_packetin)
@@ -235,5 +315,6 @@ def launch ():
   #core.openflow.addListenerByName("PacketIn", _handle_pairswitch_packetin)
   core.openflow.addListenerByName("PacketIn", 
     _handle_idealpairswitch_packetin)
+  core.openflow.addListenerByName("ConnectionUp", _handle_ConnectionUp)
 
   log.info("Switch Tutorial is running.")
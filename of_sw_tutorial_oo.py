@@ -33,23 +33,47 @@ Command Line: ./pox.py py --completion
 THIS VERSION SUPPORT resend() functionality in the betta branch POX.
 Object-oriented version that allows user to switch switches via the 
 command line interface.
+
+migrate_packetin_listener() switches to another handler a few switches
+at a time. Every flow carries the cookie of the handler generation that
+installed it, so only the flows of the old handler are removed from a
+switch when it moves over, and the learning tables are kept, so the new
+handler starts out knowing every host.
+
+SW_AGGSWITCH forwards on the destination MAC only, so a switch holds one
+flow per host instead of one per pair of hosts.
 """
 
 # These next two imports are common POX convention
 from pox.core import core
 import pox.openflow.libopenflow_01 as of
-from pox.lib.util import dpidToStr
+from hotlog import HotLog
+from pox.lib.util import dpidToStr, str_to_bool
+from pox.lib.recoco import Timer
+from learning_table import LearningTables
+from msg_batcher import Batchers
+from flow_owner import FlowOwner, COOKIE_SW_TUTORIAL_OO
+from pox.lib.addresses import EthAddr
+from state_store import pack_port, unpack_port
+from packet_out import packet_out
 
 # Even a simple usage of the logger is much nicer than print!
 log = core.getLogger()
 
+# Logging for the PacketIn path; costs next to nothing when DEBUG is off
+hot = HotLog(log)
+
+# Learned MACs are also saved in the state store (when it is loaded)
+# under this namespace, and restored when a switch connects.
+STATE_NS = 'of_sw_tutorial_oo'
+
 # Create the class to hold the switch tutorial implementations
 class SwitchTutorial (object):
 
-  # This table maps (switch,MAC-addr) pairs to the port on 'switch' at
-  # which we last saw a packet *from* 'MAC-addr'.
-  # (In this case, we use a Connection object for the switch.)
-  table = {}
+  # Holds one learning table per switch (keyed by dpid). Each table maps
+  # a MAC-addr to the port on the switch at which we last saw a packet
+  # *from* 'MAC-addr'. Set in the constructor.
+  tables = None
 
   # Holds the object with the default switch
   handlerName = 'SW_IDEALPAIRSWITCH'
@@ -57,27 +81,120 @@ class SwitchTutorial (object):
   # Holds the current active PacketIn listener object
   listeners = None
 
+  # Holds the outbound message batchers (None when not batching)
+  batchers = None
+
+  # Tags our flows with the cookie of the handler generation and keeps
+  # track of them, so they can be removed by cookie. Set in the
+  # constructor.
+  owner = None
+
+  # Handler name and cookie of switches that do not use the default
+  # handler (yet), keyed by dpid. Set in the constructor.
+  switchHandlers = None
+  switchCookies = None
+
   # Constructor and sets default handler to Ideal Pair Switch
-  def __init__(self, handlerName = 'SW_IDEALPAIRSWITCH'):
+  def __init__(self, handlerName = 'SW_IDEALPAIRSWITCH',
+               max_entries = 4096, idle_timeout = 30, batch = False,
+               batch_delay = 0, barrier = False):
     log.debug("Initializing switch %s." % handlerName)
+    self.handlerName = handlerName
+    self.tables = LearningTables(max_entries, idle_timeout)
+    self.switchHandlers = {}
+    self.switchCookies = {}
+    self.owner = FlowOwner(COOKIE_SW_TUTORIAL_OO)
+    if batch:
+      self.batchers = Batchers(batch_delay, barrier = barrier)
+
+    # Forget everything about a switch once it goes away and age out
+    # entries of idle hosts every few seconds.
+    core.openflow.addListenerByName("ConnectionUp",
+      self._handle_ConnectionUp)
+    core.openflow.addListenerByName("ConnectionDown",
+      self._handle_ConnectionDown)
+    core.openflow.addListenerByName("PortStatus",
+      self._handle_PortStatus)
+    self._expire_timer = Timer(10, self._expire_tables, recurring=True)
+
+  # Warm start: restores what we had learned about a switch before
+  def _handle_ConnectionUp (self, event):
+    store = core.components.get('state_store')
+    if store is None:
+      return
+    entries = store.get(STATE_NS, event.dpid)
+    table = self.tables.table(event.dpid)
+    for mac, port in entries.items():
+      table.learn(EthAddr(mac), unpack_port(port))
+    if entries:
+      log.info("Restored %i MAC(s) of %s" % (len(entries),
+        dpidToStr(event.dpid)))
+
+  # Learns the port of a source MAC
+  def _learn (self, event, table, mac):
+    table.learn(mac, event.port)
+    store = core.components.get('state_store')
+    if store is not None and not mac.is_multicast:
+      store.put(STATE_NS, event.dpid, mac.toRaw(), pack_port(event.port))
+
+  # Drops the learning table of a disconnected switch
+  def _handle_ConnectionDown (self, event):
+    self.tables.remove(event.dpid)
+    self.switchHandlers.pop(event.dpid, None)
+    self.switchCookies.pop(event.dpid, None)
+    log.debug("Forgetting learned MACs of %s." % dpidToStr(event.dpid))
+
+  # Forgets the hosts behind a port that went away or lost its link, and
+  # removes the destination flows we had towards them
+  def _handle_PortStatus (self, event):
+    if not (event.deleted or
+            event.ofp.desc.state & of.OFPPS_LINK_DOWN):
+      return
+    if event.dpid not in self.tables:
+      return
+    table = self.tables.table(event.dpid)
+    for mac, port in table.items():
+      if port != event.port:
+        continue
+      table.forget(mac)
+      self._remove_dst_flow(event.connection, mac)
+
+  # Removes idle entries from all learning tables
+  def _expire_tables (self):
+    self.tables.expire()
+
+  # Sends a message to a switch, through the batcher if there is one.
+  # Flows are tagged with the cookie of the switch's handler generation.
+  def _send (self, connection, msg):
+    self.owner.tag(connection, msg,
+      self.switchCookies.get(connection.dpid))
+    if self.batchers is not None:
+      self.batchers.send(connection, msg)
+    else:
+      connection.send(msg)
 
-  # Method for just sending a packet to any port (broadcast by default)
+  # Sends a flow_mod unless the very same flow is already on the switch
+  # (the PacketIn was in flight while it was installed), in which case
+  # the packet is just resent to 'dst_port'. Returns False if suppressed.
+  def _install (self, event, msg, dst_port = None):
+    if self.owner.duplicate(event.connection, msg,
+                            self.switchCookies.get(event.dpid)):
+      if dst_port is not None:
+        self.resend_packet(event, dst_port)
+      return False
+    self._send(event.connection, msg)
+    return True
+
+  # Method for just sending a packet to any port (broadcast by default).
+  # Uses the switch's buffer if it has the packet, else sends the data.
   def send_packet(self, event, dst_port = of.OFPP_ALL):
-    msg = of.ofp_packet_out(in_port=event.ofp.in_port)
-    if event.ofp.buffer_id != -1 and event.ofp.buffer_id is not None:
-      msg.buffer_id = event.ofp.buffer_id
-    else:
-      if event.ofp.data:
-        return
-      msg.data = event.ofp.data
-    msg.actions.append(of.ofp_action_output(port = dst_port))
-    event.connection.send(msg)
+    msg = packet_out(event.dpid, event.ofp, dst_port)
+    if msg is None:
+      return
+    self._send(event.connection, msg)
 
-  # Optimal method for resending a packet
-  def resend_packet(self, event, dst_port = of.OFPP_ALL):
-    msg = of.ofp_packet_out(data = event.ofp)
-    msg.actions.append(of.ofp_action_output(port = dst_port))
-    event.connection.send(msg)
+  # Method for resending a packet; the same as send_packet() now
+  resend_packet = send_packet
 
   # DUMB HUB Implementation
   # This is an implementation of a broadcast hub but all packets go 
@@ -87,8 +204,8 @@ class SwitchTutorial (object):
     packet = event.parsed
     self.resend_packet(event, of.OFPP_ALL)
 
-    log.debug("Broadcasting %s.%i -> %s.%i" %
-      (packet.src, event.ofp.in_port, packet.dst, of.OFPP_ALL))
+    hot.debug("Broadcasting %s.%i -> %s.%i",
+      packet.src, event.ofp.in_port, packet.dst, of.OFPP_ALL)
 
   # PAIR-WISE MATCHING HUB Implementation
   # This is an implementation of a broadcast hub with flows installed.
@@ -103,10 +220,10 @@ class SwitchTutorial (object):
     msg.match.dl_src = packet.src
     msg.match.dl_dst = packet.dst
     msg.actions.append(of.ofp_action_output(port = of.OFPP_ALL))
-    event.connection.send(msg)
+    self._send(event.connection, msg)
 
-    log.debug("Installing %s.%i -> %s.%i" %
-      (packet.src, event.ofp.in_port, packet.dst, of.OFPP_ALL))
+    hot.debug("Installing %s.%i -> %s.%i",
+      packet.src, event.ofp.in_port, packet.dst, of.OFPP_ALL)
 
   # LAZY HUB Implementation (How hubs typically are)
   # This is an implementation of a broadcast hub with flows installed.
@@ -119,11 +236,11 @@ class SwitchTutorial (object):
     msg.idle_timeout = 10
     msg.hard_timeout = 30
     msg.actions.append(of.ofp_action_output(port = of.OFPP_ALL))
-    event.connection.send(msg)
+    self._send(event.connection, msg)
 
-    log.debug("Installing %s.%i -> %s.%i" %
-      ("ff:ff:ff:ff:ff:ff", event.ofp.in_port, "ff:ff:ff:ff:ff:ff", 
-      of.OFPP_ALL))
+    hot.debug("Installing %s.%i -> %s.%i",
+      "ff:ff:ff:ff:ff:ff", event.ofp.in_port, "ff:ff:ff:ff:ff:ff", 
+      of.OFPP_ALL)
 
   # BAD SWITCH Implementation
   # This is an obvious but problematic implementation of switch that
@@ -132,7 +249,8 @@ class SwitchTutorial (object):
     packet = event.parsed
 
     # Learn the source and fill up routing table
-    self.table[(event.connection,packet.src)] = event.port
+    table = self.tables.table(event.dpid)
+    self._learn(event, table, packet.src)
 
     # install appropriate flow rule when learned
     msg = of.ofp_flow_mod()
@@ -140,13 +258,13 @@ class SwitchTutorial (object):
     msg.hard_timeout = 30
     msg.match.dl_dst = packet.src
     msg.actions.append(of.ofp_action_output(port = event.port))
-    event.connection.send(msg)
+    self._send(event.connection, msg)
 
-    log.debug("Installing %s.%i -> %s.%i" %
-      ("ff:ff:ff:ff:ff:ff", event.ofp.in_port, packet.src, event.port))
+    hot.debug("Installing %s.%i -> %s.%i",
+      "ff:ff:ff:ff:ff:ff", event.ofp.in_port, packet.src, event.port)
 
     # determine if appropriate destination route is available
-    dst_port = self.table.get((event.connection,packet.dst))
+    dst_port = table.get(packet.dst)
 
     if dst_port is None:
       # We don't know where the destination is yet. So, we'll just
@@ -157,15 +275,15 @@ class SwitchTutorial (object):
       # but it's not clear if all switches support this. :(
       self.resend_packet(event, of.OFPP_ALL)
 
-      log.debug("Broadcasting %s.%i -> %s.%i" %
-        (packet.src, event.ofp.in_port, packet.dst, of.OFPP_ALL))
+      hot.debug("Broadcasting %s.%i -> %s.%i",
+        packet.src, event.ofp.in_port, packet.dst, of.OFPP_ALL)
     else:   
       # This is the packet that just came in -- we want send the packet
       # if we know the destination.
       self.resend_packet(event, dst_port)
 
-      log.debug("Sending %s.%i -> %s.%i" %
-        (packet.src, event.ofp.in_port, packet.dst, dst_port))
+      hot.debug("Sending %s.%i -> %s.%i",
+        packet.src, event.ofp.in_port, packet.dst, dst_port)
 
   # PAIR-WISE MATCH SWITCH Implementation
   # This is an implementation of an pair match switch. This only matches
@@ -177,8 +295,9 @@ class SwitchTutorial (object):
     packet = event.parsed
 
     # Learn the source and fill up routing table
-    self.table[(event.connection,packet.src)] = event.port
-    dst_port = self.table.get((event.connection,packet.dst))
+    table = self.tables.table(event.dpid)
+    self._learn(event, table, packet.src)
+    dst_port = table.get(packet.dst)
 
     if dst_port is None:
       # We don't know where the destination is yet. So, we'll just
@@ -189,8 +308,8 @@ class SwitchTutorial (object):
       # but it's not clear if all switches support this. :(
       self.resend_packet(event, of.OFPP_ALL)
 
-      log.debug("Broadcasting %s.%i -> %s.%i" %
-        (packet.src, event.ofp.in_port, packet.dst, of.OFPP_ALL))
+      hot.debug("Broadcasting %s.%i -> %s.%i",
+        packet.src, event.ofp.in_port, packet.dst, of.OFPP_ALL)
     else:   
       # This is the packet that just came in -- we want to
       # install the rule and also resend the packet.
@@ -201,10 +320,13 @@ class SwitchTutorial (object):
       msg.match.dl_src = packet.src
       msg.match.dl_dst = packet.dst
       msg.actions.append(of.ofp_action_output(port = dst_port))
-      event.connection.send(msg)
+      if not self._install(event, msg, dst_port):
+        hot.debug("Already installed %s.%i -> %s.%i",
+          packet.src, event.ofp.in_port, packet.dst, dst_port)
+        return
 
-      log.debug("Installing %s.%i -> %s.%i" %
-        (packet.src, event.ofp.in_port, packet.dst, dst_port))
+      hot.debug("Installing %s.%i -> %s.%i",
+        packet.src, event.ofp.in_port, packet.dst, dst_port)
 
   # SMARTER PAIR-WISE MATCH SWITCH Implementation
   # This is an implementation of an ideal pair switch. This optimizes the
@@ -213,8 +335,9 @@ class SwitchTutorial (object):
     packet = event.parsed
 
     # Learn the source and fill up routing table
-    self.table[(event.connection,packet.src)] = event.port
-    dst_port = self.table.get((event.connection,packet.dst))
+    table = self.tables.table(event.dpid)
+    self._learn(event, table, packet.src)
+    dst_port = table.get(packet.dst)
 
     if dst_port is None:
       # We don't know where the destination is yet. So, we'll just
@@ -225,8 +348,8 @@ class SwitchTutorial (object):
       # but it's not clear if all switches support this. :(
       self.resend_packet(event, of.OFPP_ALL)
 
-      log.debug("Broadcasting %s.%i -> %s.%i" %
-        (packet.src, event.ofp.in_port, packet.dst, of.OFPP_ALL))
+      hot.debug("Broadcasting %s.%i -> %s.%i",
+        packet.src, event.ofp.in_port, packet.dst, of.OFPP_ALL)
     else:
       # Since we know the switch ports for both the source and dest
       # MACs, we can install rules for both directions.
@@ -236,7 +359,7 @@ class SwitchTutorial (object):
       msg.match.dl_dst = packet.src
       msg.match.dl_src = packet.dst
       msg.actions.append(of.ofp_action_output(port = event.port))
-      event.connection.send(msg)
+      self._install(event, msg)
     
       # This is the packet that just came in -- we want to
       # install the rule and also resend the packet.
@@ -247,11 +370,74 @@ class SwitchTutorial (object):
       msg.match.dl_src = packet.src
       msg.match.dl_dst = packet.dst
       msg.actions.append(of.ofp_action_output(port = dst_port))
-      event.connection.send(msg)
+      if not self._install(event, msg, dst_port):
+        hot.debug("Already installed %s.%i -> %s.%i",
+          packet.src, event.ofp.in_port, packet.dst, dst_port)
+        return
 
-      log.debug("Installing %s.%i -> %s.%i AND %s.%i -> %s.%i" %
-        (packet.dst, dst_port, packet.src, event.ofp.in_port,
-        packet.src, event.ofp.in_port, packet.dst, dst_port))
+      hot.debug("Installing %s.%i -> %s.%i AND %s.%i -> %s.%i",
+        packet.dst, dst_port, packet.src, event.ofp.in_port,
+        packet.src, event.ofp.in_port, packet.dst, dst_port)
+
+  # AGGREGATED SWITCH Implementation
+  # This is an implementation of a switch that forwards on the
+  # destination MAC address only, like the BAD SWITCH, so that a switch
+  # needs one flow per host instead of one per pair of hosts. What makes
+  # the bad switch bad is that a host whose packets all match the
+  # destination flows is never learned. So while the destination of a
+  # packet is unknown, the flow towards its source is removed: the
+  # answer then comes to us, and we learn where the destination is.
+  # A host that shows up on another port gets its flow moved along.
+  def _handle_aggswitch_packetin (self, event):
+    packet = event.parsed
+
+    # Learn the source and fill up routing table
+    table = self.tables.table(event.dpid)
+    src_port = table.get(packet.src)
+    self._learn(event, table, packet.src)
+    dst_port = table.get(packet.dst)
+
+    if dst_port is None:
+      # Flood and have the answer come to the controller
+      self.resend_packet(event, of.OFPP_ALL)
+      if not packet.src.is_multicast:
+        self._remove_dst_flow(event.connection, packet.src)
+
+      hot.debug("Broadcasting %s.%i -> %s.%i",
+        packet.src, event.ofp.in_port, packet.dst, of.OFPP_ALL)
+      return
+
+    if src_port is not None and src_port != event.port:
+      # The source moved; point its flow at the new port
+      self._install(event, self._dst_flow(packet.src, event.port))
+
+      hot.debug("Moved %s.%i -> %s.%i",
+        packet.src, src_port, packet.src, event.port)
+
+    # This is the packet that just came in -- we want to
+    # install the rule and also resend the packet.
+    msg = self._dst_flow(packet.dst, dst_port)
+    msg.data = event.ofp
+    if not self._install(event, msg, dst_port):
+      hot.debug("Already installed * -> %s.%i", packet.dst, dst_port)
+      return
+
+    hot.debug("Installing * -> %s.%i", packet.dst, dst_port)
+
+  # Returns the flow that sends everything for 'mac' to 'port'
+  def _dst_flow (self, mac, port):
+    msg = of.ofp_flow_mod()
+    msg.idle_timeout = 10
+    msg.hard_timeout = 30
+    msg.match.dl_dst = mac
+    msg.actions.append(of.ofp_action_output(port = port))
+    return msg
+
+  # Removes the flow towards 'mac' if we installed one
+  def _remove_dst_flow (self, connection, mac):
+    match = of.ofp_match(dl_dst = mac)
+    return self.owner.remove(connection, match,
+      send = lambda msg: self._send(connection, msg))
 
   # Define the proper handler
   def _set_handler_name (self, handlerName = 'SW_IDEALPAIRSWITCH'):
@@ -259,7 +445,26 @@ class SwitchTutorial (object):
 
   # Function to grab the appropriate handler
   def _get_handler (self, event):
-    return self.swMap[self.handlerName](self, event)
+    name = self.switchHandlers.get(event.dpid, self.handlerName)
+    return self.swMap[name](self, event)
+
+  # Moves one wave of switches over to the handler of 'cookie'
+  def _migrate_wave (self, dpids, handlerName, cookie, delete_old):
+    if self.owner.cookie != cookie:
+      # A newer migration took over these switches
+      return
+    for dpid in dpids:
+      self.switchHandlers.pop(dpid, None)
+      self.switchCookies.pop(dpid, None)
+      connection = core.openflow.getConnection(dpid)
+      if connection is None:
+        continue
+      count = 0
+      if delete_old:
+        count = self.owner.delete(connection, keep = cookie,
+          send = lambda msg: self._send(connection, msg))
+      log.debug("Migrated %s to %s (%i old flows removed)." %
+        (dpidToStr(dpid), handlerName, count))
 
   """ Here are functions that are meant to be called directly """
   # Here is a function to list all possible switches
@@ -269,12 +474,22 @@ class SwitchTutorial (object):
 
   # Here is a function to displaying possible methods
   def help(self):
-    log.info("Methods available: %s %s %s %s %s" % 
+    log.info("Methods available: %s %s %s %s %s %s %s %s" % 
       ('list_available_listeners()', 
       'attach_packetin_listener(handlerName = \'SW_IDEALPAIRSWITCH\'',
       'detach_packetin_listener()',
-      'clear_all_flows()',
-      'clear_flows(connection)'))
+      'migrate_packetin_listener(handlerName, wave_size=4, wave_interval=5)',
+      'clear_all_flows(wave_size=0, wave_interval=5)',
+      'clear_flows(connection)',
+      'clear_own_flows(connection)',
+      'show_flow_stats()'))
+
+  # Here is a function to show how many flow_mods were sent and how many
+  # duplicates were suppressed on each switch
+  def show_flow_stats (self):
+    for dpid, (flows, sent, suppressed) in self.owner.stats().items():
+      log.info("%s: %i flow(s) tracked, %i sent, %i duplicate(s) suppressed"
+        % (dpidToStr(dpid), flows, sent, suppressed))
 
   # Here is a function to attach the listener give the default handerName
   def attach_packetin_listener (self, handlerName = 'SW_IDEALPAIRSWITCH'):
@@ -286,23 +501,81 @@ class SwitchTutorial (object):
   # Here is a function to remove the listener
   def detach_packetin_listener (self):
     core.openflow.removeListener(self.listeners)
+    self.listeners = None
     log.debug("Detaching switch %s." % self.handlerName)
 
   # Function to clear all flows from a specified switch given 
-  # a connection object
+  # a connection object. The delete goes through the batcher, after
+  # the flow_mods still waiting there, so none of them survives it.
   def clear_flows (self, connection):
     msg = of.ofp_flow_mod(match=of.ofp_match(),command=of.OFPFC_DELETE)
-    connection.send(msg)
+    self._send(connection, msg)
+    self.owner.forget(connection.dpid)
     log.debug("Clearing all flows from %s." % 
       dpidToStr(connection.dpid))
 
-  # Function to clear all flows from all switches
-  def clear_all_flows (self):
-    msg = of.ofp_flow_mod(match=of.ofp_match(),command=of.OFPFC_DELETE)
-    for connection in core.openflow._connections.values():
-      connection.send(msg)
-      log.debug("Clearing all flows from %s." % 
-        dpidToStr(connection.dpid))
+  # Function to clear only the flows we installed on a switch, leaving
+  # those of other components (firewall, pong, ...) alone
+  def clear_own_flows (self, connection):
+    count = self.owner.delete(connection,
+      send = lambda msg: self._send(connection, msg))
+    log.debug("Clearing %i flow(s) from %s." %
+      (count, dpidToStr(connection.dpid)))
+
+  # Function to clear all flows from all switches. With a wave_size,
+  # only that many switches are cleared every wave_interval seconds.
+  def clear_all_flows (self, wave_size = 0, wave_interval = 5):
+    connections = list(core.openflow._connections.values())
+    if not wave_size:
+      wave_size = len(connections) or 1
+    for i in range(0, len(connections), wave_size):
+      wave = connections[i:i + wave_size]
+      if i == 0:
+        self._clear_wave(wave)
+      else:
+        Timer((i // wave_size) * wave_interval, self._clear_wave,
+          args=[wave])
+
+  def _clear_wave (self, connections):
+    for connection in connections:
+      self.clear_flows(connection)
+
+  # Here is a function to switch to another handler without flushing
+  # every switch at once. Switches move over 'wave_size' at a time,
+  # every 'wave_interval' seconds; until then they keep the handler they
+  # had. Moving a switch removes only the flows installed by its old
+  # handler (unless delete_old is False, in which case they time out).
+  # Switches that connect meanwhile get the new handler right away.
+  def migrate_packetin_listener (self, handlerName = 'SW_IDEALPAIRSWITCH',
+                                 wave_size = 4, wave_interval = 5,
+                                 delete_old = True):
+    if handlerName not in self.swMap:
+      log.error("Unknown switch %s." % handlerName)
+      return
+    if self.listeners is None:
+      self.attach_packetin_listener(handlerName)
+      return
+
+    # Pin the connected switches to what they run now
+    for dpid in core.openflow._connections.keys():
+      if dpid not in self.switchHandlers:
+        self.switchHandlers[dpid] = self.handlerName
+        self.switchCookies[dpid] = self.owner.cookie
+
+    self.owner.new_generation()
+    self._set_handler_name(handlerName)
+
+    dpids = sorted(self.switchHandlers.keys())
+    for i in range(0, len(dpids), wave_size):
+      wave = dpids[i:i + wave_size]
+      args = [wave, handlerName, self.owner.cookie, delete_old]
+      if i == 0:
+        self._migrate_wave(*args)
+      else:
+        Timer((i // wave_size) * wave_interval, self._migrate_wave,
+          args=args)
+    log.debug("Migrating %i switch(es) to %s in waves of %i." %
+      (len(dpids), handlerName, wave_size))
 
   # Define various switch handlers
   swMap = {
@@ -312,15 +585,23 @@ class SwitchTutorial (object):
     'SW_BADSWITCH' : _handle_badswitch_packetin,
     'SW_PAIRSWITCH' : _handle_pairswitch_packetin,
     'SW_IDEALPAIRSWITCH' : _handle_idealpairswitch_packetin,
+    'SW_AGGSWITCH' : _handle_aggswitch_packetin,
   }
 
 
 # function that is invoked upon load to ensure that listeners are
 # registered appropriately. Uncomment the hub/switch you would like 
 # to test. Only one at a time please.
-def launch ():
+# The size and aging of the per-switch learning tables can be set with
+# --max_entries=<n> and --idle_timeout=<seconds>. --batch packs the
+# messages of one event into a single write (--batch_delay=<seconds>
+# holds them longer, --barrier adds a barrier request to each batch).
+def launch (max_entries = 4096, idle_timeout = 30, batch = False,
+            batch_delay = 0, barrier = False):
   # create new tutorial class object using the IDEAL PAIR SWITCH as default
-  MySwitch = SwitchTutorial('SW_IDEALPAIRSWITCH')
+  MySwitch = SwitchTutorial('SW_IDEALPAIRSWITCH', int(max_entries),
+    int(idle_timeout), str_to_bool(batch), float(batch_delay),
+    str_to_bool(barrier))
 
   # add this class into core.Interactive.variables to ensure we can access
   # it in the CLI.
@@ -33,6 +33,11 @@ THIS VERSION SUPPORT resend() functionality in the betta branch POX.
 # These next two imports are common POX convention
 from pox.core import core
 import pox.openflow.libopenflow_01 as of
+from flow_owner import FlowOwner, COOKIE_SW_TUTORIAL
+from pox.lib.addresses import EthAddr
+from pox.lib.util import dpidToStr
+from state_store import pack_port, unpack_port
+from packet_out import packet_out
 
 # Even a simple usage of the logger is much nicer than print!
 log = core.getLogger()
@@ -42,23 +47,63 @@ log = core.getLogger()
 # (In this case, we use a Connection object for the switch.)
 table = {}
 
-# Method for just sending a packet to any port (broadcast by default)
+# Learned MACs are also saved in the state store (when it is loaded)
+# under this namespace, and restored when a switch connects.
+STATE_NS = 'of_sw_tutorial'
+
+# Learns the port of a source MAC
+def _learn (event, mac):
+  table[(event.connection, mac)] = event.port
+  store = core.components.get('state_store')
+  if store is not None and not mac.is_multicast:
+    store.put(STATE_NS, event.dpid, mac.toRaw(), pack_port(event.port))
+
+# Warm start: restores what we had learned about a switch before
+def _handle_ConnectionUp (event):
+  store = core.components.get('state_store')
+  if store is None:
+    return
+  entries = store.get(STATE_NS, event.dpid)
+  for mac, port in entries.items():
+    table[(event.connection, EthAddr(mac))] = unpack_port(port)
+  if entries:
+    log.info("Restored %i MAC(s) of %s", len(entries),
+      dpidToStr(event.dpid))
+
+# Tags our flows with our cookie and keeps track of them, so that
+# clear_own_flows() can remove just those. Set in launch().
+owner = None
+
+def _send (connection, msg):
+  if owner is not None:
+    owner.tag(connection, msg)
+  connection.send(msg)
+
+# Removes the flows we installed on a switch (and only those)
+def clear_own_flows (connection):
+  return owner.delete(connection)
+
+# Sends a flow_mod unless the very same flow is already on the switch
+# (the PacketIn was in flight while it was installed), in which case the
+# packet is just resent to 'dst_port'. Returns False if suppressed.
+def _install (event, msg, dst_port = None):
+  if owner is not None and owner.duplicate(event.connection, msg):
+    if dst_port is not None:
+      resend_packet(event, dst_port)
+    return False
+  _send(event.connection, msg)
+  return True
+
+# Method for just sending a packet to any port (broadcast by default).
+# Uses the switch's buffer if it has the packet, else sends the data.
 def send_packet (event, dst_port = of.OFPP_ALL):
-  msg = of.ofp_packet_out(in_port=event.ofp.in_port)
-  if event.ofp.buffer_id != -1 and event.ofp.buffer_id is not None:
-    msg.buffer_id = event.ofp.buffer_id
-  else:
-    if event.ofp.data:
-      return
-    msg.data = event.ofp.data
-  msg.actions.append(of.ofp_action_output(port = dst_port))
-  event.connection.send(msg)
+  msg = packet_out(event.dpid, event.ofp, dst_port)
+  if msg is None:
+    return
+  _send(event.connection, msg)
 
-# Optimal method for resending a packet
-def resend_packet (event, dst_port = of.OFPP_ALL):
-  msg = of.ofp_packet_out(data = event.ofp)
-  msg.actions.append(of.ofp_action_output(port = dst_port))
-  event.connection.send(msg)
+# Method for resending a packet; the same as send_packet() now
+resend_packet = send_packet
 
 # DUMB HUB Implementation
 # This is an implementation of a broadcast hub but all packets go 
@@ -84,7 +129,7 @@ def _handle_pairhub_packetin (event):
   msg.match.dl_src = packet.src
   msg.match.dl_dst = packet.dst
   msg.actions.append(of.ofp_action_output(port = of.OFPP_ALL))
-  event.connection.send(msg)
+  _send(event.connection, msg)
 
   log.debug("Installing %s.%i -> %s.%i" %
     (packet.src, event.ofp.in_port, packet.dst, of.OFPP_ALL))
@@ -100,7 +145,7 @@ def _handle_lazyhub_packetin (event):
   msg.idle_timeout = 10
   msg.hard_timeout = 30
   msg.actions.append(of.ofp_action_output(port = of.OFPP_ALL))
-  event.connection.send(msg)
+  _send(event.connection, msg)
 
   log.debug("Installing %s.%i -> %s.%i" %
     ("ff:ff:ff:ff:ff:ff", event.ofp.in_port, "ff:ff:ff:ff:ff:ff", of.OFPP_ALL))
@@ -112,7 +157,7 @@ def _handle_badswitch_packetin (event):
   packet = event.parsed
 
   # Learn the source and fill up routing table
-  table[(event.connection,packet.src)] = event.port
+  _learn(event, packet.src)
 
   # install appropriate flow rule when learned
   msg = of.ofp_flow_mod()
@@ -120,7 +165,7 @@ def _handle_badswitch_packetin (event):
   msg.hard_timeout = 30
   msg.match.dl_dst = packet.src
   msg.actions.append(of.ofp_action_output(port = event.port))
-  event.connection.send(msg)
+  _send(event.connection, msg)
 
   log.debug("Installing %s.%i -> %s.%i" %
     ("ff:ff:ff:ff:ff:ff", event.ofp.in_port, packet.src, event.port))
@@ -157,7 +202,7 @@ def _handle_pairswitch_packetin (event):
   packet = event.parsed
 
   # Learn the source and fill up routing table
-  table[(event.connection,packet.src)] = event.port
+  _learn(event, packet.src)
   dst_port = table.get((event.connection,packet.dst))
 
   if dst_port is None:
@@ -181,7 +226,8 @@ def _handle_pairswitch_packetin (event):
     msg.match.dl_src = packet.src
     msg.match.dl_dst = packet.dst
     msg.actions.append(of.ofp_action_output(port = dst_port))
-    event.connection.send(msg)
+    if not _install(event, msg, dst_port):
+      return
 
     log.debug("Installing %s.%i -> %s.%i" %
       (packet.src, event.ofp.in_port, packet.dst, dst_port))
@@ -193,7 +239,7 @@ def _handle_idealpairswitch_packetin (event):
   packet = event.parsed
 
   # Learn the source and fill up routing table
-  table[(event.connection,packet.src)] = event.port
+  _learn(event, packet.src)
   dst_port = table.get((event.connection,packet.dst))
 
   if dst_port is None:
@@ -216,7 +262,7 @@ def _handle_idealpairswitch_packetin (event):
     msg.match.dl_dst = packet.src
     msg.match.dl_src = packet.dst
     msg.actions.append(of.ofp_action_output(port = event.port))
-    event.connection.send(msg)
+    _install(event, msg)
     
     # This is the packet that just came in -- we want to
     # install the rule and also resend the packet.
@@ -227,7 +273,8 @@ def _handle_idealpairswitch_packetin (event):
     msg.match.dl_src = packet.src
     msg.match.dl_dst = packet.dst
     msg.actions.append(of.ofp_action_output(port = dst_port))
-    event.connection.send(msg)
+    if not _install(event, msg, dst_port):
+      return
 
     log.debug("Installing %s.%i -> %s.%i AND %s.%i -> %s.%i" %
       (packet.dst, dst_port, packet.src, event.ofp.in_port,
@@ -238,6 +285,9 @@ def _handle_idealpairswitch_packetin (event):
 # registered appropriately. Uncomment the hub/switch you would like 
 # to test. Only one at a time please.
 def launch ():
+  global owner
+  owner = FlowOwner(COOKIE_SW_TUTORIAL)
+
   #core.openflow.addListenerByName("PacketIn", _handle_dumbhub_packetin)
   #core.openflow.addListenerByName("PacketIn", _handle_pairhub_packetin)
   #core.openflow.addListenerByName("PacketIn", _handle_lazyhub_packetin)
@@ -245,5 +295,6 @@ def launch ():
   #core.openflow.addListenerByName("PacketIn", _handle_pairswitch_packetin)
   core.openflow.addListenerByName("PacketIn", 
     _handle_idealpairswitch_packetin)
+  core.openflow.addListenerByName("ConnectionUp", _handle_ConnectionUp)
 
   log.info("Switch Tutorial is running.")
@@ -22,31 +22,84 @@ It acts as a simple hub, but can be modified to act like an L2
 learning switch.
 
 It's quite similar to the one for NOX.  Credit where credit due. :)
+
+With --mode=hybrid it forwards on destination MACs. When a switch
+connects, flows for the hosts known to be behind it are installed right
+away; unknown hosts are still learned reactively. Host locations are
+kept across reconnects, and across restarts when samples.state_store is
+loaded too, so a restarted controller does not have to flood to find
+them again.
 """
 
 from pox.core import core
 import pox.openflow.libopenflow_01 as of
+from pox.lib.addresses import EthAddr
+from pox.lib.util import dpidToStr
+from learning_table import HostLocations, int_to_mac
+from flow_owner import FlowOwner, COOKIE_SWITCH_FLOW
+from state_store import pack_port, unpack_port
+from packet_out import packet_out
 
 log = core.getLogger()
 
+# Forwarding mode ('hub', 'switch' or 'hybrid'). Set by launch().
+forwarding_mode = 'switch'
+
+# Host locations by dpid, kept when a switch reconnects
+locations = HostLocations()
+
+# Host locations are also saved in the state store (when it is loaded)
+# under this namespace
+STATE_NS = 'of_switch_flow'
+
+# Timeouts of the per-host flows of the hybrid mode. The hard timeout
+# bounds how long a host that moved without us noticing stays
+# unreachable.
+HOST_IDLE_TIMEOUT = 60
+HOST_HARD_TIMEOUT = 300
 
 
 class Tutorial (object):
   """
   A Tutorial object is created for each switch that connects.
-  A Connection object for that switch is passed to the __init__ function.
+  A Connection object for that switch is passed to the __init__ function,
+  along with the FlowOwner that tags and tracks the flows we install.
   """
-  def __init__ (self, connection):
+  def __init__ (self, connection, owner):
     # Keep track of the connection to the switch so that we can
     # send it messages!
     self.connection = connection
+    self.owner = owner
 
     # This binds our PacketIn event listener
     connection.addListeners(self)
 
     # Use this table to keep track of which ethernet address is on
-    # which switch port (keys are MACs, values are ports).
-    self.mac_to_port = {}
+    # which switch port (keys are MACs, values are ports). MACs are
+    # stored as 48-bit integers, so we look them up by their raw bytes.
+    self.mac_to_port = locations.table(connection.dpid)
+
+    # Warm start from what was learned before a restart
+    self.store = core.components.get('state_store')
+    if self.store is not None and not self.mac_to_port:
+      entries = self.store.get(STATE_NS, connection.dpid)
+      for mac, port in entries.items():
+        self.mac_to_port.learn(mac, unpack_port(port))
+      if entries:
+        log.info("Restored %i host location(s) of %s", len(entries),
+          dpidToStr(connection.dpid))
+
+    if forwarding_mode == 'hybrid':
+      self.install_known_hosts()
+
+
+  def learn (self, mac, port):
+    """
+    Records the port of a source MAC (given as raw bytes).
+    """
+    self.mac_to_port.learn(mac, port)
+    if self.store is not None:
+      self.store.put(STATE_NS, self.connection.dpid, mac, pack_port(port))
 
 
   def send_packet (self, buffer_id, raw_data, out_port, in_port):
@@ -77,6 +130,17 @@ class Tutorial (object):
     self.connection.send(msg)
 
 
+  def resend_packet (self, packet_in, out_port):
+    """
+    Sends the packet of a PacketIn out of the specified switch port: by
+    its buffer_id if the switch buffered it, else with its data if the
+    switch sent all of it.
+    """
+    msg = packet_out(self.connection.dpid, packet_in, out_port)
+    if msg is not None:
+      self.connection.send(msg)
+
+
   def act_like_hub (self, packet, packet_in):
     """
     Implement hub-like behavior -- send all packets to all ports besides
@@ -98,7 +162,7 @@ class Tutorial (object):
     msg.hard_timeout = 30
     msg.actions.append(of.ofp_action_output(port = of.OFPP_FLOOD))
     msg.buffer_id = packet_in.buffer_id
-    self.connection.send(msg)
+    self.owner.send(self.connection, msg)
 
     # Note that if we didn't get a valid buffer_id, a slightly better
     # implementation would check that we got the full data before
@@ -114,12 +178,13 @@ class Tutorial (object):
     # switch.  You'll need to rewrite it as real Python code.
 
     # Learn the port for the source MAC
-    self.mac_to_port[str(packet.src)] = packet_in.in_port 
+    self.learn(packet.src.toRaw(), packet_in.in_port)
 
-    if str(packet.dst) in self.mac_to_port:
+    port = self.mac_to_port.get(packet.dst.toRaw())
+    if port is not None:
       # Send packet out the associated port
       #self.send_packet(packet_in.buffer_id, packet_in.data,
-      #                 self.mac_to_port[str(packet.dst)], packet_in.in_port)
+      #                 port, packet_in.in_port)
 
       # Once you have the above working, try pushing a flow entry
       # instead of resending the packet (comment out the above and
@@ -127,11 +192,10 @@ class Tutorial (object):
 
       #log.debug("Installing flow: from " + str(packet_in.in_port))
       # Maybe the log statement should have source/destination/port?
-      port = self.mac_to_port[str(packet.dst)]
       log.debug("installing flow for %s.%i -> %s.%i" %
              (packet.src, packet_in.in_port, packet.dst, port))
 
-"""
+      """
       # create new flow with match record set to match entire record
       # what is wrong with this?
       msg = of.ofp_flow_mod()
@@ -141,8 +205,8 @@ class Tutorial (object):
       msg.actions.append(of.ofp_action_output(port = port))
       msg.buffer_id = packet_in.buffer_id
       self.connection.send(msg)
-"""
-"""
+      """
+      """
       # create new flow with match record set to only match destination
       # what is wrong with this?
       msg = of.ofp_flow_mod()
@@ -152,7 +216,7 @@ class Tutorial (object):
       msg.actions.append(of.ofp_action_output(port = port))
       msg.buffer_id = packet_in.buffer_id
       self.connection.send(msg)
-"""
+      """
 
       # create new flow with match record set to only match destination
       # what is wrong with this?
@@ -163,7 +227,7 @@ class Tutorial (object):
       msg.hard_timeout = 30
       msg.actions.append(of.ofp_action_output(port = port))
       msg.buffer_id = packet_in.buffer_id
-      self.connection.send(msg)
+      self.owner.send(self.connection, msg)
 
       #msg = of.ofp_flow_mod()
       #
@@ -185,14 +249,82 @@ class Tutorial (object):
       #  msg.data = packet_in.data
 
       # Add an action to send to the specified port
-      #action = of.ofp_action_output(port = self.mac_to_port[str(packet.dst)])
+      #action = of.ofp_action_output(port = port)
       #msg.actions.append(action)
 
     else:
       # Flood the packet out everything but the input port
       # This part looks familiar, right?
-      self.send_packet(packet_in.buffer_id, packet_in.data,
-                       of.OFPP_FLOOD, packet_in.in_port)
+      self.resend_packet(packet_in, of.OFPP_FLOOD)
+
+  def host_flow (self, mac, port):
+    """
+    Returns the flow that sends everything for 'mac' to 'port'.
+    """
+    msg = of.ofp_flow_mod()
+    msg.match.dl_dst = mac
+    msg.idle_timeout = HOST_IDLE_TIMEOUT
+    msg.hard_timeout = HOST_HARD_TIMEOUT
+    msg.actions.append(of.ofp_action_output(port = port))
+    return msg
+
+
+  def install_known_hosts (self):
+    """
+    Proactively installs a flow for every host we know is behind this
+    switch.
+    """
+    hosts = self.mac_to_port.items()
+    for mac, port in hosts:
+      self.owner.send(self.connection,
+        self.host_flow(EthAddr(int_to_mac(mac)), port))
+    if hosts:
+      log.debug("Installed flows for %i known host(s) on %s",
+        len(hosts), dpidToStr(self.connection.dpid))
+
+
+  def act_like_hybrid (self, packet, packet_in):
+    """
+    Forward on the destination MAC only, with flows installed ahead of
+    time for known hosts; learn unknown hosts reactively.
+    """
+    in_port = packet_in.in_port
+    src = packet.src.toRaw()
+    if not packet.src.is_multicast:
+      old_port = self.mac_to_port.get(src)
+      self.learn(src, in_port)
+      if old_port is not None and old_port != in_port:
+        # The source moved; point its flow at the new port
+        log.debug("%s moved from port %i to %i", packet.src, old_port,
+          in_port)
+        self.owner.send(self.connection, self.host_flow(packet.src,
+          in_port))
+
+    port = self.mac_to_port.get(packet.dst.toRaw())
+    if port is None:
+      self.resend_packet(packet_in, of.OFPP_FLOOD)
+      # Packets to the source go straight to it, so its flow has to go
+      # for the answer to reach us and tell us where the destination is.
+      if not packet.src.is_multicast:
+        self.owner.remove(self.connection, of.ofp_match(dl_dst =
+          packet.src))
+      return
+
+    msg = self.host_flow(packet.dst, port)
+    if self.owner.duplicate(self.connection, msg):
+      # Sent while this packet was on its way
+      self.resend_packet(packet_in, port)
+      return
+    log.debug("installing flow for * -> %s.%i" % (packet.dst, port))
+    msg.buffer_id = packet_in.buffer_id
+    self.owner.send(self.connection, msg)
+
+
+  def clear_own_flows (self):
+    """
+    Removes the flows we installed on this switch (and only those).
+    """
+    return self.owner.delete(self.connection)
 
   def _handle_PortStatus (self, event):
     """
@@ -217,6 +349,13 @@ class Tutorial (object):
 
     packet_in = event.ofp # The actual ofp_packet_in message.
 
+    if forwarding_mode == 'hybrid':
+      self.act_like_hybrid(packet, packet_in)
+      return
+    if forwarding_mode == 'hub':
+      self.act_like_hub(packet, packet_in)
+      return
+
     # Comment out the following line and uncomment the one after
     # when starting the exercise.
     #self.act_like_hub(packet, packet_in)
@@ -224,11 +363,17 @@ class Tutorial (object):
 
 
 
-def launch ():
+def launch (mode = 'switch'):
   """
   Starts the component
   """
+  global forwarding_mode
+  if mode not in ('hub', 'switch', 'hybrid'):
+    raise RuntimeError("Unknown forwarding mode: %s" % (mode,))
+  forwarding_mode = mode
+
+  owner = FlowOwner(COOKIE_SWITCH_FLOW)
   def start_switch (event):
     log.debug("Controlling %s" % (event.connection,))
-    Tutorial(event.connection)
+    Tutorial(event.connection, owner)
   core.openflow.addListenerByName("ConnectionUp", start_switch)
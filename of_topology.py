@@ -0,0 +1,263 @@
+#!/usr/bin/python
+# Copyright 2012 William Yu
+# wyu@ateneo.edu
+#
+# This file is part of POX.
+#
+# POX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# POX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with POX. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Loop-free flooding over a spanning tree.
+
+Builds the switch topology from the links found by openflow.discovery
+and keeps a spanning tree over it. Flooding a packet (see flood_actions()
+and packet_out.packet_out() with OFPP_ALL/OFPP_FLOOD) sends it out of
+the host ports of a switch and of its tree ports only, so redundant
+links (as in mininet/fanout.py or mininet/linear.py) cannot make
+broadcasts loop.
+
+The tree is kept up to date incrementally: a link between two parts of
+the network joins them through that link, a link within one part is
+left off the tree, and only removing a tree link recomputes the tree,
+and only for the switches that were connected through it. Ports that
+go down (PortStatus) take their links along right away instead of
+waiting for discovery to time them out.
+
+A port is only flooded to once it has been up for --hold_down seconds,
+so that discovery has had the time to tell whether a switch is on the
+other side.
+
+The same graph feeds a paths.PathEngine (topology.paths), whose cached
+shortest paths are invalidated link by link as the graph changes (see
+samples.of_path_switch).
+
+Command Line: ./pox.py openflow.discovery samples.of_topology
+                [--hold_down=10] samples.of_sw_tutorial
+"""
+
+import time
+
+from pox.core import core
+import pox.openflow.libopenflow_01 as of
+from pox.lib.util import dpidToStr
+from paths import PathEngine
+
+log = core.getLogger()
+
+
+class Topology (object):
+  """
+  Switch ports, the links between them and a spanning tree over them.
+  """
+  def __init__ (self, hold_down = 10):
+    self.hold_down = hold_down
+
+    self.ports = {}       # dpid -> {port: time it came up}
+    self.adj = {}         # dpid -> {port: (dpid on the other side, port)}
+    self.tree = {}        # dpid -> set of ports on the spanning tree
+    self.root = {}        # dpid -> lowest dpid of its part of the network
+
+    self._flood = {}      # dpid -> [(port, output action)] (cache)
+
+    self.paths = PathEngine(self.adj)
+
+  def add_switch (self, dpid, ports):
+    now = time.time()
+    self.ports[dpid] = dict((p, now) for p in ports if p < of.OFPP_MAX)
+    self.adj.setdefault(dpid, {})
+    self.tree.setdefault(dpid, set())
+    self.root.setdefault(dpid, dpid)
+    self._changed([dpid])
+
+  def remove_switch (self, dpid):
+    for port in list(self.adj.get(dpid, {})):
+      self.remove_link(dpid, port)
+    for d in (self.ports, self.adj, self.tree, self.root, self._flood):
+      d.pop(dpid, None)
+    self.paths.switch_removed(dpid)
+
+  def port_up (self, dpid, port):
+    ports = self.ports.get(dpid)
+    if ports is not None and port < of.OFPP_MAX and port not in ports:
+      ports[port] = time.time()
+      self._changed([dpid])
+
+  def port_down (self, dpid, port):
+    ports = self.ports.get(dpid)
+    if ports is not None:
+      ports.pop(port, None)
+    self.remove_link(dpid, port)
+    self._changed([dpid])
+
+  def add_link (self, dpid1, port1, dpid2, port2):
+    if dpid1 not in self.adj or dpid2 not in self.adj:
+      return
+    if self.adj[dpid1].get(port1) == (dpid2, port2):
+      return
+    # A port has at most one link
+    self.remove_link(dpid1, port1)
+    self.remove_link(dpid2, port2)
+    self.adj[dpid1][port1] = (dpid2, port2)
+    self.adj[dpid2][port2] = (dpid1, port1)
+    self.paths.link_added(dpid1, port1, dpid2, port2)
+
+    r1, r2 = self.root[dpid1], self.root[dpid2]
+    if r1 != r2:
+      # Joins two parts of the network; the link becomes a tree link
+      self.tree[dpid1].add(port1)
+      self.tree[dpid2].add(port2)
+      root = min(r1, r2)
+      other = r2 if root == r1 else r1
+      for dpid, r in self.root.items():
+        if r == other:
+          self.root[dpid] = root
+      log.debug("Tree link %s.%i <-> %s.%i", dpidToStr(dpid1), port1,
+        dpidToStr(dpid2), port2)
+    else:
+      log.debug("Blocked link %s.%i <-> %s.%i", dpidToStr(dpid1), port1,
+        dpidToStr(dpid2), port2)
+    self._changed([dpid1, dpid2])
+
+  def remove_link (self, dpid, port):
+    other = self.adj.get(dpid, {}).pop(port, None)
+    if other is None:
+      return
+    dpid2, port2 = other
+    self.adj.get(dpid2, {}).pop(port2, None)
+    self.paths.link_removed(dpid, port, dpid2, port2)
+    on_tree = port in self.tree.get(dpid, ())
+    self.tree.get(dpid, set()).discard(port)
+    self.tree.get(dpid2, set()).discard(port2)
+    if on_tree:
+      # The part of the network may have split, or have another way
+      # to connect through a link that was blocked
+      if dpid2 not in self._rebuild(dpid):
+        self._rebuild(dpid2)
+    self._changed([dpid, dpid2])
+
+  def _rebuild (self, start):
+    """
+    Recomputes the tree of the switches reachable from 'start' (a
+    breadth-first search from the lowest dpid among them). Returns the
+    set of those switches.
+    """
+    if start not in self.adj:
+      return set()
+    seen = set([start])
+    todo = [start]
+    while todo:
+      dpid = todo.pop()
+      for d, _ in self.adj[dpid].values():
+        if d not in seen and d in self.adj:
+          seen.add(d)
+          todo.append(d)
+    root = min(seen)
+    for dpid in seen:
+      self.tree[dpid] = set()
+      self.root[dpid] = root
+    visited = set([root])
+    queue = [root]
+    for dpid in queue:
+      for port, (d, p) in sorted(self.adj[dpid].items()):
+        if d in visited or d not in seen:
+          continue
+        visited.add(d)
+        queue.append(d)
+        self.tree[dpid].add(port)
+        self.tree[d].add(p)
+    self._changed(seen)
+    log.debug("Rebuilt the spanning tree of %i switch(es) under %s",
+      len(seen), dpidToStr(root))
+    return seen
+
+  def _changed (self, dpids):
+    for dpid in dpids:
+      self._flood.pop(dpid, None)
+
+  def is_link_port (self, dpid, port):
+    """
+    True if 'port' leads to another switch (as opposed to hosts).
+    """
+    return port in self.adj.get(dpid, ())
+
+  def is_flood_port (self, dpid, port):
+    """
+    True if floods may go out of 'port': it is on the tree, or it leads
+    to hosts and has been up for hold_down seconds.
+    """
+    if port in self.tree.get(dpid, ()):
+      return True
+    if port in self.adj.get(dpid, ()):
+      return False
+    up = self.ports.get(dpid, {}).get(port)
+    return up is not None and time.time() - up >= self.hold_down
+
+  def flood_actions (self, dpid, in_port):
+    """
+    Returns the output actions that flood a packet that came in on
+    'in_port' of 'dpid'.
+    """
+    ports = self._flood.get(dpid)
+    if ports is None:
+      ports = [(p, of.ofp_action_output(port = p))
+               for p in sorted(self.ports.get(dpid, ()))
+               if self.is_flood_port(dpid, p)]
+      # Ports in their hold-down change on their own, so only cache
+      # once they are all out of it
+      if all(self.is_flood_port(dpid, p) or p in self.adj.get(dpid, ())
+             for p in self.ports.get(dpid, ())):
+        self._flood[dpid] = ports
+    return [a for p, a in ports if p != in_port]
+
+  def show (self):
+    for dpid in sorted(self.adj):
+      log.info("%s: tree ports %s, blocked %s, host ports %s",
+        dpidToStr(dpid), sorted(self.tree.get(dpid, ())),
+        sorted(p for p in self.adj[dpid] if p not in self.tree[dpid]),
+        sorted(p for p in self.ports.get(dpid, ())
+               if p not in self.adj[dpid]))
+
+  def _handle_ConnectionUp (self, event):
+    self.add_switch(event.dpid, [p.port_no for p in event.ofp.ports])
+
+  def _handle_ConnectionDown (self, event):
+    self.remove_switch(event.dpid)
+
+  def _handle_PortStatus (self, event):
+    if event.deleted or event.ofp.desc.state & of.OFPPS_LINK_DOWN:
+      self.port_down(event.dpid, event.port)
+    else:
+      self.port_up(event.dpid, event.port)
+
+  def _handle_LinkEvent (self, event):
+    l = event.link
+    if event.added:
+      self.add_link(l.dpid1, l.port1, l.dpid2, l.port2)
+    elif event.removed:
+      self.remove_link(l.dpid1, l.port1)
+
+
+def launch (hold_down = 10):
+  topology = Topology(float(hold_down))
+  core.register("of_topology", topology)
+
+  def start ():
+    for connection in core.openflow._connections.values():
+      topology.add_switch(connection.dpid,
+        [p.port_no for p in connection.features.ports])
+    core.openflow.addListeners(topology)
+    core.openflow_discovery.addListenerByName("LinkEvent",
+      topology._handle_LinkEvent)
+    log.info("Flooding over a spanning tree.")
+  core.call_when_ready(start, ["openflow", "openflow_discovery"])
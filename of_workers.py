@@ -0,0 +1,430 @@
+#!/usr/bin/python
+# Copyright 2012 William Yu
+# wyu@ateneo.edu
+#
+# This file is part of POX.
+#
+# POX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# POX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with POX. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+PacketIn processing in worker processes, sharded by switch.
+
+POX runs every event handler on one cooperative loop, so a busy switch
+delays all the others and only one core is ever used. This component
+keeps the OpenFlow connections in the POX process (the front end) and
+hands the PacketIns of each switch to one of --workers processes
+(dpid modulo the number of workers), so the switches of different
+shards are handled on different cores.
+
+The front end does not even parse the packets: it queues the dpid, port,
+buffer ID and data of each PacketIn, and the worker parses the packet,
+runs the logic of its switches and queues back the packed OpenFlow
+messages to send. A thread of the front end hands those to the
+connections through core.callLater(). The results of everything a
+worker found in its queue are sent back as one batch.
+
+--logic selects what the workers run:
+  switch    the learning switch of the tutorials (Tutorial in
+            of_switch_flow, SwitchTutorial in of_sw_tutorial_oo): flows
+            on (dl_src, dl_dst), unknown destinations flooded
+  firewall  the noisy firewall of of_firewall: IP packets are checked
+            against the rules of their switch before being switched,
+            with flows for both directions as of_firewall installs;
+            AddRule()/DeleteRule() of this module send rules to the
+            worker of that switch
+
+Load this instead of those components:
+  ./pox.py samples.of_workers --workers=4 [--logic=switch|firewall]
+
+The queues are multiprocessing.Queues. Only plain tuples and bytes go
+through them, so no POX object crosses a process boundary. Each worker
+keeps the state of its own switches only. A worker that dies is
+restarted by the front end; the firewall rules, which the front end
+keeps as well (and saves in samples.state_store like of_firewall), are
+sent to it again, while what it had learned is lost.
+"""
+
+import ast
+import multiprocessing
+import threading
+import time
+import traceback
+
+try:
+  from Queue import Empty
+except ImportError:
+  from queue import Empty
+
+from pox.core import core
+import pox.openflow.libopenflow_01 as of
+from pox.lib.util import dpidToStr
+from pox.lib.recoco import Timer
+from learning_table import LearningTables
+
+log = core.getLogger()
+
+# Values meaning "not buffered" in the buffer_id of a PacketIn
+_NO_BUFFER = (None, -1, 0xffffffff)
+
+# The Workers front end. Set by launch().
+front_end = None
+
+# Seconds between checks that the workers are alive
+CHECK_INTERVAL = 5
+
+# Seconds the POX loop waits in all for the workers to exit on shutdown
+SHUTDOWN_WAIT = 0.2
+
+# Namespace of the firewall rules in samples.state_store (the same as
+# of_firewall's, so either component restores the other's rules)
+STATE_NS = 'of_firewall'
+
+
+def _resend (in_port, buffer_id, total_len, data, port):
+  """
+  Returns the packet_outs that send a packet back out of 'port' (none
+  if it was not buffered and its data is incomplete).
+  """
+  msg = of.ofp_packet_out(in_port = in_port)
+  if buffer_id not in _NO_BUFFER:
+    msg.buffer_id = buffer_id
+  elif data and len(data) == total_len:
+    msg.data = data
+  else:
+    return []
+  msg.actions.append(of.ofp_action_output(port = port))
+  return [msg]
+
+
+class SwitchLogic (object):
+  """
+  Learning switch state and decisions for the switches of one worker.
+  """
+  def __init__ (self):
+    self.tables = LearningTables()
+
+  def forget (self, dpid):
+    self.tables.remove(dpid)
+
+  def forward (self, dpid, in_port, buffer_id, total_len, data, packet,
+               match):
+    """
+    Learns the source and returns the messages that forward the packet
+    with a flow on 'match' (or flood it).
+    """
+    table = self.tables.table(dpid)
+    if not packet.src.is_multicast:
+      table.learn(packet.src.toRaw(), in_port)
+    port = None
+    if not packet.dst.is_multicast:
+      port = table.get(packet.dst.toRaw())
+    if port is None:
+      return _resend(in_port, buffer_id, total_len, data, of.OFPP_FLOOD)
+    if port == in_port:
+      return []
+    msg = of.ofp_flow_mod(match = match)
+    msg.idle_timeout = 10
+    msg.hard_timeout = 30
+    msg.actions.append(of.ofp_action_output(port = port))
+    if buffer_id not in _NO_BUFFER:
+      msg.buffer_id = buffer_id
+      return [msg]
+    return [msg] + _resend(in_port, buffer_id, total_len, data, port)
+
+  def packet_in (self, dpid, in_port, buffer_id, total_len, data, packet):
+    match = of.ofp_match(dl_src = packet.src, dl_dst = packet.dst)
+    return self.forward(dpid, in_port, buffer_id, total_len, data, packet,
+                        match)
+
+
+class FirewallLogic (SwitchLogic):
+  """
+  The noisy firewall: only allowed IP packets are switched.
+  """
+  def __init__ (self):
+    SwitchLogic.__init__(self)
+    self.rules = {}     # dpid -> of_firewall.RuleIndex
+
+  def add_rule (self, dpid, *rule):
+    from of_firewall import RuleIndex
+    index = self.rules.get(dpid)
+    if index is None:
+      index = self.rules[dpid] = RuleIndex()
+    index.add(*rule)
+
+  def remove_rule (self, dpid, *key):
+    index = self.rules.get(dpid)
+    if index is not None and key in index.rules:
+      index.remove(*key)
+
+  def packet_in (self, dpid, in_port, buffer_id, total_len, data, packet):
+    # Only IP packets are processed
+    if packet.type != packet.IP_TYPE:
+      return []
+    ip = packet.payload
+    # The transport source port (or ICMP type) is checked
+    tp_src = getattr(ip.payload, 'srcport', None)
+    if tp_src is None:
+      tp_src = getattr(ip.payload, 'type', 0)
+    index = self.rules.get(dpid)
+    if index is None or not index.allows(packet.type, ip.protocol, tp_src,
+                                         in_port):
+      return []
+    def match (port, src, dst):
+      m = of.ofp_match(dl_type = packet.type, nw_proto = ip.protocol,
+                       in_port = port, dl_src = src, dl_dst = dst)
+      if ip.protocol != 1:
+        m.tp_src = tp_src
+      return m
+    msgs = self.forward(dpid, in_port, buffer_id, total_len, data, packet,
+                        match(in_port, packet.src, packet.dst))
+    port = None
+    if not packet.dst.is_multicast:
+      port = self.tables.table(dpid).get(packet.dst.toRaw())
+    if port is None or port == in_port or \
+       not index.allows(packet.type, ip.protocol, tp_src, port):
+      return msgs
+    # Both ends are known: the way back gets its flow too
+    msg = of.ofp_flow_mod(match = match(port, packet.dst, packet.src))
+    msg.idle_timeout = 10
+    msg.hard_timeout = 30
+    msg.actions.append(of.ofp_action_output(port = in_port))
+    return [msg] + msgs
+
+
+LOGICS = {
+  'switch': SwitchLogic,
+  'firewall': FirewallLogic,
+}
+
+
+def _worker (logic_name, inbox, outbox):
+  """
+  Main loop of a worker process.
+  """
+  from pox.lib.packet.ethernet import ethernet
+  logic = LOGICS[logic_name]()
+  while True:
+    item = inbox.get()
+    results = []
+    while item is not None:
+      try:
+        if item[0] == 'packet':
+          _, dpid, in_port, buffer_id, total_len, data = item
+          packet = ethernet(data)
+          if packet.parsed:
+            msgs = logic.packet_in(dpid, in_port, buffer_id, total_len,
+                                   data, packet)
+            if msgs:
+              results.append((dpid, b''.join(m.pack() for m in msgs)))
+        else:
+          getattr(logic, item[0])(*item[1:])
+      except Exception:
+        # One bad item should not take the switches of the shard down
+        outbox.put(('error', item[0], traceback.format_exc()))
+      try:
+        item = inbox.get_nowait()
+      except Empty:
+        break
+    if results:
+      outbox.put(results)
+    if item is None:
+      return
+
+
+class Workers (object):
+  """
+  The front end: dispatches PacketIns to the workers and sends their
+  answers.
+  """
+  def __init__ (self, count, logic):
+    self.inboxes = [multiprocessing.Queue() for _ in range(count)]
+    self.outbox = multiprocessing.Queue()
+    self.dispatched = [0] * count
+    self.logic = logic
+    self.rules = {}     # dpid -> of_firewall.RuleIndex, for restarts
+    self.processes = [self._start(shard) for shard in range(count)]
+
+    t = threading.Thread(target = self._collect)
+    t.daemon = True
+    t.start()
+
+    core.openflow.addListenerByName("PacketIn", self._handle_PacketIn)
+    core.openflow.addListenerByName("ConnectionDown",
+      self._handle_ConnectionDown)
+    if logic == 'firewall':
+      core.openflow.addListenerByName("ConnectionUp",
+        self._handle_ConnectionUp)
+    core.addListenerByName("GoingDownEvent", self._handle_GoingDownEvent)
+    self._timer = Timer(CHECK_INTERVAL, self.check, recurring = True)
+
+  def _start (self, shard):
+    p = multiprocessing.Process(target = _worker,
+      args = (self.logic, self.inboxes[shard], self.outbox))
+    p.daemon = True
+    p.start()
+    for dpid, index in self.rules.items():
+      if self.shard(dpid) == shard:
+        for rule in index.sorted_rules():
+          self.inboxes[shard].put(('add_rule', dpid) + rule.key +
+                                  (rule.priority, rule.allow))
+    return p
+
+  def add_rule (self, dpid, dl_type, nw_proto, port, src_port,
+                priority = 0, allow = True):
+    from of_firewall import RuleIndex
+    index = self.rules.get(dpid)
+    if index is None:
+      index = self.rules[dpid] = RuleIndex()
+    rule = index.add(dl_type, nw_proto, port, src_port, priority, allow)
+    store = core.components.get('state_store')
+    if store is not None:
+      store.put(STATE_NS, dpid, repr(rule.key).encode('utf-8'),
+        repr((rule.priority, rule.allow, rule.rank[1])).encode('utf-8'))
+    self.send_to(dpid, 'add_rule', dpid, dl_type, nw_proto, port,
+                 src_port, priority, allow)
+
+  def remove_rule (self, dpid, *key):
+    """
+    Removes a rule. Raises KeyError if there is no such rule.
+    """
+    self.rules[dpid].remove(*key)
+    store = core.components.get('state_store')
+    if store is not None:
+      store.delete(STATE_NS, dpid, repr(key).encode('utf-8'))
+    self.send_to(dpid, 'remove_rule', dpid, *key)
+
+  def restore_rules (self, dpid):
+    """
+    Restores the rules saved for a switch before a restart, as
+    of_firewall does.
+    """
+    store = core.components.get('state_store')
+    if store is None or dpid in self.rules:
+      return
+    rules = []
+    for key, value in store.get(STATE_NS, dpid).items():
+      key = ast.literal_eval(key.decode('utf-8'))
+      priority, allow, seq = ast.literal_eval(value.decode('utf-8'))
+      rules.append((seq, key, priority, allow))
+    for seq, key, priority, allow in sorted(rules):
+      self.add_rule(dpid, *key, priority = priority, allow = allow)
+    if rules:
+      log.info("Restored %i firewall rule(s) of %s", len(rules),
+        dpidToStr(dpid))
+
+  def check (self):
+    """
+    Restarts the workers that died. Their switches get their rules
+    again but start over with no learned state.
+    """
+    for shard, p in enumerate(self.processes):
+      if not p.is_alive():
+        log.error("Worker %i (pid %s) died with exit code %s; restarting",
+          shard, p.pid, p.exitcode)
+        self.processes[shard] = self._start(shard)
+
+  def shard (self, dpid):
+    return dpid % len(self.inboxes)
+
+  def send_to (self, dpid, *item):
+    self.inboxes[self.shard(dpid)].put(item)
+
+  def _collect (self):
+    # Runs in its own thread; the sends are done by the POX loop
+    while True:
+      results = self.outbox.get()
+      if results is None:
+        return
+      if results[0] == 'error':
+        log.error("Worker failed on %s item:\n%s", results[1], results[2])
+        continue
+      core.callLater(self._send, results)
+
+  def _send (self, results):
+    for dpid, data in results:
+      connection = core.openflow.getConnection(dpid)
+      if connection is not None:
+        connection.send(data)
+
+  def _handle_PacketIn (self, event):
+    ofp = event.ofp
+    shard = self.shard(event.dpid)
+    self.dispatched[shard] += 1
+    self.inboxes[shard].put(('packet', event.dpid, ofp.in_port,
+      ofp.buffer_id, ofp.total_len, ofp.data))
+
+  def _handle_ConnectionUp (self, event):
+    self.restore_rules(event.dpid)
+
+  def _handle_ConnectionDown (self, event):
+    self.send_to(event.dpid, 'forget', event.dpid)
+
+  def _handle_GoingDownEvent (self, event):
+    self._timer.cancel()
+    for inbox in self.inboxes:
+      inbox.put(None)
+    # Give them a moment in all; they are daemons, so the ones still
+    # busy are killed on exit anyway
+    deadline = time.time() + SHUTDOWN_WAIT
+    for p in self.processes:
+      p.join(max(0, deadline - time.time()))
+    self.outbox.put(None)
+
+  def show_stats (self):
+    for shard, count in enumerate(self.dispatched):
+      log.info("Worker %i (pid %s): %i PacketIn(s) dispatched", shard,
+        self.processes[shard].pid, count)
+
+
+# Rules can be given for an event, a connection or a dpid
+def _dpid_of (target):
+  return getattr(target, 'dpid', target)
+
+def _firewall_front_end ():
+  if front_end is None or front_end.logic != 'firewall':
+    raise RuntimeError("Firewall rules need samples.of_workers "
+                       "--logic=firewall")
+  return front_end
+
+def AddRule (event, dl_type=0x800, nw_proto=1, port=0, src_port=of.OFPP_ALL,
+             priority=0, allow=True):
+  dpid = _dpid_of(event)
+  _firewall_front_end().add_rule(dpid, dl_type, nw_proto, port, src_port,
+                                 priority, allow)
+  log.debug("Adding firewall rule to %s: %s %s %s %s", dpidToStr(dpid),
+    dl_type, nw_proto, port, src_port)
+
+def DeleteRule (event, dl_type=0x800, nw_proto=1, port=0,
+                src_port=of.OFPP_ALL):
+  dpid = _dpid_of(event)
+  try:
+    _firewall_front_end().remove_rule(dpid, dl_type, nw_proto, port,
+                                      src_port)
+  except KeyError:
+    log.error("Cannot find in %s: %s %s %s %s", dpidToStr(dpid), dl_type,
+      nw_proto, port, src_port)
+    return
+  log.debug("Deleting firewall rule in %s: %s %s %s %s", dpidToStr(dpid),
+    dl_type, nw_proto, port, src_port)
+
+
+def launch (workers = None, logic = 'switch'):
+  global front_end
+  if logic not in LOGICS:
+    raise RuntimeError("Unknown logic: %s" % (logic,))
+  count = int(workers) if workers is not None else \
+    multiprocessing.cpu_count()
+  front_end = Workers(count, logic)
+  log.info("Handling PacketIns in %i %s worker(s)", count, logic)
@@ -0,0 +1,109 @@
+#!/usr/bin/python
+# Copyright 2012 William Yu
+# wyu@ateneo.edu
+#
+# This file is part of POX.
+#
+# POX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# POX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with POX. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Buffer-aware packet_out.
+
+packet_out() builds the ofp_packet_out that sends the packet of a
+PacketIn back out of the switch. If the switch buffered the packet, only
+the buffer_id is sent; the payload is attached only when there is no
+buffer, and then only if the switch sent all of it (a PacketIn without
+a buffer may be cut short to miss_send_len bytes). Counts are kept per
+switch so the bytes saved can be seen with show_usage().
+
+When samples.of_topology is loaded, packets sent to OFPP_ALL or
+OFPP_FLOOD only go out of the ports on its spanning tree (and the host
+ports), so floods cannot loop.
+
+  msg = packet_out(event.dpid, event.ofp, of.OFPP_ALL)
+  if msg is not None:
+    event.connection.send(msg)
+"""
+
+from pox.core import core
+import pox.openflow.libopenflow_01 as of
+from pox.lib.util import dpidToStr
+
+log = core.getLogger()
+
+# Values meaning "not buffered" in the buffer_id of a PacketIn
+_NO_BUFFER = (None, -1, 0xffffffff)
+
+# dpid -> [sent by buffer_id, sent with data, dropped as incomplete,
+#          payload bytes sent, payload bytes left on the switch]
+usage = {}
+
+# Whether _handle_ConnectionDown is listening yet. This module is only
+# imported by other components, so it starts listening on first use.
+_listening = False
+
+def _handle_ConnectionDown (event):
+  usage.pop(event.dpid, None)
+
+def _usage (dpid):
+  global _listening
+  u = usage.get(dpid)
+  if u is None:
+    if not _listening:
+      core.openflow.addListenerByName("ConnectionDown",
+        _handle_ConnectionDown)
+      _listening = True
+    u = usage[dpid] = [0, 0, 0, 0, 0]
+  return u
+
+def packet_out (dpid, ofp, port = of.OFPP_ALL, actions = None):
+  """
+  Returns an ofp_packet_out that sends the packet of an ofp_packet_in
+  from switch 'dpid' out of 'port' (or through 'actions'), or None if
+  the packet was not buffered and its data is incomplete.
+  """
+  u = _usage(dpid)
+  msg = of.ofp_packet_out(in_port = ofp.in_port)
+  if ofp.buffer_id not in _NO_BUFFER:
+    msg.buffer_id = ofp.buffer_id
+    u[0] += 1
+    u[4] += ofp.total_len
+  else:
+    data = ofp.data
+    if not data or len(data) != ofp.total_len:
+      u[2] += 1
+      return None
+    msg.data = data
+    u[1] += 1
+    u[3] += len(data)
+  if actions is None:
+    if port == of.OFPP_ALL or port == of.OFPP_FLOOD:
+      topology = core.components.get('of_topology')
+      if topology is not None:
+        actions = topology.flood_actions(dpid, ofp.in_port)
+  if actions is None:
+    msg.actions.append(of.ofp_action_output(port = port))
+  else:
+    msg.actions = actions
+  return msg
+
+def show_usage ():
+  for dpid, (buffered, unbuffered, incomplete, sent, saved) in \
+      usage.items():
+    connection = core.openflow.getConnection(dpid)
+    n_buffers = connection.features.n_buffers if connection else 0
+    log.info("%s (%i buffers): %i packet_out(s) by buffer_id (%i bytes "
+      "not resent), %i with data (%i bytes), %i incomplete dropped",
+      dpidToStr(dpid), n_buffers, buffered, saved, unbuffered, sent,
+      incomplete)
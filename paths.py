@@ -0,0 +1,204 @@
+#!/usr/bin/python
+# Copyright 2012 William Yu
+# wyu@ateneo.edu
+#
+# This file is part of POX.
+#
+# POX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# POX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with POX. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Shortest paths between switches.
+
+A PathEngine answers "which port of switch A leads towards switch B on a
+shortest path" for a graph given as dpid -> {port: (dpid, port)}. For
+every destination switch asked about, a breadth-first search from it
+gives the out port and hop count of every switch that can reach it (a
+sink tree). Because all switches share the sink tree of a destination,
+forwarding on the destination alone can never loop.
+
+Sink trees are cached (least recently used ones are dropped beyond
+'max_trees') and invalidated one by one when links change:
+  - a removed link only invalidates the trees that used it;
+  - an added link only invalidates the trees it makes shorter (its ends
+    are more than one hop apart in the tree, or only one end was
+    reachable); an equal-cost link leaves the tree alone.
+A path lookup on a cached tree just follows out ports, so it costs one
+dict lookup per hop.
+
+This module does not depend on POX. Running it directly prints a
+benchmark of tree builds and path lookups on a large random fabric.
+"""
+
+import time
+from collections import OrderedDict
+
+
+class PathEngine (object):
+  """
+  Cached shortest-path sink trees over a switch graph.
+  """
+  def __init__ (self, adj, max_trees = 4096):
+    # dpid -> {port: (dpid, port)}; owned and updated by the caller,
+    # who also tells us about the changes
+    self.adj = adj
+    self.max_trees = max_trees
+
+    # destination dpid -> {dpid: (out port, hops)}, least recent first
+    self._trees = OrderedDict()
+    self.builds = 0
+
+  def sink_tree (self, dst):
+    tree = self._trees.get(dst)
+    if tree is not None:
+      # Mark as recently used
+      del self._trees[dst]
+      self._trees[dst] = tree
+      return tree
+    tree = self._bfs(dst)
+    self._trees[dst] = tree
+    if len(self._trees) > self.max_trees:
+      self._trees.popitem(last = False)
+    return tree
+
+  def _bfs (self, dst):
+    self.builds += 1
+    adj = self.adj
+    tree = {dst: (None, 0)}
+    if dst not in adj:
+      return tree
+    frontier = [dst]
+    hops = 0
+    while frontier:
+      hops += 1
+      next_frontier = []
+      for dpid in frontier:
+        for d, p in adj[dpid].values():
+          # Port p of d leads to dpid, which is one hop closer to dst
+          if d not in tree and d in adj:
+            tree[d] = (p, hops)
+            next_frontier.append(d)
+      frontier = next_frontier
+    return tree
+
+  def cached (self, dst):
+    """
+    Returns the cached sink tree of 'dst' (None if there is none). A
+    tree is replaced, never changed, so a caller can tell whether one it
+    used still holds by comparing it to this.
+    """
+    return self._trees.get(dst)
+
+  def out_port (self, src, dst):
+    """
+    Returns the port of 'src' towards 'dst' (None if src is dst or dst
+    cannot be reached).
+    """
+    entry = self.sink_tree(dst).get(src)
+    return None if entry is None else entry[0]
+
+  def path (self, src, dst):
+    """
+    Returns [(dpid, out port), ...] from 'src' up to (not including)
+    'dst', or None if there is no path.
+    """
+    tree = self.sink_tree(dst)
+    if src not in tree:
+      return None
+    adj = self.adj
+    result = []
+    dpid = src
+    while dpid != dst:
+      port = tree[dpid][0]
+      result.append((dpid, port))
+      dpid = adj[dpid][port][0]
+    return result
+
+  def link_added (self, dpid1, port1, dpid2, port2):
+    for dst, tree in list(self._trees.items()):
+      e1 = tree.get(dpid1)
+      e2 = tree.get(dpid2)
+      if e1 is None and e2 is None:
+        continue
+      if e1 is None or e2 is None or abs(e1[1] - e2[1]) > 1:
+        del self._trees[dst]
+
+  def link_removed (self, dpid1, port1, dpid2, port2):
+    for dst, tree in list(self._trees.items()):
+      e1 = tree.get(dpid1)
+      e2 = tree.get(dpid2)
+      if (e1 is not None and e1[0] == port1) or \
+         (e2 is not None and e2[0] == port2):
+        del self._trees[dst]
+
+  def switch_removed (self, dpid):
+    # Its links are removed one by one; only its own tree is left
+    self._trees.pop(dpid, None)
+
+  def clear (self):
+    self._trees.clear()
+
+
+def _benchmark (switches = 2000, degree = 4, lookups = 100000):
+  """
+  Builds a random connected fabric and times sink tree builds, cached
+  path lookups and a link failure.
+  """
+  import random
+  random.seed(1)
+  adj = dict((d, {}) for d in range(1, switches + 1))
+  def link (a, b):
+    pa = len(adj[a]) + 1
+    pb = len(adj[b]) + 1
+    adj[a][pa] = (b, pb)
+    adj[b][pb] = (a, pa)
+  for d in range(2, switches + 1):
+    link(d, random.randint(1, d - 1))
+  for _ in range(switches * (degree - 2) // 2):
+    a, b = random.sample(range(1, switches + 1), 2)
+    link(a, b)
+
+  engine = PathEngine(adj)
+  dsts = random.sample(range(1, switches + 1), 100)
+  start = time.time()
+  for dst in dsts:
+    engine.sink_tree(dst)
+  build = (time.time() - start) / len(dsts)
+
+  pairs = [(random.randint(1, switches), random.choice(dsts))
+           for _ in range(lookups)]
+  start = time.time()
+  hops = 0
+  for src, dst in pairs:
+    hops += len(engine.path(src, dst))
+  lookup = (time.time() - start) / lookups
+
+  # Fail a link on some path and count the trees that had to go
+  src, dst = pairs[0]
+  p = engine.path(src, dst) or [(src, next(iter(adj[src])))]
+  a, pa = p[0]
+  b, pb = adj[a][pa]
+  del adj[a][pa]
+  del adj[b][pb]
+  before = len(engine._trees)
+  engine.link_removed(a, pa, b, pb)
+  invalidated = before - len(engine._trees)
+
+  print("%i switches, %i links: sink tree build %.2f ms, path lookup "
+    "%.1f us (%.1f hops on average), link failure invalidated %i of %i "
+    "trees" % (switches, sum(len(v) for v in adj.values()) // 2,
+    build * 1e3, lookup * 1e6, float(hops) / lookups, invalidated, before))
+
+
+if __name__ == '__main__':
+  _benchmark()
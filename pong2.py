@@ -20,22 +20,254 @@ A simple component that always replies to ARPs and pings.
 
 When running this component, pings (and pretty much nothing else!)
 should always work.
+
+Untagged ARP requests and ICMP echo requests are answered straight from
+the raw packet bytes: the reply is written into a pre-packed template
+(ARP) or a copy of the request (ICMP) with the addresses swapped and the
+ICMP checksum updated incrementally, without parsing the packet into
+objects. Anything else goes through the regular packet library. Use
+--fast=False to always take the regular path.
+
+With --offload, the IP/MAC/port of real hosts is learned per switch from
+the ARPs and IP packets they send (kept for --arp_ttl seconds). Packets
+to a learned host are then forwarded to it by flows, so the host answers
+ARPs and pings for itself: the first request for a known target installs
+the flows, later ones never reach the controller. Addresses that no host
+has claimed are still answered by the controller.
 """
 
+import struct
+import time
+
 from pox.core import core
 import pox.openflow.libopenflow_01 as of
 import pox.lib.packet as pkt
-from pox.lib.addresses import EthAddr
+from pox.lib.addresses import EthAddr, IPAddr
+from pox.lib.util import str_to_bool
+from hotlog import HotLog, lazy
+from packet_out import packet_out
 
 log = core.getLogger()
 
+# Logging for the PacketIn path; costs next to nothing when DEBUG is off
+hot = HotLog(log)
+
+# The MAC address we answer ARPs with
+ARP_REPLY_MAC = EthAddr("02:00:DE:AD:BE:EF")
+
+# Set by launch()
+fast_path = True
+
+# ARP reply template: Ethernet header followed by an IPv4-over-Ethernet
+# ARP reply from ARP_REPLY_MAC. Only the addresses are patched in.
+_arp_template = bytearray(
+  b'\x00' * 6 + ARP_REPLY_MAC.toRaw() + b'\x08\x06' +
+  b'\x00\x01\x08\x00\x06\x04\x00\x02' +
+  ARP_REPLY_MAC.toRaw() + b'\x00' * 4 + b'\x00' * 6 + b'\x00' * 4)
+
+# Packet out that all fast replies are sent with; it is packed by
+# connection.send() right away, so it can be reused.
+_reply_msg = of.ofp_packet_out()
+_reply_msg.actions.append(of.ofp_action_output(port = of.OFPP_IN_PORT))
+
+_ARP_REQUEST_HEAD = b'\x00\x01\x08\x00\x06\x04\x00\x01'
+
+# Set by launch()
+offload_hosts = False
+arp_cache_ttl = 60
+
+
+class ArpCache (object):
+  """
+  IP-to-(MAC, port) bindings learned on one switch. Addresses are kept
+  as raw bytes.
+  """
+  def __init__ (self, ttl):
+    self.ttl = ttl
+    self.entries = {}      # ip -> (mac, port, learned at)
+
+  def __len__ (self):
+    return len(self.entries)
+
+  def learn (self, ip, mac, port, now):
+    """
+    Records a binding. Returns True if it is new, changed, or old enough
+    that the flows for it should be refreshed.
+    """
+    entry = self.entries.get(ip)
+    if (entry is not None and entry[0] == mac and entry[1] == port
+        and now - entry[2] < self.ttl / 2.0):
+      return False
+    self.entries[ip] = (mac, port, now)
+    return True
+
+  def lookup (self, ip, now):
+    entry = self.entries.get(ip)
+    if entry is None:
+      return None
+    if now - entry[2] > self.ttl:
+      del self.entries[ip]
+      return None
+    return entry
+
+# ARP caches of all switches (dpid -> ArpCache)
+caches = {}
+
+_NO_IP = b'\x00' * 4
+
+
+def _offload_flow (event, match, actions):
+  msg = of.ofp_flow_mod(match = match)
+  msg.idle_timeout = arp_cache_ttl
+  msg.hard_timeout = arp_cache_ttl
+  msg.actions = actions
+  event.connection.send(msg)
+
+def _learn (event, cache, ip, mac, now):
+  if ip == _NO_IP or mac == ARP_REPLY_MAC.toRaw():
+    return
+  if not cache.learn(ip, mac, event.port, now):
+    return
+  # Forward everything for this host to it; this also carries the
+  # host's own answers back to whoever asked.
+  match = of.ofp_match(dl_dst = EthAddr(mac))
+  _offload_flow(event, match,
+    [of.ofp_action_output(port = event.port)])
+  hot.debug("Learned %s at %s.%i", lazy(IPAddr, ip), EthAddr(mac),
+    event.port)
+
+def _offload (event):
+  """
+  Learns hosts from a packet and hands requests for learned hosts over
+  to them. Returns True if the packet was forwarded to the host.
+  """
+  data = event.ofp.data
+  if data is None or len(data) < 42:
+    return False
+  now = time.time()
+  cache = caches.get(event.dpid)
+  if cache is None:
+    cache = caches[event.dpid] = ArpCache(arp_cache_ttl)
+  ethertype = data[12:14]
+
+  if ethertype == b'\x08\x06':
+    if data[14:20] != _ARP_REQUEST_HEAD[:6]:
+      return False
+    _learn(event, cache, data[28:32], data[22:28], now)
+    if data[20:22] != _ARP_REQUEST_HEAD[6:]:
+      return False
+    target = data[38:42]
+    entry = cache.lookup(target, now)
+    if entry is None or entry[1] == event.port:
+      return False
+    # Later requests for this target go straight to it (for ARP,
+    # nw_proto is the opcode and nw_dst the target address)
+    match = of.ofp_match(dl_type = pkt.ethernet.ARP_TYPE, nw_proto = 1,
+                         nw_dst = IPAddr(target))
+    actions = [of.ofp_action_output(port = entry[1])]
+
+  elif ethertype == b'\x08\x00' and len(data) >= 34:
+    _learn(event, cache, data[26:30], data[6:12], now)
+    if data[23:24] != b'\x01':
+      return False
+    target = data[30:34]
+    entry = cache.lookup(target, now)
+    if entry is None or entry[1] == event.port:
+      return False
+    # The sender may have our made-up MAC for the target, so make sure
+    # the target sees its own
+    match = of.ofp_match(dl_type = pkt.ethernet.IP_TYPE, nw_proto = 1,
+                         nw_dst = IPAddr(target))
+    actions = [of.ofp_action_dl_addr.set_dst(EthAddr(entry[0])),
+               of.ofp_action_output(port = entry[1])]
+
+  else:
+    return False
+
+  _offload_flow(event, match, actions)
+  msg = packet_out(event.dpid, event.ofp, actions = actions)
+  if msg is not None:
+    event.connection.send(msg)
+  hot.debug("Offloaded requests for %s to port %i", lazy(IPAddr, target),
+    entry[1])
+  return True
+
+def _handle_ConnectionDown (event):
+  caches.pop(event.dpid, None)
+
+
+def _send_reply (event, data):
+  _reply_msg.data = data
+  _reply_msg.in_port = event.port
+  event.connection.send(_reply_msg)
+
+
+def _fast_reply (event):
+  """
+  Answers ARP and echo requests from the raw packet. Returns False if
+  the packet needs the regular path.
+  """
+  data = event.ofp.data
+  if data is None or len(data) < 42:
+    return False
+  ethertype = data[12:14]
+
+  if ethertype == b'\x08\x06':
+    if data[14:22] != _ARP_REQUEST_HEAD:
+      return False
+    r = _arp_template
+    r[0:6] = data[6:12]           # to the requester
+    r[28:32] = data[38:42]        # the address that was asked for
+    r[32:38] = data[22:28]        # requester's MAC
+    r[38:42] = data[28:32]        # requester's IP
+    _send_reply(event, bytes(r))
+    hot.info("%s ARPed for %s", lazy(IPAddr, data[28:32]),
+      lazy(IPAddr, data[38:42]))
+    return True
+
+  if ethertype == b'\x08\x00':
+    raw = bytearray(data)
+    if raw[23] != 1:              # not ICMP
+      return False
+    ihl = (raw[14] & 0x0f) * 4
+    icmp = 14 + ihl
+    if len(raw) < icmp + 4 or raw[icmp] != pkt.TYPE_ECHO_REQUEST:
+      return False
+
+    # Swap MACs and IPs (the IP checksum does not change)
+    raw[0:6], raw[6:12] = raw[6:12], raw[0:6]
+    raw[26:30], raw[30:34] = raw[30:34], raw[26:30]
+
+    # Echo request -> reply. Update the ICMP checksum for the type
+    # change as in RFC 1624: HC' = ~(~HC + ~m + m')
+    old = (raw[icmp] << 8) | raw[icmp + 1]
+    raw[icmp] = pkt.TYPE_ECHO_REPLY
+    new = (raw[icmp] << 8) | raw[icmp + 1]
+    csum = struct.unpack_from('!H', raw, icmp + 2)[0]
+    s = (~csum & 0xffff) + (~old & 0xffff) + new
+    s = (s & 0xffff) + (s >> 16)
+    s = (s & 0xffff) + (s >> 16)
+    struct.pack_into('!H', raw, icmp + 2, ~s & 0xffff)
+
+    _send_reply(event, bytes(raw))
+    hot.debug("%s pinged %s", lazy(IPAddr, bytes(raw[30:34])),
+      lazy(IPAddr, bytes(raw[26:30])))
+    return True
+
+  return False
+
 
 def _handle_PacketIn (event):
+  if offload_hosts and _offload(event):
+    return
+  if fast_path and _fast_reply(event):
+    return
+
   packet = event.parsed
 
-  if packet.find("arp"):
+  a = packet.find("arp")
+  if a:
     # Reply to ARP
-    a = packet.find("arp")
     if a.opcode == a.REQUEST:
       r = pkt.arp()
       r.hwtype = a.hwtype
@@ -46,7 +278,7 @@ def _handle_PacketIn (event):
       r.hwdst = a.hwsrc
       r.protodst = a.protosrc
       r.protosrc = a.protodst
-      r.hwsrc = EthAddr("02:00:DE:AD:BE:EF")
+      r.hwsrc = ARP_REPLY_MAC
       e = pkt.ethernet(type=packet.type, src=r.hwsrc, dst=a.hwsrc)
       e.payload = r
 
@@ -58,19 +290,23 @@ def _handle_PacketIn (event):
 
       log.info("%s ARPed for %s", r.protodst, r.protosrc)
  
-  elif packet.find("icmp"):
+    return
+
+  ip = packet.find("ipv4")
+  icmp_in = packet.find("icmp")
+  if icmp_in:
     # Reply to pings
 
     # Make the ping reply
     icmp = pkt.icmp()
     icmp.type = pkt.TYPE_ECHO_REPLY
-    icmp.payload = packet.find("icmp").payload
+    icmp.payload = icmp_in.payload
 
     # Make the IP packet around it
     ipp = pkt.ipv4()
     ipp.protocol = ipp.ICMP_PROTOCOL
-    ipp.srcip = packet.find("ipv4").dstip
-    ipp.dstip = packet.find("ipv4").srcip
+    ipp.srcip = ip.dstip
+    ipp.dstip = ip.srcip
 
     # Ethernet around that...
     e = pkt.ethernet()
@@ -91,14 +327,20 @@ def _handle_PacketIn (event):
 
     log.debug("%s pinged %s", ipp.dstip, ipp.srcip)
 
-  elif packet.find("tcp"):
-    log.debug("tcp found: %s:%s to %s:%s", packet.find("ipv4").srcip, packet.find("tcp").srcport, packet.find("ipv4").dstip, packet.find("tcp").dstport)
+    return
+
+  l4 = packet.find("tcp") or packet.find("udp")
+  if l4:
+    hot.debug("%s found: %s:%s to %s:%s", l4.__class__.__name__,
+      ip.srcip, l4.srcport, ip.dstip, l4.dstport)
 
-  elif packet.find("udp"):
-    log.debug("udp found: %s:%s to %s:%s", packet.find("ipv4").srcip, packet.find("udp").srcport, packet.find("ipv4").dstip, packet.find("udp").dstport)
 
+def launch (fast = True, offload = False, arp_ttl = 60):
+  global fast_path, offload_hosts, arp_cache_ttl
+  fast_path = str_to_bool(fast)
+  offload_hosts = str_to_bool(offload)
+  arp_cache_ttl = int(arp_ttl)
 
-def launch ():
   import pox.log.color
   pox.log.color.launch()
   import pox.log
@@ -106,5 +348,6 @@ def launch ():
                         "@@@bold%(message)s@@@normal")
 
   core.openflow.addListenerByName("PacketIn", _handle_PacketIn)
+  core.openflow.addListenerByName("ConnectionDown", _handle_ConnectionDown)
 
   log.info("Pong component running.")
@@ -0,0 +1,238 @@
+#!/usr/bin/python
+# Copyright 2012 William Yu
+# wyu@ateneo.edu
+#
+# This file is part of POX.
+#
+# POX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# POX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with POX. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Longest-prefix match of IPv4 addresses.
+
+A PrefixTable is a multibit trie with a stride of 8 bits: one node per
+level, four levels at most, each with 256 slots. A prefix is stored in
+the node of the level its last bits fall in, and is expanded over all
+the slots it covers there; a slot keeps the longest prefix that covers
+it. A lookup therefore takes at most four list indexings, with the
+last match found on the way down being the longest, whatever the
+number of routes.
+
+  table = PrefixTable()
+  table.insert(ip_to_int('192.168.1.64'), 26, route)
+  prefix, length, route = table.lookup(ip_to_int('192.168.1.66'))
+
+Addresses and prefixes are 32-bit unsigned integers (IPAddr.toUnsigned()
+in POX). This module does not depend on POX; running it directly checks
+it against a linear search and prints a benchmark.
+"""
+
+import socket
+import struct
+import time
+
+def ip_to_int (ip):
+  return struct.unpack('!I', socket.inet_aton(ip))[0]
+
+def int_to_ip (n):
+  return socket.inet_ntoa(struct.pack('!I', n))
+
+def prefix_mask (length):
+  return (0xffffffff << (32 - length)) & 0xffffffff
+
+
+class _Node (object):
+  __slots__ = ('slots', 'children', 'prefixes')
+
+  def __init__ (self):
+    # byte -> (length, prefix, value) of the longest prefix covering it
+    self.slots = [None] * 256
+    # byte -> _Node of the next level
+    self.children = {}
+    # (prefix, length) -> value of the prefixes stored in this node
+    self.prefixes = {}
+
+
+class PrefixTable (object):
+  """
+  IPv4 routes by prefix, looked up by longest match.
+  """
+  def __init__ (self):
+    self._root = _Node()
+    self._default = None      # (0, 0, value) for 0.0.0.0/0
+    self._count = 0
+
+  def __len__ (self):
+    return self._count
+
+  def _home (self, prefix, length, create):
+    """
+    Returns (node, first slot, number of slots) of a prefix, or None.
+    """
+    level = (length - 1) // 8
+    node = self._root
+    for shift in (24, 16, 8)[:level]:
+      b = (prefix >> shift) & 0xff
+      child = node.children.get(b)
+      if child is None:
+        if not create:
+          return None
+        child = node.children[b] = _Node()
+      node = child
+    first = (prefix >> (24 - 8 * level)) & 0xff
+    return node, first, 1 << (8 * (level + 1) - length)
+
+  def insert (self, prefix, length, value):
+    """
+    Adds (or replaces) the route of prefix/length.
+    """
+    prefix &= prefix_mask(length)
+    if length == 0:
+      if self._default is None:
+        self._count += 1
+      self._default = (0, 0, value)
+      return
+    node, first, span = self._home(prefix, length, True)
+    if (prefix, length) not in node.prefixes:
+      self._count += 1
+    node.prefixes[(prefix, length)] = value
+    entry = (length, prefix, value)
+    slots = node.slots
+    for i in range(first, first + span):
+      s = slots[i]
+      if s is None or s[0] <= length:
+        slots[i] = entry
+
+  def remove (self, prefix, length):
+    """
+    Removes the route of prefix/length. Returns False if there was none.
+    """
+    prefix &= prefix_mask(length)
+    if length == 0:
+      if self._default is None:
+        return False
+      self._default = None
+      self._count -= 1
+      return True
+    home = self._home(prefix, length, False)
+    if home is None:
+      return False
+    node, first, span = home
+    if node.prefixes.pop((prefix, length), None) is None:
+      return False
+    self._count -= 1
+
+    # The slots it had go back to the longest shorter prefix of the same
+    # node that covers it (longer ones inside it kept their own slots)
+    replacement = None
+    for l in range(length - 1, 8 * ((length - 1) // 8), -1):
+      p = prefix & prefix_mask(l)
+      if (p, l) in node.prefixes:
+        replacement = (l, p, node.prefixes[(p, l)])
+        break
+    slots = node.slots
+    for i in range(first, first + span):
+      s = slots[i]
+      if s is not None and s[0] == length and s[1] == prefix:
+        slots[i] = replacement
+    return True
+
+  def get (self, prefix, length):
+    """
+    Returns the value of exactly prefix/length (None if there is none).
+    """
+    prefix &= prefix_mask(length)
+    if length == 0:
+      return None if self._default is None else self._default[2]
+    home = self._home(prefix, length, False)
+    if home is None:
+      return None
+    return home[0].prefixes.get((prefix, length))
+
+  def lookup (self, addr):
+    """
+    Returns (length, prefix, value) of the longest prefix that matches
+    'addr', or None.
+    """
+    best = self._default
+    node = self._root
+    for shift in (24, 16, 8, 0):
+      b = (addr >> shift) & 0xff
+      s = node.slots[b]
+      if s is not None:
+        best = s
+      node = node.children.get(b)
+      if node is None:
+        break
+    return best
+
+  def routes (self):
+    """
+    Returns [(prefix, length, value)] of all the routes.
+    """
+    result = []
+    if self._default is not None:
+      result.append((0, 0, self._default[2]))
+    todo = [self._root]
+    while todo:
+      node = todo.pop()
+      result.extend((p, l, v) for (p, l), v in node.prefixes.items())
+      todo.extend(node.children.values())
+    return result
+
+
+def _benchmark (routes = 200000, lookups = 200000):
+  import random
+  random.seed(1)
+  table = PrefixTable()
+  lengths = [8, 12, 16, 20, 22, 24, 24, 24, 24, 26, 28, 32]
+  start = time.time()
+  while len(table) < routes:
+    length = random.choice(lengths)
+    table.insert(random.getrandbits(32), length, length)
+  build = time.time() - start
+
+  # Check against a linear search on a small table, with removals
+  small = PrefixTable()
+  entries = {}
+  for _ in range(2000):
+    length = random.randint(0, 32)
+    prefix = random.getrandbits(32) & prefix_mask(length)
+    if random.random() < 0.3 and entries:
+      p, l = random.choice(list(entries))
+      assert small.remove(p, l)
+      del entries[(p, l)]
+    small.insert(prefix, length, (prefix, length))
+    entries[(prefix, length)] = True
+  for _ in range(20000):
+    addr = random.getrandbits(32)
+    if random.random() < 0.5:
+      p, l = random.choice(list(entries))
+      addr = p | (addr & ~prefix_mask(l) & 0xffffffff)
+    want = max([(l, p) for p, l in entries
+                if addr & prefix_mask(l) == p] or [None])
+    got = small.lookup(addr)
+    assert (got and got[:2]) == want, (int_to_ip(addr), got, want)
+
+  addrs = [random.getrandbits(32) for _ in range(lookups)]
+  lookup = table.lookup
+  start = time.time()
+  for a in addrs:
+    lookup(a)
+  elapsed = time.time() - start
+  print("%i routes inserted in %.2f s, lookup %.2f us" %
+    (len(table), build, elapsed / lookups * 1e6))
+
+
+if __name__ == '__main__':
+  _benchmark()
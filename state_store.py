@@ -0,0 +1,253 @@
+#!/usr/bin/python
+# Copyright 2012 William Yu
+# wyu@ateneo.edu
+#
+# This file is part of POX.
+#
+# POX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# POX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with POX. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Persistent learned state.
+
+A StateStore holds key/value pairs (both raw bytes) per namespace and
+datapath ID, e.g. the MAC-to-port table a switch component learned for
+each switch. Changes are appended to a log; every 'compact_after' log
+records, the whole state is written out as a snapshot and the log is
+started over. Both files are memory-mapped and replayed on load (a
+record cut short by a crash is dropped), so a restarted controller gets
+back everything it had learned.
+
+  store = StateStore('/var/tmp/pox.state')
+  store.put('of_sw_tutorial', dpid, mac.toRaw(), pack_port(port))
+  store.flush()                  # write out the pending log records
+  for mac, port in store.get('of_sw_tutorial', dpid).items(): ...
+
+put() ignores values that did not change, so components can call it for
+every packet they learn from. Writes are buffered until flush().
+add_listener() lets another component see every change (this is how
+samples.state_sync replicates the store to other controllers).
+
+Loaded as a component, it registers the store as core.state_store and
+flushes it every --flush_interval seconds:
+  ./pox.py samples.state_store --path=/var/tmp/pox.state samples.of_sw_tutorial
+Components warm-start from it on ConnectionUp if it is loaded.
+
+The StateStore class does not depend on POX.
+"""
+
+import mmap
+import os
+import struct
+
+_SNAP_MAGIC = b'PXSS1'
+_LOG_MAGIC = b'PXSL1'
+
+_PUT = 1
+_DELETE = 2
+
+# op, dpid, namespace length, key length, value length
+_header = struct.Struct('!BQHHI')
+
+_port = struct.Struct('!H')
+
+def pack_port (port):
+  return _port.pack(port)
+
+def unpack_port (data):
+  return _port.unpack(data)[0]
+
+
+def _record (op, ns, dpid, key, value = b''):
+  return _header.pack(op, dpid, len(ns), len(key), len(value)) + ns + \
+    key + value
+
+
+class StateStore (object):
+  """
+  Key/value state per (namespace, dpid), kept as a snapshot plus an
+  append-only log.
+  """
+  def __init__ (self, path, compact_after = 100000):
+    self.path = path
+    self.compact_after = compact_after
+    # (namespace, dpid) -> {key: value}
+    self.data = {}
+    self._pending = []
+    self._log_records = 0
+    self._listeners = []
+
+    self._load(path + '.snap', _SNAP_MAGIC)
+    good = self._load(path + '.log', _LOG_MAGIC)
+    if good is None:
+      self._log = open(path + '.log', 'wb')
+      self._log.write(_LOG_MAGIC)
+      self._log.flush()
+    else:
+      self._log = open(path + '.log', 'r+b')
+      # Drop a record cut short by a crash
+      self._log.truncate(good)
+      self._log.seek(good)
+
+  def __len__ (self):
+    return sum(len(d) for d in self.data.values())
+
+  def _load (self, path, magic):
+    """
+    Replays a snapshot or log file. Returns the offset after its last
+    complete record, or None if there is no such file.
+    """
+    if not os.path.exists(path):
+      return None
+    f = open(path, 'rb')
+    try:
+      size = os.fstat(f.fileno()).st_size
+      if size < len(magic):
+        return None
+      m = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+      try:
+        if m[:len(magic)] != magic:
+          raise ValueError("%s is not a state file" % (path,))
+        off = len(magic)
+        hsize = _header.size
+        unpack = _header.unpack_from
+        while off + hsize <= size:
+          op, dpid, nlen, klen, vlen = unpack(m, off)
+          end = off + hsize + nlen + klen + vlen
+          if end > size:
+            break
+          p = off + hsize
+          ns = m[p:p+nlen].decode('utf-8')
+          key = m[p+nlen:p+nlen+klen]
+          if op == _PUT:
+            d = self.data.get((ns, dpid))
+            if d is None:
+              d = self.data[(ns, dpid)] = {}
+            d[key] = m[p+nlen+klen:end]
+          else:
+            d = self.data.get((ns, dpid))
+            if d is not None:
+              d.pop(key, None)
+          if magic == _LOG_MAGIC:
+            self._log_records += 1
+          off = end
+        return off
+      finally:
+        m.close()
+    finally:
+      f.close()
+
+  def add_listener (self, listener):
+    """
+    Calls listener(ns, dpid, key, value) after every change made with
+    put() or delete() (value is None for a delete).
+    """
+    self._listeners.append(listener)
+
+  def get (self, ns, dpid):
+    """
+    Returns the {key: value} dict of a namespace and dpid (empty if
+    there is nothing). Do not modify it; use put() and delete().
+    """
+    return self.data.get((ns, dpid), {})
+
+  def dpids (self, ns):
+    return [dpid for n, dpid in self.data if n == ns]
+
+  def put (self, ns, dpid, key, value):
+    """
+    Sets a value. Returns False if it was already set to that.
+    """
+    d = self.data.get((ns, dpid))
+    if d is None:
+      d = self.data[(ns, dpid)] = {}
+    elif d.get(key) == value:
+      return False
+    d[key] = value
+    self._pending.append(_record(_PUT, ns.encode('utf-8'), dpid, key,
+                                 value))
+    for listener in self._listeners:
+      listener(ns, dpid, key, value)
+    return True
+
+  def delete (self, ns, dpid, key):
+    d = self.data.get((ns, dpid))
+    if d is None or key not in d:
+      return False
+    del d[key]
+    self._pending.append(_record(_DELETE, ns.encode('utf-8'), dpid, key))
+    for listener in self._listeners:
+      listener(ns, dpid, key, None)
+    return True
+
+  def clear (self, ns, dpid):
+    for key in list(self.get(ns, dpid)):
+      self.delete(ns, dpid, key)
+
+  def flush (self):
+    """
+    Appends the pending records to the log in one write, and compacts
+    once the log has grown long enough.
+    """
+    if not self._pending:
+      return
+    self._log.write(b''.join(self._pending))
+    self._log.flush()
+    self._log_records += len(self._pending)
+    self._pending = []
+    if self._log_records >= self.compact_after:
+      self.compact()
+
+  def compact (self):
+    """
+    Writes the whole state as a snapshot (atomically, via a temporary
+    file) and starts a new log.
+    """
+    self._log.write(b''.join(self._pending))
+    self._pending = []
+    tmp = self.path + '.snap.tmp'
+    f = open(tmp, 'wb')
+    try:
+      f.write(_SNAP_MAGIC)
+      for (ns, dpid), d in self.data.items():
+        n = ns.encode('utf-8')
+        f.write(b''.join(_record(_PUT, n, dpid, k, v)
+                         for k, v in d.items()))
+      f.flush()
+      os.fsync(f.fileno())
+    finally:
+      f.close()
+    os.rename(tmp, self.path + '.snap')
+    # Replaying the old log over the new snapshot would do no harm, so
+    # a crash before this point loses nothing.
+    self._log.seek(0)
+    self._log.truncate()
+    self._log.write(_LOG_MAGIC)
+    self._log.flush()
+    self._log_records = 0
+
+  def close (self):
+    self.flush()
+    self._log.close()
+
+
+def launch (path = 'pox.state', flush_interval = 1, compact_after = 100000):
+  from pox.core import core
+  from pox.lib.recoco import Timer
+  log = core.getLogger()
+
+  store = StateStore(path, int(compact_after))
+  log.info("Loaded %i entries from %s", len(store), path)
+  core.register("state_store", store)
+  Timer(float(flush_interval), store.flush, recurring = True)
+  core.addListenerByName("GoingDownEvent", lambda event: store.close())
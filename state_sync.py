@@ -0,0 +1,555 @@
+#!/usr/bin/python
+# Copyright 2012 William Yu
+# wyu@ateneo.edu
+#
+# This file is part of POX.
+#
+# POX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# POX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with POX. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+State sharing between controllers.
+
+Replicates the samples.state_store of a controller to other controllers
+over TCP, e.g. for the two controllers of of_double_controller.py. The
+switch components keep their MAC locations in the store and the
+firewall keeps its rules there, so each controller gets to know the
+hosts and rules of the other's switches.
+
+Every change to the store gets a version: a Lamport clock and the ID of
+the controller that made it. Changes are sent to the peers in batches
+every --interval seconds, and a peer applies a change only if its
+version is newer than the one it has for that key, so all controllers
+end up with the same state whatever order the changes arrive in. A
+controller that connects gets the whole state (deletes included) first.
+
+To forward between domains, each controller sends a probe out of every
+port of its switches every --probe_interval seconds. A probe that
+arrives at a switch of another controller tells it which of its ports
+leads to which switch of the other domain. A packet to a MAC that is
+not known on the local switch, but that the other controller has
+learned behind one of those neighbouring switches, then gets a flow out
+of that port instead of being flooded. Only switches directly linked to
+ours are looked at. When samples.of_firewall is loaded, this shortcut is
+not taken, so that every packet still goes through the firewall rules.
+
+  ./pox.py samples.state_store --path=/tmp/c0 samples.state_sync
+      --listen=6700 samples.of_sw_tutorial_oo openflow.of_01 --port=6633
+  ./pox.py samples.state_store --path=/tmp/c1 samples.state_sync
+      --peers=127.0.0.1:6700 samples.of_sw_tutorial_oo
+      openflow.of_01 --port=6644
+
+The SyncNode class does not depend on POX. Running this module directly
+replicates between two local processes and checks that they agree.
+"""
+
+import os
+import socket
+import struct
+import threading
+import time
+
+try:
+  from Queue import Queue, Empty
+except ImportError:
+  from queue import Queue, Empty
+
+_MAGIC = b'PXSY1'
+
+# magic, payload length
+_frame = struct.Struct('!5sI')
+
+_PUT = 1
+_DELETE = 2
+
+# op, dpid, clock, node ID, namespace length, key length, value length
+_header = struct.Struct('!BQQIHHI')
+
+# Seconds between attempts to connect to a peer
+RETRY_INTERVAL = 2
+
+
+def encode_record (ns, dpid, key, value, version):
+  """
+  Packs a change (value None for a delete) with its (clock, node ID).
+  """
+  n = ns.encode('utf-8')
+  if value is None:
+    op = _DELETE
+    value = b''
+  else:
+    op = _PUT
+  return _header.pack(op, dpid, version[0], version[1], len(n), len(key),
+                      len(value)) + n + key + value
+
+def decode_records (data):
+  """
+  Returns [(ns, dpid, key, value or None, version)] of a batch.
+  """
+  records = []
+  off = 0
+  size = len(data)
+  while off < size:
+    op, dpid, clock, node, nlen, klen, vlen = _header.unpack_from(data, off)
+    p = off + _header.size
+    end = p + nlen + klen + vlen
+    if end > size:
+      raise ValueError("Truncated record")
+    ns = data[p:p+nlen].decode('utf-8')
+    key = bytes(data[p+nlen:p+nlen+klen])
+    value = bytes(data[p+nlen+klen:end]) if op == _PUT else None
+    records.append((ns, dpid, key, value, (clock, node)))
+    off = end
+  return records
+
+def _recv_exact (sock, n):
+  data = b''
+  while len(data) < n:
+    chunk = sock.recv(n - len(data))
+    if not chunk:
+      raise socket.error("Connection closed")
+    data += chunk
+  return data
+
+def _start_thread (target, *args):
+  t = threading.Thread(target = target, args = args)
+  t.daemon = True
+  t.start()
+  return t
+
+
+class SyncNode (object):
+  """
+  Replicates a StateStore to and from peers.
+
+  Sockets are read by threads; what they receive is handed to 'defer'
+  (e.g. core.callLater) so that the store is only ever changed from one
+  thread. Without it, calls are queued until poll().
+  """
+  def __init__ (self, store, node_id, defer = None):
+    self.store = store
+    self.node_id = node_id
+    self.clock = 0
+    # (ns, dpid, key) -> (clock, node ID) of its last change
+    self.versions = {}
+
+    self._pending = []
+    self._peers = []
+    self._applying = False
+    self._closed = False
+    self._server = None
+    self._calls = Queue()
+    self._defer = defer or (lambda f, *args: self._calls.put((f, args)))
+
+    # Records sent / received / applied
+    self.sent = 0
+    self.received = 0
+    self.applied = 0
+
+    store.add_listener(self._store_changed)
+
+  def _version (self, k):
+    return self.versions.get(k, (0, self.node_id))
+
+  def _store_changed (self, ns, dpid, key, value):
+    if self._applying:
+      return
+    self.clock += 1
+    version = (self.clock, self.node_id)
+    self.versions[(ns, dpid, key)] = version
+    self._pending.append(encode_record(ns, dpid, key, value, version))
+
+  def flush (self):
+    """
+    Sends the changes made since the last flush to all peers, in one
+    batch.
+    """
+    pending = self._pending
+    self._pending = []
+    if pending and self._peers:
+      payload = b''.join(pending)
+      for sock in list(self._peers):
+        self._send(sock, payload)
+      self.sent += len(pending)
+
+  def full_state (self):
+    records = []
+    for (ns, dpid), d in list(self.store.data.items()):
+      for key, value in d.items():
+        records.append(encode_record(ns, dpid, key, value,
+                                     self._version((ns, dpid, key))))
+    for (ns, dpid, key), version in self.versions.items():
+      if key not in self.store.get(ns, dpid):
+        records.append(encode_record(ns, dpid, key, None, version))
+    return b''.join(records)
+
+  def apply (self, records):
+    """
+    Applies the changes of a peer that are newer than ours.
+    """
+    self.received += len(records)
+    for ns, dpid, key, value, version in records:
+      if version[0] > self.clock:
+        self.clock = version[0]
+      k = (ns, dpid, key)
+      if k in self.versions or key in self.store.get(ns, dpid):
+        if self._version(k) >= version:
+          continue
+      self.versions[k] = version
+      self._applying = True
+      try:
+        if value is None:
+          self.store.delete(ns, dpid, key)
+        else:
+          self.store.put(ns, dpid, key, value)
+      finally:
+        self._applying = False
+      self.applied += 1
+
+  def poll (self):
+    """
+    Runs the calls queued by the socket threads (when no 'defer' was
+    given).
+    """
+    while True:
+      try:
+        f, args = self._calls.get_nowait()
+      except Empty:
+        return
+      f(*args)
+
+  def listen (self, port, address = '127.0.0.1'):
+    self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    self._server.bind((address, port))
+    self._server.listen(5)
+    _start_thread(self._accept_loop)
+    return self._server.getsockname()[1]
+
+  def connect (self, address, port):
+    _start_thread(self._connect_loop, address, port)
+
+  def close (self):
+    self._closed = True
+    if self._server is not None:
+      self._server.close()
+    for sock in list(self._peers):
+      sock.close()
+    self._peers = []
+
+  def _accept_loop (self):
+    while not self._closed:
+      try:
+        sock, _ = self._server.accept()
+      except socket.error:
+        return
+      _start_thread(self._serve, sock)
+
+  def _connect_loop (self, address, port):
+    while not self._closed:
+      try:
+        sock = socket.create_connection((address, port))
+      except socket.error:
+        time.sleep(RETRY_INTERVAL)
+        continue
+      self._serve(sock)
+      time.sleep(RETRY_INTERVAL)
+
+  def _serve (self, sock):
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    self._defer(self._add_peer, sock)
+    try:
+      while not self._closed:
+        magic, length = _frame.unpack(_recv_exact(sock, _frame.size))
+        if magic != _MAGIC:
+          raise ValueError("Not a state sync peer")
+        records = decode_records(_recv_exact(sock, length))
+        self._defer(self.apply, records)
+    except (socket.error, ValueError, struct.error):
+      pass
+    self._defer(self._remove_peer, sock)
+
+  def _add_peer (self, sock):
+    self._peers.append(sock)
+    self._send(sock, self.full_state())
+
+  def _remove_peer (self, sock):
+    if sock in self._peers:
+      self._peers.remove(sock)
+    sock.close()
+
+  def _send (self, sock, payload):
+    try:
+      sock.sendall(_frame.pack(_MAGIC, len(payload)) + payload)
+    except socket.error:
+      self._remove_peer(sock)
+
+
+# Everything below is for running within POX
+
+# Namespaces of the store that hold MAC -> port tables
+MAC_NAMESPACES = ('of_sw_tutorial', 'of_sw_tutorial_oo', 'of_switch_flow')
+
+# Probes are sent to the LLDP multicast address (which bridges do not
+# forward) with a local experimental ethertype.
+PROBE_DST = b'\x01\x80\xc2\x00\x00\x0e'
+PROBE_TYPE = 0x88b5
+
+# node ID, dpid, port
+_probe = struct.Struct('!IQH')
+
+FLOW_IDLE_TIMEOUT = 10
+FLOW_HARD_TIMEOUT = 30
+
+
+class StateSync (object):
+  """
+  Forwards packets to hosts in the domain of another controller.
+  """
+  def __init__ (self, node, probe_interval = 5):
+    from pox.core import core
+    from pox.lib.recoco import Timer
+    from flow_owner import FlowOwner, COOKIE_STATE_SYNC
+
+    self.node = node
+    self.probe_interval = probe_interval
+    # our dpid -> {dpid of the other domain: (our port, probed at)}
+    self.borders = {}
+    # (dpid, port) of the other domains that lead to our switches ->
+    # (our dpid, probed at)
+    self.foreign_ports = {}
+    self.owner = FlowOwner(COOKIE_STATE_SYNC)
+
+    # Before the switch components see the packets
+    core.openflow.addListenerByName("PacketIn", self._handle_PacketIn,
+      priority = 10)
+    core.openflow.addListenerByName("ConnectionDown",
+      self._handle_ConnectionDown)
+    Timer(probe_interval, self.send_probes, recurring = True)
+
+  def _expire (self):
+    """
+    Drops the borders and foreign ports not probed for a while.
+    """
+    limit = time.time() - 3 * self.probe_interval
+    for dpid, border in list(self.borders.items()):
+      for peer, (_, probed) in list(border.items()):
+        if probed < limit:
+          del border[peer]
+      if not border:
+        del self.borders[dpid]
+    for key, (_, probed) in list(self.foreign_ports.items()):
+      if probed < limit:
+        del self.foreign_ports[key]
+
+  def send_probes (self):
+    from pox.core import core
+    import pox.openflow.libopenflow_01 as of
+    self._expire()
+    for connection in list(core.openflow.connections):
+      for p in connection.features.ports:
+        if p.port_no >= of.OFPP_MAX:
+          continue
+        msg = of.ofp_packet_out(in_port = of.OFPP_NONE)
+        msg.data = PROBE_DST + p.hw_addr.toRaw() + \
+          struct.pack('!H', PROBE_TYPE) + \
+          _probe.pack(self.node.node_id, connection.dpid, p.port_no)
+        msg.actions.append(of.ofp_action_output(port = p.port_no))
+        connection.send(msg)
+
+  def _handle_probe (self, event):
+    from pox.core import core
+    from pox.lib.util import dpidToStr
+    data = event.ofp.data
+    if data is None or len(data) < 14 + _probe.size:
+      return
+    node_id, dpid, port = _probe.unpack_from(data, 14)
+    if node_id == self.node.node_id:
+      # A link between two of our own switches
+      return
+    border = self.borders.setdefault(event.dpid, {})
+    if dpid not in border:
+      core.getLogger().info("%s.%i leads to %s.%i (controller %i)",
+        dpidToStr(event.dpid), event.port, dpidToStr(dpid), port, node_id)
+    now = time.time()
+    border[dpid] = (event.port, now)
+    self.foreign_ports[(dpid, port)] = (event.dpid, now)
+
+  def lookup (self, dpid, mac):
+    """
+    Returns the port of switch 'dpid' that leads to 'mac' in another
+    domain, or None if it is unknown (or known locally).
+    """
+    from state_store import unpack_port
+    border = self.borders.get(dpid)
+    if not border:
+      return None
+    store = self.node.store
+    for ns in MAC_NAMESPACES:
+      if mac in store.get(ns, dpid):
+        return None
+    now = time.time()
+    for peer, (port, probed) in border.items():
+      if now - probed > 3 * self.probe_interval:
+        continue
+      for ns in MAC_NAMESPACES:
+        p = store.get(ns, peer).get(mac)
+        # Skip where the other controller just learned it from us
+        if p is not None and (peer, unpack_port(p)) not in \
+           self.foreign_ports:
+          return port
+    return None
+
+  def _handle_PacketIn (self, event):
+    from pox.core import core
+    from pox.lib.revent import EventHalt
+    import pox.openflow.libopenflow_01 as of
+    from packet_out import packet_out
+
+    packet = event.parsed
+    if packet.type == PROBE_TYPE:
+      self._handle_probe(event)
+      return EventHalt
+    if not packet.parsed or packet.dst.is_multicast:
+      return
+    if core.components.get('of_firewall') is not None:
+      # A dl_dst flow would let past what the rules deny
+      return
+    port = self.lookup(event.dpid, packet.dst.toRaw())
+    if port is None or port == event.port:
+      return
+
+    msg = of.ofp_flow_mod()
+    msg.match.dl_dst = packet.dst
+    msg.idle_timeout = FLOW_IDLE_TIMEOUT
+    msg.hard_timeout = FLOW_HARD_TIMEOUT
+    msg.actions.append(of.ofp_action_output(port = port))
+    if not self.owner.duplicate(event.connection, msg):
+      self.owner.send(event.connection, msg)
+    out = packet_out(event.dpid, event.ofp, port)
+    if out is not None:
+      event.connection.send(out)
+    return EventHalt
+
+  def _handle_ConnectionDown (self, event):
+    self.borders.pop(event.dpid, None)
+    for key, (dpid, _) in list(self.foreign_ports.items()):
+      if dpid == event.dpid:
+        del self.foreign_ports[key]
+
+  def show (self):
+    from pox.core import core
+    from pox.lib.util import dpidToStr
+    log = core.getLogger()
+    log.info("Node %i: %i peer(s), clock %i, %i sent, %i received, "
+      "%i applied", self.node.node_id, len(self.node._peers),
+      self.node.clock, self.node.sent, self.node.received,
+      self.node.applied)
+    for dpid, border in self.borders.items():
+      for peer, (port, _) in border.items():
+        log.info("%s.%i -> %s", dpidToStr(dpid), port, dpidToStr(peer))
+
+
+def launch (listen = None, peers = '', node_id = None, interval = 0.5,
+            probe_interval = 5):
+  from pox.core import core
+  from pox.lib.recoco import Timer
+  log = core.getLogger()
+
+  def start ():
+    node = SyncNode(core.state_store,
+      int(node_id) if node_id is not None else os.getpid(),
+      defer = core.callLater)
+    if listen is not None:
+      node.listen(int(listen))
+    for peer in peers.split(','):
+      if peer:
+        address, port = peer.rsplit(':', 1)
+        node.connect(address, int(port))
+    Timer(float(interval), node.flush, recurring = True)
+    core.register("state_sync", StateSync(node, float(probe_interval)))
+    core.addListenerByName("GoingDownEvent", lambda event: node.close())
+    log.info("Sharing state as node %i", node.node_id)
+  core.call_when_ready(start, ["openflow", "state_store"])
+
+
+def _node_process (path, node_id, listen, peer, puts, results):
+  """
+  One controller of _selftest(): makes its changes, then reports its
+  state once it has been quiet for a while.
+  """
+  from state_store import StateStore
+  store = StateStore(path)
+  node = SyncNode(store, node_id)
+  port = None
+  if listen is not None:
+    port = node.listen(listen)
+    results.put(('port', port))
+  if peer is not None:
+    node.connect('127.0.0.1', peer)
+  deadline = time.time() + 3
+  while time.time() < deadline:
+    if puts:
+      ns, dpid, key, value = puts.pop(0)
+      if value is None:
+        store.delete(ns, dpid, key)
+      else:
+        store.put(ns, dpid, key, value)
+    node.poll()
+    node.flush()
+    time.sleep(0.01)
+  state = sorted((ns, dpid, key, value)
+                 for (ns, dpid), d in store.data.items()
+                 for key, value in d.items())
+  results.put((node_id, state, node.sent, node.applied))
+  node.close()
+  store.close()
+
+def _selftest ():
+  import multiprocessing
+  import shutil
+  import tempfile
+  tmp = tempfile.mkdtemp()
+  try:
+    results = multiprocessing.Queue()
+    a_puts = [('of_sw_tutorial', 1, b'mac-a%i' % (i,), b'\x00\x01')
+              for i in range(50)]
+    a_puts += [('of_firewall', 1, b'rule', b'allow'),
+               ('of_sw_tutorial', 1, b'both', b'\x00\x01')]
+    b_puts = [('of_sw_tutorial', 2, b'mac-b%i' % (i,), b'\x00\x02')
+              for i in range(50)]
+    b_puts += [('of_sw_tutorial', 1, b'both', b'\x00\x03'),
+               ('of_sw_tutorial', 2, b'mac-b0', None)]
+    a = multiprocessing.Process(target = _node_process,
+      args = (os.path.join(tmp, 'a'), 1, 0, None, a_puts, results))
+    a.start()
+    _, port = results.get(timeout = 10)
+    b = multiprocessing.Process(target = _node_process,
+      args = (os.path.join(tmp, 'b'), 2, None, port, b_puts, results))
+    b.start()
+    reports = [results.get(timeout = 20) for _ in range(2)]
+    a.join()
+    b.join()
+    (_, state_a, sent_a, applied_a), (_, state_b, sent_b, applied_b) = \
+      sorted(reports)
+    print("node 1: %i entries, sent %i, applied %i" %
+      (len(state_a), sent_a, applied_a))
+    print("node 2: %i entries, sent %i, applied %i" %
+      (len(state_b), sent_b, applied_b))
+    print("in sync" if state_a == state_b else "NOT IN SYNC")
+  finally:
+    shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+  _selftest()
@@ -0,0 +1,259 @@
+#!/usr/bin/python
+# Copyright 2012 William Yu
+# wyu@ateneo.edu
+#
+# This file is part of POX.
+#
+# POX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# POX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with POX. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Bounded in-memory time series for collected statistics.
+
+Every series is kept at several resolutions (by default 5s for an hour,
+1m for a day and 10m for a week). Each resolution is a ring of float32
+values with one slot per step, so memory is fixed per series no matter
+how long the controller runs; missing samples are stored as NaN. The
+coarser resolutions hold the mean of the samples that fell in each of
+their steps.
+
+Series are identified by tuples such as (dpid, 'port', 1, 'rx_bps').
+A TimeSeriesStore can be saved to and loaded from a compact binary file.
+
+  store = TimeSeriesStore()
+  store.add((dpid, 'class', 'web', 'bps'), time.time(), 1234.0)
+  store.query((dpid, 'class', 'web', 'bps'), start = time.time() - 600)
+  store.save('/tmp/stats.ts')
+"""
+
+import math
+import os
+import struct
+from array import array
+
+# (step in seconds, number of steps kept)
+DEFAULT_TIERS = ((5, 720), (60, 1440), (600, 1008))
+
+_NAN = float('nan')
+_MAGIC = b'PXTS1'
+
+def _to_bytes (a):
+  return a.tobytes() if hasattr(a, 'tobytes') else a.tostring()
+
+def _from_bytes (a, data):
+  if hasattr(a, 'frombytes'):
+    a.frombytes(data)
+  else:
+    a.fromstring(data)
+
+
+class RingSeries (object):
+  """
+  Fixed-size ring of values, one per 'step' seconds.
+  """
+  def __init__ (self, step, capacity):
+    self.step = step
+    self.capacity = capacity
+    self.values = array('f', [_NAN]) * capacity
+    self.last_slot = None       # slot number (time // step) of the newest
+    self.head = 0               # index of the newest value
+
+  def add (self, t, value):
+    slot = int(t // self.step)
+    if self.last_slot is None:
+      self.last_slot = slot
+    elif slot < self.last_slot:
+      # Too old to store
+      return
+    elif slot > self.last_slot:
+      # Blank out the steps we have no samples for
+      skip = min(slot - self.last_slot, self.capacity)
+      for _ in range(skip):
+        self.head = (self.head + 1) % self.capacity
+        self.values[self.head] = _NAN
+      self.last_slot = slot
+    self.values[self.head] = value
+
+  def first_time (self):
+    if self.last_slot is None:
+      return None
+    return (self.last_slot - self.capacity + 1) * self.step
+
+  def samples (self, start = None, end = None):
+    """
+    Returns (time, value) pairs between 'start' and 'end', oldest
+    first. Steps without a sample are left out.
+    """
+    if self.last_slot is None:
+      return []
+    result = []
+    cap = self.capacity
+    first = self.last_slot - cap + 1
+    for i in range(cap):
+      t = (first + i) * self.step
+      if start is not None and t < start: continue
+      if end is not None and t > end: break
+      v = self.values[(self.head + 1 + i) % cap]
+      if not math.isnan(v):
+        result.append((t, v))
+    return result
+
+  def ordered (self):
+    """
+    Returns the values as an array, oldest first.
+    """
+    h = self.head + 1
+    return self.values[h:] + self.values[:h]
+
+
+class TieredSeries (object):
+  """
+  A series kept at several resolutions.
+  """
+  def __init__ (self, tiers = DEFAULT_TIERS):
+    self.tiers = [RingSeries(step, capacity) for step, capacity in tiers]
+    # Sum of the samples in the current step of each coarser tier:
+    # [slot, sum, count]
+    self._acc = [[None, 0.0, 0] for _ in self.tiers[1:]]
+
+  def add (self, t, value):
+    self.tiers[0].add(t, value)
+    for tier, acc in zip(self.tiers[1:], self._acc):
+      slot = int(t // tier.step)
+      if acc[0] is not None and slot != acc[0]:
+        if slot < acc[0]:
+          continue
+        acc[1] = 0.0
+        acc[2] = 0
+      acc[0] = slot
+      acc[1] += value
+      acc[2] += 1
+      # The step holds the mean so far, which is final once it closes
+      tier.add(t, acc[1] / acc[2])
+
+  def query (self, start = None, end = None, step = None):
+    """
+    Returns (time, value) pairs. Uses the tier with the given 'step',
+    or else the finest tier that still goes back to 'start'.
+    """
+    if step is not None:
+      for tier in self.tiers:
+        if tier.step == step:
+          return tier.samples(start, end)
+      raise ValueError("No tier with step %s" % (step,))
+    for tier in self.tiers:
+      first = tier.first_time()
+      if start is None or first is None or first <= start:
+        return tier.samples(start, end)
+    return self.tiers[-1].samples(start, end)
+
+
+class TimeSeriesStore (object):
+  """
+  A set of TieredSeries keyed by tuples.
+  """
+  def __init__ (self, tiers = DEFAULT_TIERS):
+    self.tiers = tuple(tiers)
+    self.series = {}
+
+  def __len__ (self):
+    return len(self.series)
+
+  def add (self, key, t, value):
+    s = self.series.get(key)
+    if s is None:
+      s = self.series[key] = TieredSeries(self.tiers)
+    s.add(t, value)
+
+  def query (self, key, start = None, end = None, step = None):
+    s = self.series.get(key)
+    if s is None:
+      return []
+    return s.query(start, end, step)
+
+  def keys (self, prefix = ()):
+    """
+    Returns the keys that start with 'prefix'.
+    """
+    n = len(prefix)
+    return [k for k in self.series if k[:n] == prefix]
+
+  def remove (self, prefix):
+    for k in self.keys(prefix):
+      del self.series[k]
+
+  def save (self, path):
+    """
+    Writes all series to 'path' (atomically, via a temporary file).
+
+    Format: magic, tier count, then (step, capacity) per tier, series
+    count, and per series its key (repr, length prefixed) followed by
+    the newest slot number and the values of each tier, oldest first.
+    """
+    tmp = path + '.tmp'
+    f = open(tmp, 'wb')
+    try:
+      f.write(_MAGIC)
+      f.write(struct.pack('!I', len(self.tiers)))
+      for step, capacity in self.tiers:
+        f.write(struct.pack('!dI', step, capacity))
+      f.write(struct.pack('!I', len(self.series)))
+      for key, s in self.series.items():
+        k = repr(key).encode('utf-8')
+        f.write(struct.pack('!H', len(k)))
+        f.write(k)
+        for tier in s.tiers:
+          last = tier.last_slot if tier.last_slot is not None else -1
+          f.write(struct.pack('!q', last))
+          values = tier.ordered()
+          if struct.pack('=H', 1) != struct.pack('!H', 1):
+            values.byteswap()
+          f.write(_to_bytes(values))
+    finally:
+      f.close()
+    os.rename(tmp, path)
+
+  @classmethod
+  def load (cls, path):
+    import ast
+    f = open(path, 'rb')
+    try:
+      data = f.read()
+    finally:
+      f.close()
+    if data[:len(_MAGIC)] != _MAGIC:
+      raise ValueError("%s is not a time series file" % (path,))
+    off = len(_MAGIC)
+    ntiers, = struct.unpack_from('!I', data, off); off += 4
+    tiers = []
+    for _ in range(ntiers):
+      step, capacity = struct.unpack_from('!dI', data, off); off += 12
+      tiers.append((step, capacity))
+    store = cls(tiers)
+    nseries, = struct.unpack_from('!I', data, off); off += 4
+    for _ in range(nseries):
+      klen, = struct.unpack_from('!H', data, off); off += 2
+      key = ast.literal_eval(data[off:off+klen].decode('utf-8'))
+      off += klen
+      s = store.series[key] = TieredSeries(tiers)
+      for tier in s.tiers:
+        last, = struct.unpack_from('!q', data, off); off += 8
+        size = tier.capacity * 4
+        values = array('f')
+        _from_bytes(values, data[off:off+size]); off += size
+        if struct.pack('=H', 1) != struct.pack('!H', 1):
+          values.byteswap()
+        tier.values = values
+        tier.head = tier.capacity - 1
+        tier.last_slot = last if last >= 0 else None
+    return store